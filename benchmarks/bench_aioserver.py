@@ -0,0 +1,78 @@
+"""
+Load test of AsyncHessianServer: a server process is driven by an asyncio
+client keeping `connections` kept-alive connections busy, each making calls
+back to back. Reports requests per second and latency percentiles for a
+coroutine handler, a plain one (run in the executor) and a larger payload.
+
+    python benchmarks/bench_aioserver.py [connections] [seconds]
+"""
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mustaine.aioclient import AsyncHessianProxy
+from mustaine.aioserver import AsyncHessianServer
+
+
+class Service(object):
+    async def add(self, a, b):
+        return a + b
+
+    def multiply(self, a, b):
+        return a * b
+
+    async def echo(self, value):
+        return value
+
+def server(port):
+    async def main():
+        server = await AsyncHessianServer(Service(), max_pending=4096).serve('127.0.0.1', 0, backlog=4096)
+        port.put(server.sockets[0].getsockname()[1])
+        await server.serve_forever()
+
+    asyncio.run(main())
+
+async def load(url, connections, seconds, method, args):
+    proxy     = AsyncHessianProxy(url, pool_size=connections, max_connections=connections, timeout=None)
+    latencies = []
+    deadline  = time.monotonic() + seconds
+
+    async def worker():
+        call = getattr(proxy, method)
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            await call(*args)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.monotonic()
+    await asyncio.gather(*[worker() for _ in range(connections)])
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print("%-28s %8.0f req/s   p50 %7.2f ms   p99 %7.2f ms   (%d calls, %d connections)" % (
+        "%s%s" % (method, '' if len(repr(args)) > 40 else repr(args)),
+        len(latencies) / elapsed, percentile(0.5), percentile(0.99), len(latencies), proxy.pool_stats.misses))
+
+
+if __name__ == '__main__':
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    seconds     = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    port    = multiprocessing.Queue()
+    process = multiprocessing.Process(target=server, args=(port,), daemon=True)
+    process.start()
+    url = "http://127.0.0.1:%d/" % (port.get(),)
+
+    try:
+        asyncio.run(load(url, connections, seconds, 'add', (1, 2)))
+        asyncio.run(load(url, connections, seconds, 'multiply', (3, 4)))
+        asyncio.run(load(url, connections, seconds, 'echo', ([{'id': i, 'name': 'row %d' % (i,)} for i in range(100)],)))
+    finally:
+        process.terminate()
@@ -0,0 +1,45 @@
+"""
+Bytes on the wire versus CPU time with request and reply compression: the
+size of typical payloads under each content coding and level, the time
+taken to compress them, and the time to parse them while inflating.
+
+    python benchmarks/bench_compression.py
+"""
+from io import BytesIO
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mustaine.encoder import encode_object
+from mustaine.parser import Parser
+from mustaine.protocol import Object
+from mustaine._util import BufferedReader, InflatingReader, compress
+
+
+def reply(value):
+    return b'r\x01\x00' + encode_object(value) + b'z'
+
+def timed(f, number=3):
+    return min(timeit.repeat(f, number=number, repeat=3)) / number
+
+def bench(name, payload):
+    parser = Parser()
+    plain  = timed(lambda: parser.parse_stream(BufferedReader(BytesIO(payload))))
+    print("%-22s %10d bytes                         parse %8.1f ms" % (name, len(payload), plain * 1000))
+
+    for coding in ('gzip', 'deflate'):
+        for level in (1, 6, 9):
+            compressed = compress(payload, coding, level)
+            packing    = timed(lambda: compress(payload, coding, level))
+            parsing    = timed(lambda: parser.parse_stream(BufferedReader(InflatingReader(BytesIO(compressed)))))
+            print("  %-7s level %d   %10d bytes %5.1f%%   compress %8.1f ms   parse %8.1f ms" % (
+                coding, level, len(compressed), 100.0 * len(compressed) / len(payload), packing * 1000, parsing * 1000))
+
+
+if __name__ == '__main__':
+    bench('typed objects', reply([Object('com.example.Position', id=i, symbol='S%d' % (i % 500,), quantity=i * 10, price=i * 0.25)
+                                  for i in range(20000)]))
+    bench('maps of strings', reply([{'name': 'row %d' % (i,), 'status': 'active', 'tags': ['a', 'b']} for i in range(20000)]))
+    bench('random doubles', reply([(i * 7919 % 10007) / 10007.0 for i in range(100000)]))
@@ -0,0 +1,63 @@
+"""
+Encoding time of chunked strings and binaries at various sizes, of
+numeric vectors as lists and as arrays, and of small calls encoded in full
+and through a PreparedCall.
+
+    python benchmarks/bench_encoder.py
+"""
+from array import array
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mustaine.encoder import PreparedCall, encode_object
+from mustaine.protocol import Binary, Call
+
+
+def bench(name, value, version=1):
+    started = time.perf_counter()
+    encoded = encode_object(value, version=version)
+    elapsed = time.perf_counter() - started
+    print("%-22s %12d bytes %10.2f ms" % (name, len(encoded), elapsed * 1000))
+
+def bench_calls(version, overload, types):
+    args     = (42, 'quote')
+    headers  = {'trace': 'abc'} if version == 1 else None
+    prepared = PreparedCall('getPrice', headers=headers, overload=overload, types=types, version=version)
+
+    full  = min(timeit.repeat(lambda: encode_object(Call('getPrice', args, headers, overload=overload), version=version), number=100000, repeat=3))
+    fast  = min(timeit.repeat(lambda: prepared.encode(args), number=100000, repeat=3))
+    label = "call v%d%s" % (version, ' overloaded' if overload else '')
+    print("%-22s %10.2f us in full %8.2f us prepared" % (label, full * 10, fast * 10))
+
+
+if __name__ == '__main__':
+    for label, size in (('1 KB', 1 << 10), ('1 MB', 1 << 20), ('100 MB', 100 << 20)):
+        bench('str ascii ' + label, 'x' * size)
+        bench('str multi-byte ' + label, 'é' * (size // 2))
+        bench('bytes utf-8 ' + label, 'é'.encode('utf-8') * (size // 2))
+        bench('binary ' + label, Binary(b'\x00' * size))
+
+    doubles = [i * 0.37 for i in range(10 ** 6)]
+    ints    = list(range(10 ** 6))
+    for version in (1, 2):
+        suffix = ' v%d' % (version,)
+        bench('1M doubles list' + suffix, doubles, version)
+        bench('1M doubles array' + suffix, array('d', doubles), version)
+        bench('1M ints list' + suffix, ints, version)
+        bench('1M ints array' + suffix, array('i', ints), version)
+
+    try:
+        import numpy
+    except ImportError:
+        pass
+    else:
+        bench('1M doubles numpy', numpy.array(doubles))
+        bench('1M ints numpy', numpy.array(ints, dtype='int32'))
+
+    for version in (1, 2):
+        bench_calls(version, False, None)
+        bench_calls(version, True, ('long' if version == 1 else 'int', 'string'))
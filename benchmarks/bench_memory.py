@@ -0,0 +1,62 @@
+"""
+Memory held by a decoded list of typed objects, as Objects versus compact
+__slots__ objects (Parser(compact=True)), and by a list of maps with and
+without the parser's cache of shared keys.
+
+    python benchmarks/bench_memory.py
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mustaine.encoder import encode_object
+from mustaine.parser import Parser
+from mustaine.protocol import Object
+
+
+ENVELOPES = {1: (b'r\x01\x00', b'z'), 2: (b'H\x02\x00R', b'')}
+
+def objects(count=200000):
+    return [Object('com.example.Position', id=i, symbol='S%d' % (i % 500,), quantity=i * 10, price=i * 0.25, open=bool(i % 2))
+            for i in range(count)]
+
+def maps(count=200000):
+    return [{'id': i, 'account': 'A%d' % (i % 50,), 'currency': 'EUR', 'amount': i * 0.25, 'settled': bool(i % 2)}
+            for i in range(count)]
+
+def bench(label, version, payload, **options):
+    parser  = Parser(**options)
+    started = time.perf_counter()
+    parser.parse_string(payload)
+    elapsed = time.perf_counter() - started
+    gc.collect()
+
+    tracemalloc.start()
+    value = parser.parse_string(payload).value
+    held  = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print("%-10s Hessian %d.0   %8.1f MB held   %6.0f bytes per object   decode %8.1f ms" % (
+        label, version, held / 2.0**20, held / float(len(value)), elapsed * 1000))
+
+
+if __name__ == '__main__':
+    value = objects()
+    for version in (1, 2):
+        head, tail = ENVELOPES[version]
+        payload = head + encode_object(value, version=version) + tail
+
+        bench('Object', version, payload)
+        bench('compact', version, payload, compact=True)
+
+    value = maps()
+    for version in (1, 2):
+        head, tail = ENVELOPES[version]
+        payload = head + encode_object(value, version=version) + tail
+
+        bench('uncached', version, payload, cache_size=0)
+        bench('cached', version, payload)
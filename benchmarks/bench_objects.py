@@ -0,0 +1,58 @@
+"""
+Size and coding time of a list of typed Objects, written as Hessian 1.0 typed
+maps versus Hessian 2.0 class definitions, and of the same values as
+instances of a class registered with mustaine.schema.
+
+    python benchmarks/bench_objects.py
+"""
+import dataclasses
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mustaine.encoder import encode_object
+from mustaine.parser import Parser
+from mustaine.protocol import Object
+from mustaine.schema import register
+
+
+ENVELOPES = {1: (b'r\x01\x00', b'z'), 2: (b'H\x02\x00R', b'')}
+
+def objects(count=100000, factory=lambda **fields: Object('com.example.Position', **fields)):
+    return [factory(id=i, symbol='S%d' % (i % 500,), quantity=i * 10, price=i * 0.25, open=bool(i % 2))
+            for i in range(count)]
+
+def bench(label, version, value):
+    head, tail = ENVELOPES[version]
+
+    started = time.perf_counter()
+    encoded = head + encode_object(value, version=version) + tail
+    encoding = time.perf_counter() - started
+
+    started = time.perf_counter()
+    Parser().parse_string(encoded)
+    decoding = time.perf_counter() - started
+
+    print("%-10s Hessian %d.0 %12d bytes   encode %8.1f ms   decode %8.1f ms" % (
+        label, version, len(encoded), encoding * 1000, decoding * 1000))
+
+
+if __name__ == '__main__':
+    value = objects()
+    for version in (1, 2):
+        bench('Object', version, value)
+
+    @register('com.example.Position')
+    @dataclasses.dataclass
+    class Position(object):
+        id: int
+        symbol: str
+        quantity: int
+        price: float
+        open: bool
+
+    value = objects(factory=Position)
+    for version in (1, 2):
+        bench('registered', version, value)
@@ -0,0 +1,52 @@
+"""
+Decoding throughput of mustaine.parser.Parser on large nested replies.
+
+    python benchmarks/bench_parser.py
+"""
+from io import BytesIO
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mustaine.encoder import encode_object
+from mustaine.parser import Parser
+from mustaine.protocol import Binary
+
+
+def reply(value):
+    return b'r\x01\x00' + encode_object(value) + b'z'
+
+def nested_reply(rows=20000):
+    return reply([
+        {
+            'id':      i,
+            'name':    'row %d' % (i,),
+            'score':   i * 0.5,
+            'active':  bool(i % 2),
+            'tags':    ['a', 'b', 'c'],
+            'history': [i, i + 1, i + 2, None],
+        }
+        for i in range(rows)
+    ])
+
+def timed(f, number=3):
+    return min(timeit.repeat(f, number=number, repeat=3)) / number
+
+def bench(name, payload, **options):
+    parser = Parser(**options)
+    stream = timed(lambda: parser.parse_stream(BytesIO(payload)))
+    buffer = timed(lambda: parser.parse_string(payload))
+    print("%-24s %8.1f KB   stream %8.1f ms   buffer %8.1f ms %8.1f MB/s" % (
+        name, len(payload) / 1024.0, stream * 1000, buffer * 1000, len(payload) / buffer / 2**20))
+
+
+if __name__ == '__main__':
+    bench('nested maps and lists', nested_reply())
+    bench('flat list of doubles', reply([i * 0.25 for i in range(200000)]))
+    bench('1M doubles', reply([i * 0.25 for i in range(1000000)]))
+    bench('1M doubles as an array', reply([i * 0.25 for i in range(1000000)]), arrays=True)
+    bench('ascii strings', reply(['lorem ipsum dolor sit amet %d' % (i,) * 8 for i in range(20000)]))
+    bench('32 MB binary', reply(Binary(b'\x00' * (32 << 20))))
+    bench('multi-byte strings', reply(['\u00e9t\u00e9 \u4e2d\u6587 \U0001f600 %d' % (i,) * 8 for i in range(20000)]))
@@ -1,42 +1,349 @@
-#from io import StringIO
-from io import BytesIO
+import ssl
+import zlib
 
+# the most buffers handed to a single sendmsg() call
+MAX_IOV = 512
 
-class BufferedReader(object):
+# zlib window settings of the HTTP content codings supported: gzip is a
+# gzip file, deflate a zlib stream; inflating detects either header
+CODINGS = {
+    'gzip':    16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
 
-    def __init__(self, input, buffer_size=65535):
-        self.__input       = input
-        self.__buffer_size = buffer_size
-        self.__buffer      = BytesIO()
 
-        # initial fill
-        chunk = input.read(buffer_size)
-        self.__byte_count = len(chunk)
-        self.__buffer.write(chunk)
-        self.__buffer.seek(0)
+class BufferedReader(object):
+    """
+    Buffers reads from `input` through a single reusable bytearray which is
+    refilled in place with readinto(). When the total `length` of the input
+    is known (e.g. from Content-Length) no read ever asks for more than what
+    is left, so the underlying stream is never polled past its end.
+    """
+    def __init__(self, input, buffer_size=65535, length=None):
+        self.__input     = input
+        self.__readinto  = getattr(input, 'readinto', None)
+        self.__remaining = length
+        self.__buffer    = bytearray(buffer_size if length is None else max(1, min(buffer_size, length)))
+        self.__view      = memoryview(self.__buffer)
+        self.__start     = 0 # first unread byte
+        self.__end       = 0 # end of valid data
 
     def read(self, byte_count):
-        difference = byte_count - self.__byte_count
+        start = self.__start
+        end   = start + byte_count
 
-        if difference < 0:
-            chunk = self.__buffer.read(byte_count)
-            self.__byte_count -= byte_count
-        else:
-            chunk = self.__buffer.read() + self.__input.read(difference)
+        if end <= self.__end:
+            self.__start = end
+            return self.__view[start:end].tobytes()
+
+        if byte_count > len(self.__buffer):
+            return self.__read_large(byte_count)
+
+        self.__fill(byte_count)
+        if byte_count > self.__end:
+            raise EOFError("Encountered unexpected end of stream")
+
+        self.__start = byte_count
+        return self.__view[:byte_count].tobytes()
+
+    def readinto(self, b):
+        """ Fill as much of the writable buffer `b` as the input allows """
+        target = memoryview(b).cast('B')
+        count  = min(len(target), self.__end - self.__start)
+
+        target[:count] = self.__view[self.__start:self.__start + count]
+        self.__start += count
+
+        while count < len(target):
+            n = self.__input_readinto(target[count:])
+            if not n:
+                break
+            count += n
+
+        return count
+
+    def read_byte(self):
+        """ Read a single byte, returned as an int """
+        start = self.__start
+        if start >= self.__end:
+            self.__fill(1)
+            start = 0
+            if not self.__end:
+                raise EOFError("Encountered unexpected end of stream")
+
+        self.__start = start + 1
+        return self.__buffer[start]
+
+    def unpack(self, struct):
+        """ Decode the first field of `struct` straight out of the buffer """
+        start = self.__start
+        end   = start + struct.size
+
+        if end > self.__end:
+            if struct.size > len(self.__buffer):
+                return struct.unpack(self.read(struct.size))[0]
 
-            # verify size
-            if len(chunk) != byte_count:
+            self.__fill(struct.size)
+            start, end = 0, struct.size
+            if end > self.__end:
                 raise EOFError("Encountered unexpected end of stream")
 
-            # reset internal buffer
-            self.__buffer.seek(0)
-            self.__buffer.truncate()
+        self.__start = end
+        return struct.unpack_from(self.__buffer, start)[0]
+
+    def peek(self, byte_count=1):
+        """
+        Return a view of at least `byte_count` buffered bytes (fewer only at
+        the end of the input) without consuming them. The view is only valid
+        until the next call on this reader.
+        """
+        if self.__end - self.__start < byte_count:
+            self.__fill(min(byte_count, len(self.__buffer)))
+
+        return self.__view[self.__start:self.__end]
+
+    def __fill(self, byte_count):
+        # move the unread tail to the front, then read in behind it
+        pending = self.__end - self.__start
+        if self.__start:
+            self.__buffer[:pending] = self.__view[self.__start:self.__end]
+            self.__start, self.__end = 0, pending
+
+        while self.__end < byte_count:
+            n = self.__input_readinto(self.__view[self.__end:])
+            if not n:
+                break
+            self.__end += n
+
+    def __read_large(self, byte_count):
+        # too big to buffer: hand over what we have, read the rest directly
+        result = bytearray(byte_count)
+        if self.readinto(result) != byte_count:
+            raise EOFError("Encountered unexpected end of stream")
+
+        return bytes(result)
+
+    def __input_readinto(self, target):
+        if self.__remaining is not None:
+            if not self.__remaining:
+                return 0
+            target = target[:self.__remaining]
+
+        if self.__readinto is not None:
+            n = self.__readinto(target)
+        else:
+            chunk = self.__input.read(len(target))
+            n = len(chunk)
+            target[:n] = chunk
+
+        if self.__remaining is not None:
+            self.__remaining -= n
+
+        return n
+
+
+# UTF-8 continuation bytes (10xxxxxx); every other byte starts a character
+UTF8_CONTINUATION = bytes(range(0x80, 0xC0))
+
+def utf8_length(data):
+    """ Count the characters in a UTF-8 byte string without decoding it """
+    if data.isascii():
+        return len(data)
+
+    return len(data.translate(None, UTF8_CONTINUATION))
+
+def utf8_sequence_length(lead):
+    """ Return the encoded length of a character from its first byte """
+    if lead < 0x80:
+        return 1
+    elif lead < 0xE0:
+        return 2
+    elif lead < 0xF0:
+        return 3
+    else:
+        return 4
+
+
+def gather_run(data, pos, end, tag, size, limit=None):
+    """
+    Count the consecutive values in data[pos:end] that are each `size` bytes
+    long and introduced by the tag byte `tag`, the first tag lying just before
+    `pos`, and return that count (at most `limit`) along with the values
+    joined into one bytearray, tags stripped. Only values wholly before `end`
+    are counted.
+    """
+    stride    = size + 1
+    available = (end - pos + 1) // stride
+    if limit is None or limit > available:
+        limit = available
+    if limit <= 0:
+        return 0, bytearray()
+
+    # compare the tags in windows that double in size, so short runs never
+    # pay for looking far ahead
+    marker = bytes((tag,))
+    count  = 1
+    window = 16
+    while count < limit:
+        n       = min(window, limit - count)
+        first   = pos + count * stride - 1
+        tags    = bytes(data[first:first + n * stride:stride])
+        matched = n - len(tags.lstrip(marker))
+        count  += matched
+        if matched < n:
+            break
+        window *= 2
+
+    # each byte position of the values is gathered in one strided copy
+    values = bytearray(count * size)
+    stop   = pos + count * stride
+    for k in range(size):
+        values[k::size] = data[pos + k:stop:stride]
+
+    return count, values
+
+
+class ChunkedSink(object):
+    """
+    A file-like sink that sends what is written to it over `sock` as HTTP/1.1
+    chunked transfer coding. Writes are coalesced until at least `chunk_size`
+    bytes are pending, and each chunk goes out with a single scatter-gather
+    sendmsg() where the socket supports it, so pieces are never joined.
+    """
+    def __init__(self, sock, chunk_size=65536):
+        self.__sock       = sock
+        self.__chunk_size = chunk_size
+        self.__pending    = []
+        self.__size       = 0
+
+    def write(self, data):
+        self.__pending.append(data)
+        self.__size += len(data)
+
+        if self.__size >= self.__chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.__size:
+            buffers = [b'%x\r\n' % (self.__size,)] + self.__pending + [b'\r\n']
+            self.__pending = []
+            self.__size    = 0
+            sendall_vectored(self.__sock, buffers)
+
+    def close(self):
+        self.flush()
+        self.__sock.sendall(b'0\r\n\r\n')
+
+
+def sendall_vectored(sock, buffers):
+    """ Send a list of bytes-like objects, as sendall() would their concatenation """
+    try:
+        sendmsg = sock.sendmsg
+        if isinstance(sock, ssl.SSLSocket):
+            raise AttributeError
+    except AttributeError:
+        sock.sendall(b''.join(buffers))
+        return
+
+    buffers = [memoryview(buffer).cast('B') for buffer in buffers]
+    first   = 0
+    while first < len(buffers):
+        sent = sendmsg(buffers[first:first + MAX_IOV])
+
+        # skip whatever went out, then resume mid-buffer if need be
+        while first < len(buffers) and sent >= len(buffers[first]):
+            sent  -= len(buffers[first])
+            first += 1
+        if sent:
+            buffers[first] = buffers[first][sent:]
+
+
+def compress(data, coding, level=6):
+    """ Encode `data` in content coding `coding`, 'gzip' or 'deflate' """
+    deflater = zlib.compressobj(level, zlib.DEFLATED, CODINGS[coding])
+    return deflater.compress(data) + deflater.flush()
+
+
+class CompressingSink(object):
+    """
+    A file-like sink that writes what is written to it on to `sink` (which
+    must have a close() method) encoded in content coding `coding`.
+    """
+    def __init__(self, sink, coding, level=6):
+        self.__sink     = sink
+        self.__deflater = zlib.compressobj(level, zlib.DEFLATED, CODINGS[coding])
+
+    def write(self, data):
+        compressed = self.__deflater.compress(data)
+        if compressed:
+            self.__sink.write(compressed)
+
+    def close(self):
+        self.__sink.write(self.__deflater.flush())
+        self.__sink.close()
+
+
+class InflatingReader(object):
+    """
+    A file-like reader decoding the gzip or deflate coded stream `input` as
+    it is read, `chunk_size` compressed bytes at a time. No read inflates
+    more than it was asked for, so the memory used stays bounded whatever
+    the compression ratio. Servers that send deflate without its zlib header
+    are tolerated.
+    """
+    def __init__(self, input, chunk_size=16384):
+        self.__input      = input
+        self.__chunk_size = chunk_size
+        self.__inflater   = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        self.__started    = False
+
+    def readinto(self, b):
+        """ Fill up to all of the writable buffer `b`; returns 0 at the end """
+        target = memoryview(b).cast('B')
+
+        while target:
+            inflater = self.__inflater
+            if inflater.unconsumed_tail:
+                data = inflater.unconsumed_tail
+            elif inflater.eof:
+                return 0
+            else:
+                data = self.__input.read(self.__chunk_size)
+                if not data:
+                    return 0
+
+            try:
+                inflated = inflater.decompress(data, len(target))
+            except zlib.error:
+                if self.__started:
+                    raise
+
+                # raw deflate, start over without looking for a header
+                self.__inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+                inflated = self.__inflater.decompress(data, len(target))
+
+            self.__started = True
+            if inflated:
+                target[:len(inflated)] = inflated
+                return len(inflated)
+
+        return 0
 
-            # replenish
-            fresh_chunk = self.__input.read(self.__buffer_size)
-            self.__byte_count = len(fresh_chunk)
-            self.__buffer.write(fresh_chunk)
-            self.__buffer.seek(0)
+    def read(self, byte_count=-1):
+        if byte_count < 0:
+            chunks = []
+            while True:
+                chunk = self.read(65536)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
 
-        return chunk
+        result = bytearray(byte_count)
+        count  = 0
+        while count < byte_count:
+            n = self.readinto(memoryview(result)[count:])
+            if not n:
+                break
+            count += n
 
+        return bytes(result[:count])
@@ -0,0 +1,324 @@
+from io import BytesIO
+from urllib.parse import urlparse
+import asyncio
+import base64
+import ssl
+import time
+
+from mustaine.client import ProtocolError
+from mustaine.encoder import encode_object
+from mustaine.parser import Parser
+from mustaine.pool import PoolStats
+from mustaine._util import CODINGS, InflatingReader, compress
+from mustaine.protocol import Call, Fault
+from mustaine import __version__
+
+
+class AsyncConnection(object):
+    def __init__(self, reader, writer):
+        self.reader    = reader
+        self.writer    = writer
+        self.created   = time.monotonic()
+        self.last_used = self.created
+        self.reused    = False
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncConnectionPool(object):
+    """
+    The asyncio counterpart of mustaine.pool.ConnectionPool: a bounded set of
+    idle keep-alive stream pairs to a single host. At most `max_connections`
+    connections are open at once; further checkouts wait for one to free up.
+    """
+    def __init__(self, uri, key_file=None, cert_file=None, max_size=4, max_idle=60, max_lifetime=None, max_connections=100):
+        self._host = uri.hostname
+
+        if uri.scheme == 'http':
+            self._port = uri.port or 80
+            self._ssl  = None
+        elif uri.scheme == 'https':
+            self._port = uri.port or 443
+            self._ssl  = ssl.create_default_context()
+            if cert_file:
+                self._ssl.load_cert_chain(cert_file, key_file)
+        else:
+            raise NotImplementedError("AsyncHessianProxy only supports http:// and https:// URIs")
+
+        self._idle         = []
+        self._max_size     = max_size
+        self._max_idle     = max_idle
+        self._max_lifetime = max_lifetime
+        self.stats         = PoolStats()
+        self._slots        = asyncio.Semaphore(max_connections)
+
+    async def get(self):
+        await self._slots.acquire()
+        try:
+            return await self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def _checkout(self):
+        now = time.monotonic()
+
+        while self._idle:
+            conn = self._idle.pop()
+
+            if self._expired(conn, now) or conn.reader.at_eof() or conn.writer.is_closing():
+                self.stats.evictions += 1
+                conn.close()
+                continue
+
+            self.stats.hits += 1
+            conn.reused = True
+            return conn
+
+        self.stats.misses += 1
+        return await self._connect()
+
+    def put(self, conn):
+        self._slots.release()
+        conn.last_used = time.monotonic()
+
+        if len(self._idle) >= self._max_size or self._expired(conn, conn.last_used):
+            conn.close()
+        else:
+            self._idle.append(conn)
+
+    def discard(self, conn):
+        self._slots.release()
+        conn.close()
+
+    async def reconnect(self, conn):
+        self.stats.reconnects += 1
+        conn.close()
+        return await self._connect()
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self._host, self._port, ssl=self._ssl)
+        return AsyncConnection(reader, writer)
+
+    def _expired(self, conn, now):
+        if self._max_idle is not None and now - conn.last_used > self._max_idle:
+            return True
+        if self._max_lifetime is not None and now - conn.created > self._max_lifetime:
+            return True
+
+        return False
+
+
+class AsyncHessianProxy(object):
+    """
+    An asyncio flavour of mustaine.client.HessianProxy. Remote methods are
+    exposed as attributes and return awaitables:
+
+        service = AsyncHessianProxy("http://hessian.caucho.com/test/test")
+        print(await service.replyDate_1())
+
+    Replies are read off the socket without blocking the event loop and then
+    decoded in one pass by the regular Parser.
+
+    `references`, `version`, `arrays`, `compact`, `compression` and
+    `compress_threshold` are as for HessianProxy, except that compressed
+    replies are inflated in one go, having been read whole anyway.
+
+    As with HessianProxy, helper methods such as `batch` shadow remote methods
+    of the same name; those remain reachable as `await proxy('batch', args)`.
+    """
+    def __init__(self, service_uri, credentials=None, key_file=None, cert_file=None, timeout=10, error_factory=lambda x: x, overload=False,
+                 pool_size=4, max_idle=60, max_lifetime=None, max_connections=100,
+                 references=False, version=1, arrays=False, compact=False, compression=None, compress_threshold=1024):
+        if compression is not None and compression not in CODINGS:
+            raise ValueError("Unsupported compression %r" % (compression,))
+
+        self._headers = list()
+        self._headers.append(('User-Agent', 'mustaine/' + __version__,))
+        self._headers.append(('Content-Type', 'application/x-hessian',))
+        if compression:
+            self._headers.append(('Accept-Encoding', 'gzip, deflate',))
+
+        self._uri  = urlparse(service_uri)
+        self._pool = AsyncConnectionPool(self._uri,
+                                         key_file=key_file,
+                                         cert_file=cert_file,
+                                         max_size=pool_size,
+                                         max_idle=max_idle,
+                                         max_lifetime=max_lifetime,
+                                         max_connections=max_connections)
+
+        self._headers.append(('Host', self._uri.netloc.rpartition('@')[2],))
+
+        # autofill credentials if they were passed via url instead of kwargs
+        if (self._uri.username and self._uri.password) and not credentials:
+            credentials = (self._uri.username, self._uri.password)
+
+        if credentials:
+            auth = 'Basic ' + base64.b64encode(':'.join(credentials).encode('utf-8')).decode('ascii')
+            self._headers.append(('Authorization', auth))
+
+        self._timeout = timeout
+        self._pool_size = pool_size
+        self._error_factory = error_factory
+        self._overload = overload
+        self._references = references
+        self._version = version
+        self._arrays = arrays
+        self._compact = compact
+        self._compression = compression
+        self._compress_threshold = compress_threshold
+        self._parser = Parser(arrays=arrays, compact=compact)
+
+    class __RemoteMethod(object):
+        # dark magic for autoloading methods
+        def __init__(self, caller, method):
+            self.__caller = caller
+            self.__method = method
+        def __call__(self, *args):
+            return self.__caller(self.__method, args)
+
+    def __getattr__(self, method):
+        return self.__RemoteMethod(self, method)
+
+    def __repr__(self):
+        return "<mustaine.aioclient.AsyncHessianProxy(\"%s\")>" % (self._uri.geturl(),)
+
+    def __str__(self):
+        return self.__repr__()
+
+    @property
+    def pool_stats(self):
+        return self._pool.stats
+
+    async def batch(self, calls, parallelism=None):
+        """
+        Perform a list of independent (method, args) calls with at most
+        `parallelism` in flight (by default, as many as the pool keeps).
+        Results are returned in input order; a call that fails yields the
+        exception it raised in its place.
+        """
+        limit = asyncio.Semaphore(self._pool_size if parallelism is None else parallelism)
+
+        async def call(pair):
+            async with limit:
+                try:
+                    return await self(*pair)
+                except Exception as e:
+                    return e
+
+        return list(await asyncio.gather(*[call(pair) for pair in calls]))
+
+    async def __call__(self, method, args):
+        request = encode_object(Call(method, args, overload=self._overload), references=self._references, version=self._version)
+
+        coding = self._compression
+        if coding and len(request) >= self._compress_threshold:
+            request = compress(request, coding)
+        else:
+            coding = None
+
+        if self._timeout is None:
+            reply = await self._call(request, coding)
+        else:
+            reply = await asyncio.wait_for(self._call(request, coding), self._timeout)
+
+        if isinstance(reply.value, Fault):
+            raise self._error_factory(reply.value)
+        else:
+            return reply.value
+
+    async def _call(self, request, coding=None):
+        conn = await self._pool.get()
+
+        try:
+            try:
+                status, reason, headers, body = await self._exchange(conn, request, coding)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # a kept-alive connection may have been closed by the server
+                # while idle; retry once on a fresh one
+                if not conn.reused:
+                    raise
+
+                conn = await self._pool.reconnect(conn)
+                status, reason, headers, body = await self._exchange(conn, request, coding)
+
+            if status != 200:
+                raise ProtocolError(self._uri.geturl(), status, reason)
+
+            if not body:
+                raise ProtocolError(self._uri.geturl(), 'FATAL:', 'Server sent zero-length response')
+
+            if headers.get('content-encoding', 'identity').lower() in CODINGS:
+                body = InflatingReader(BytesIO(body)).read()
+
+            # the body is complete in memory, so decoding never waits on the network
+            reply = self._parser.parse_string(body)
+        except BaseException:
+            # includes cancellation, which leaves the stream in an unknown state
+            self._pool.discard(conn)
+            raise
+
+        if headers.get('connection', '').lower() == 'close':
+            self._pool.discard(conn)
+        else:
+            self._pool.put(conn)
+
+        return reply
+
+    async def _exchange(self, conn, request, coding=None):
+        head = ['POST %s HTTP/1.1' % (self._uri.path or '/',)]
+        for header in self._headers:
+            head.append('%s: %s' % header)
+        if coding:
+            head.append('Content-Encoding: %s' % (coding,))
+        head.append('Content-Length: %d' % (len(request),))
+
+        conn.writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        conn.writer.write(request)
+        await conn.writer.drain()
+
+        status_line = await conn.reader.readuntil(b'\r\n')
+        version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+
+        headers = {}
+        while True:
+            line = await conn.reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await self._read_chunked(conn.reader)
+        elif 'content-length' in headers:
+            body = await conn.reader.readexactly(int(headers['content-length']))
+        else:
+            # no framing, the body runs until the server hangs up
+            body = await conn.reader.read()
+            headers['connection'] = 'close'
+
+        return int(status), reason, headers, body
+
+    async def _read_chunked(self, reader):
+        chunks = []
+
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';', 1)[0], 16)
+            if size == 0:
+                break
+
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+        # skip trailers
+        while (await reader.readuntil(b'\r\n')) != b'\r\n':
+            pass
+
+        return b''.join(chunks)
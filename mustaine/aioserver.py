@@ -0,0 +1,277 @@
+from functools import partial
+from io import BytesIO
+import asyncio
+import inspect
+
+from mustaine.protocol import Fault
+from mustaine.server import HessianServer, accepted_coding, message_version, no_such_method, service_fault
+from mustaine._util import CODINGS, InflatingReader, compress
+from mustaine import __version__
+
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    405: 'Method Not Allowed',
+    408: 'Request Timeout',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    415: 'Unsupported Media Type',
+    431: 'Request Header Fields Too Large',
+    505: 'HTTP Version Not Supported',
+}
+
+class HTTPError(Exception):
+    # a request answered with `status`, after which the connection is closed
+    def __init__(self, status):
+        Exception.__init__(self, status)
+        self.status = status
+
+
+class AsyncHessianServer(object):
+    """
+    An asyncio Hessian endpoint serving the public methods of `handler`, the
+    counterpart of mustaine.server.HessianServer (whose method resolution,
+    faults and compression it shares):
+
+        class Calculator(object):
+            async def add(self, a, b):
+                return a + b
+
+        server = await AsyncHessianServer(Calculator()).serve('0.0.0.0', 8080)
+        await server.serve_forever()
+
+    Coroutine methods are awaited on the event loop; plain methods are run in
+    `executor` (the loop's default one if None), so they may block.
+
+    Connections are kept alive and served one request at a time: the next
+    request is not read before the reply to the last has been handed to the
+    socket, so a client that does not read its replies stops being read
+    from. At most `max_pending` calls are in progress at once across all
+    connections; requests beyond that wait their turn with only their head
+    read, so no more than `max_pending` bodies are held at once. Requests
+    whose body exceeds `max_request_size` bytes (once inflated) are refused
+    with a 413, head blocks over `max_header_size` bytes with a 431.
+    Connections idle for `idle_timeout` seconds are closed, as are those
+    whose body takes longer than that to come in (with a 408).
+    """
+    def __init__(self, handler, references=False, executor=None, max_pending=1024, max_request_size=16 * 1024 * 1024,
+                 max_header_size=65536, idle_timeout=60, compress_threshold=1024):
+        self._service            = HessianServer(handler, references=references, compress_threshold=compress_threshold,
+                                                 max_request_size=max_request_size)
+        self._executor           = executor
+        self._pending            = asyncio.Semaphore(max_pending)
+        self._max_request_size   = max_request_size
+        self._max_header_size    = max_header_size
+        self._idle_timeout       = idle_timeout
+        self._compress_threshold = compress_threshold
+        self._server_header      = 'Server: mustaine/' + __version__
+
+        self.connections = 0 # currently open
+
+    def __repr__(self):
+        return "<mustaine.aioserver.AsyncHessianServer(%r)>" % (self._service._handler,)
+
+    async def serve(self, host='127.0.0.1', port=0, **options):
+        """
+        Start listening on `host` and `port`; returns the asyncio.Server.
+        Further `options` go to asyncio.start_server.
+        """
+        return await asyncio.start_server(self.handle_connection, host, port, limit=self._max_header_size, **options)
+
+    async def handle_connection(self, reader, writer):
+        """ Serve requests coming in on a stream pair until it is closed """
+        self.connections += 1
+        try:
+            while await self._handle_request(reader, writer):
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _handle_request(self, reader, writer):
+        # serve one request; returns whether the connection is to be kept
+        try:
+            head = await asyncio.wait_for(self._read_head(reader), self._idle_timeout)
+        except asyncio.TimeoutError:
+            return False
+        except HTTPError as e:
+            await self._respond(writer, e.status, b'')
+            return False
+
+        if head is None:
+            return False
+        method, connection, headers = head
+
+        try:
+            if method != 'POST':
+                raise HTTPError(405)
+            coding, length = self._body_size(headers)
+
+            # the body is only read once the call may go ahead
+            async with self._pending:
+                try:
+                    body = await asyncio.wait_for(self._read_body(reader, writer, headers, coding, length), self._idle_timeout)
+                except asyncio.TimeoutError:
+                    raise HTTPError(408)
+                value = await self.dispatch(self._service.read_call(body))
+        except HTTPError as e:
+            await self._respond(writer, e.status, b'')
+            return False
+
+        reply  = self._service.encode_reply(value, message_version(body[:3]))
+        coding = accepted_coding(headers.get('accept-encoding', ''))
+        if coding and self._compress_threshold is not None and len(reply) >= self._compress_threshold:
+            reply = compress(reply, coding)
+        else:
+            coding = None
+
+        await self._respond(writer, 200, reply, connection=connection, coding=coding)
+        return connection is not None
+
+    async def dispatch(self, call):
+        """ Perform `call`, returning its result, or a Fault if it failed """
+        if isinstance(call, Fault):
+            return call
+
+        method = self._service.resolve(call.method, len(call.args))
+        if method is None:
+            return no_such_method(call.method)
+
+        try:
+            if inspect.iscoroutinefunction(method):
+                return await method(*call.args)
+            else:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, partial(method, *call.args))
+        except Exception as e:
+            return service_fault(e)
+
+    async def _read_head(self, reader):
+        # (method, connection, headers) of the next request, or None if the
+        # client hung up in between requests; connection is the Connection
+        # header to reply with if the connection is kept open, else None
+        try:
+            line = await reader.readuntil(b'\r\n')
+            size = len(line)
+
+            parts = line.decode('latin-1').split()
+            if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+                raise HTTPError(400)
+            if parts[2] not in ('HTTP/1.0', 'HTTP/1.1'):
+                raise HTTPError(505)
+
+            headers = {}
+            while True:
+                line  = await reader.readuntil(b'\r\n')
+                size += len(line)
+                if size > self._max_header_size:
+                    raise HTTPError(431)
+                if line == b'\r\n':
+                    break
+
+                name, colon, value = line.decode('latin-1').partition(':')
+                if not colon:
+                    raise HTTPError(400)
+                headers[name.strip().lower()] = value.strip()
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431)
+
+        tokens = [token.strip() for token in headers.get('connection', '').lower().split(',')]
+        if parts[2] == 'HTTP/1.1':
+            connection = '' if 'close' not in tokens else None
+        else:
+            connection = 'keep-alive' if 'keep-alive' in tokens else None
+
+        return parts[0], connection, headers
+
+    def _body_size(self, headers):
+        # (content coding, length) of a request's body, the length being None
+        # if it comes chunked; refuses those it cannot take before any is read
+        coding = headers.get('content-encoding', 'identity').lower()
+        if coding != 'identity' and coding not in CODINGS:
+            raise HTTPError(415)
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            return coding, None
+
+        try:
+            length = int(headers['content-length'])
+        except KeyError:
+            raise HTTPError(411)
+        except ValueError:
+            raise HTTPError(400)
+        if length < 0:
+            raise HTTPError(400)
+        if length > self._max_request_size:
+            raise HTTPError(413)
+
+        return coding, length
+
+    async def _read_body(self, reader, writer, headers, coding, length):
+        if headers.get('expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+
+        if length is None:
+            body = await self._read_chunked(reader)
+        else:
+            body = await reader.readexactly(length)
+
+        if coding != 'identity':
+            # inflated no further than the limit, whatever the ratio
+            try:
+                body = InflatingReader(BytesIO(body)).read(self._max_request_size + 1)
+            except Exception:
+                raise HTTPError(400)
+            if len(body) > self._max_request_size:
+                raise HTTPError(413)
+
+        return body
+
+    async def _read_chunked(self, reader):
+        chunks = []
+        total  = 0
+
+        while True:
+            try:
+                size = int((await reader.readuntil(b'\r\n')).split(b';', 1)[0], 16)
+            except (ValueError, asyncio.LimitOverrunError):
+                raise HTTPError(400)
+            if size < 0:
+                raise HTTPError(400)
+            if size == 0:
+                break
+
+            total += size
+            if total > self._max_request_size:
+                raise HTTPError(413)
+
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+        # skip trailers
+        while (await reader.readuntil(b'\r\n')) != b'\r\n':
+            pass
+
+        return b''.join(chunks)
+
+    async def _respond(self, writer, status, body, connection=None, coding=None):
+        # `connection` is as returned by _read_head, None closing it
+        head = ['HTTP/1.1 %d %s' % (status, REASONS[status]), self._server_header]
+        if status == 200:
+            head.append('Content-Type: application/x-hessian')
+        elif status == 405:
+            head.append('Allow: POST')
+        if coding:
+            head.append('Content-Encoding: %s' % (coding,))
+        head.append('Content-Length: %d' % (len(body),))
+        if connection is None:
+            head.append('Connection: close')
+        elif connection:
+            head.append('Connection: %s' % (connection,))
+
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
@@ -1,13 +1,16 @@
-from http.client import HTTPConnection, HTTPSConnection
+from concurrent.futures import ThreadPoolExecutor
+from http.client import BadStatusLine
 from urllib.parse import urlparse
 from warnings import warn
 import base64
 import sys
+import threading
 
-from mustaine.encoder import encode_object
+from mustaine.encoder import Encoder, PreparedCall, encode_object
 from mustaine.parser import Parser
 from mustaine.protocol import Call, Fault
-from mustaine._util import BufferedReader
+from mustaine.pool import ConnectionPool, header_block
+from mustaine._util import CODINGS, BufferedReader, ChunkedSink, CompressingSink, InflatingReader, compress
 from mustaine import __version__
 
 
@@ -25,34 +28,68 @@ class ProtocolError(Exception):
         return "<ProtocolError for %s: %s %s>" % (self._url, self._status, self._reason,)
 
 
+# errors that mean a connection died underneath us rather than a server error
+DISCONNECT_ERRORS = (ConnectionError, BadStatusLine)
+
+
 class HessianProxy(object):
+    """
+    A proxy for a remote Hessian service. Remote methods are exposed as
+    attributes, so `proxy.echo(1)` calls the service's `echo` method.
+
+    A proxy may be shared freely between threads: connections are checked out
+    of a thread-safe pool for the duration of each call, and every thread
+    decodes replies with its own Parser.
+
+    With `references` set, containers that occur more than once in a call's
+    arguments are sent once and referred back to afterwards (see
+    mustaine.encoder.Encoder).
+
+    `version` picks the wire format of requests: 1 for Hessian 1.0.2, 2 for
+    Hessian 2.0. Replies are decoded in whichever version the server answers.
+
+    With `arrays` set, lists of doubles, ints or longs in replies are decoded
+    in bulk into numpy arrays, or array.array objects without numpy; with
+    `compact` set, typed values are decoded into compact __slots__ objects
+    rather than Objects (see mustaine.parser.Parser).
+
+    With `chunk_size` set, requests are not encoded up front but streamed to
+    the server with chunked transfer coding as they are encoded, so the memory
+    a large argument needs on top of itself stays around `chunk_size`.
+
+    With `compression` set to 'gzip' or 'deflate', replies may come back
+    compressed (either way), and are inflated as they are parsed; requests of
+    `compress_threshold` bytes or more are sent compressed, as are all
+    streamed ones.
+
+    The few helper methods defined here (such as `batch`) shadow remote methods
+    of the same name; those remain reachable as `proxy('batch', args)`.
+    """
+
+    def __init__(self, service_uri, credentials=None, key_file=None, cert_file=None, timeout=10, buffer_size=65535, error_factory=lambda x: x, overload=False,
+                 pool_size=4, max_idle=60, max_lifetime=None, chunk_size=None,
+                 references=False, version=1, arrays=False, compact=False, compression=None, compress_threshold=1024):
+        if compression is not None and compression not in CODINGS:
+            raise ValueError("Unsupported compression %r" % (compression,))
 
-    def __init__(self, service_uri, credentials=None, key_file=None, cert_file=None, timeout=10, buffer_size=65535, error_factory=lambda x: x, overload=False):
         self._headers = list()
         self._headers.append(('User-Agent', 'mustaine/' + __version__,))
         self._headers.append(('Content-Type', 'application/x-hessian',))
+        if compression:
+            self._headers.append(('Accept-Encoding', 'gzip, deflate',))
 
         if sys.version_info < (2,6):
             warn('HessianProxy timeout not enforceable before Python 2.6', RuntimeWarning, stacklevel=2)
-            timeout = {}
-        else:
-            timeout = {'timeout': timeout}
-
-        self._uri = urlparse(service_uri)
-        if self._uri.scheme == 'http':
-            self._client = HTTPConnection(self._uri.hostname,
-                                          self._uri.port or 80,
-                                          strict=True,
-                                          **timeout)
-        elif self._uri.scheme == 'https':
-            self._client = HTTPSConnection(self._uri.hostname,
-                                           self._uri.port or 443,
-                                           key_file=key_file,
-                                           cert_file=cert_file,
-                                           strict=True,
-                                           **timeout)
-        else:
-            raise NotImplementedError("HessianProxy only supports http:// and https:// URIs")
+            timeout = None
+
+        self._uri  = urlparse(service_uri)
+        self._pool = ConnectionPool(self._uri,
+                                    timeout=timeout,
+                                    key_file=key_file,
+                                    cert_file=cert_file,
+                                    max_size=pool_size,
+                                    max_idle=max_idle,
+                                    max_lifetime=max_lifetime)
 
         # autofill credentials if they were passed via url instead of kwargs
         if (self._uri.username and self._uri.password) and not credentials:
@@ -65,7 +102,18 @@ class HessianProxy(object):
         self._buffer_size = buffer_size
         self._error_factory = error_factory
         self._overload = overload
-        self._parser = Parser()
+        self._chunk_size = chunk_size
+        self._pool_size = pool_size
+        self._references = references
+        self._version = version
+        self._arrays = arrays
+        self._compact = compact
+        self._compression = compression
+        self._compress_threshold = compress_threshold
+        self._local = threading.local()
+
+        # the proxy's own headers never change, so they are serialized once
+        self._header_block = header_block(self._headers)
 
     class __RemoteMethod(object):
         # dark magic for autoloading methods
@@ -75,6 +123,13 @@ class HessianProxy(object):
         def __call__(self, *args):
             return self.__caller(self.__method, args)
 
+    class __PreparedMethod(object):
+        def __init__(self, caller, call):
+            self.__caller = caller
+            self.__call   = call
+        def __call__(self, *args):
+            return self.__caller._perform(self.__call, args)
+
     def __getattr__(self, method):
         return self.__RemoteMethod(self, method)
 
@@ -84,32 +139,148 @@ class HessianProxy(object):
     def __str__(self):
         return self.__repr__()
 
+    @property
+    def pool_stats(self):
+        return self._pool.stats
+
+    def batch(self, calls, parallelism=None):
+        """
+        Perform a list of independent (method, args) calls concurrently over
+        at most `parallelism` pooled connections (by default, as many as the
+        pool keeps). Results are returned in input order; a call that fails
+        yields the exception it raised (normally a Fault) in its place instead
+        of aborting the batch.
+        """
+        if parallelism is None:
+            parallelism = self._pool_size
+
+        calls = list(calls)
+        if not calls:
+            return []
+
+        def call(pair):
+            try:
+                return self(*pair)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(min(parallelism, len(calls))) as executor:
+            return list(executor.map(call, calls))
+
+    def prepare(self, method, *types, headers=None):
+        """
+        A callable making calls of `method` whose encoding up to the arguments
+        is done once, here, for methods called often enough for that to
+        matter:
+
+            add = proxy.prepare('add')
+            add(1, 2)
+
+        When the proxy overloads method names, passing the Hessian type names
+        of the arguments (`proxy.prepare('add', 'long', 'long')`) fixes the
+        name as well; calls with arguments of other types raise TypeError,
+        as does passing types to a proxy that does not overload.
+        `headers` are sent with every call (Hessian 1.0 only).
+        """
+        call = PreparedCall(method, headers=headers, overload=self._overload, types=types if types else None,
+                            references=self._references, version=self._version)
+        return self.__PreparedMethod(self, call)
+
     def __call__(self, method, args):
+        return self._perform(Call(method, args, overload=self._overload))
+
+    def _perform(self, call, args=None):
+        # make `call`, a Call, or a PreparedCall with `args`
+        coding = self._compression
+        if self._chunk_size:
+            request = call if args is None else lambda sink: call.write(sink, args)
+        else:
+            if args is None:
+                request = encode_object(call, references=self._references, version=self._version)
+            else:
+                request = call.encode(args)
+            if coding and len(request) >= self._compress_threshold:
+                request = compress(request, coding)
+            else:
+                coding = None
+
+        pooled = self._pool.get()
+
         try:
-            self._client.putrequest('POST', self._uri.path)
-            for header in self._headers:
-                self._client.putheader(*header)
+            try:
+                response = self._send(pooled.connection, request, coding)
+            except DISCONNECT_ERRORS:
+                # a kept-alive connection may have been closed by the server
+                # while idle; retry once on a fresh one
+                if not pooled.reused:
+                    raise
 
-            request = encode_object(Call(method, args, overload=self._overload))
-            self._client.putheader("Content-Length", str(len(request)).encode('utf8'))
-            self._client.endheaders()
-            self._client.send(request)
+                pooled   = self._pool.reconnect(pooled)
+                response = self._send(pooled.connection, request, coding)
 
-            response = self._client.getresponse()
             if response.status != 200:
                 raise ProtocolError(self._uri.geturl(), response.status, response.reason)
 
-            length = response.getheader('Content-Length', -1)
+            length = response.getheader('Content-Length')
             if length == '0':
                 raise ProtocolError(self._uri.geturl(), 'FATAL:', 'Server sent zero-length response')
 
-            reply = self._parser.parse_stream(BufferedReader(response, buffer_size=self._buffer_size))
-            self._client.close()
-
-            if isinstance(reply.value, Fault):
-                raise self._error_factory(reply.value)
+            length = int(length) if length else None
+            if response.getheader('Content-Encoding', 'identity').lower() in CODINGS:
+                # the length is that of the compressed body
+                body, length = InflatingReader(response), None
             else:
-                return reply.value
+                body = response
+
+            reply = self._parser().parse_stream(BufferedReader(body, buffer_size=self._buffer_size, length=length))
+
+            # drain anything left behind the reply so the connection can be reused
+            response.read()
         except:
-            self._client.close()
+            self._pool.discard(pooled)
             raise
+
+        if response.will_close:
+            self._pool.discard(pooled)
+        else:
+            self._pool.put(pooled)
+
+        if isinstance(reply.value, Fault):
+            raise self._error_factory(reply.value)
+        else:
+            return reply.value
+
+    def _parser(self):
+        # Parser keeps per-message state, so each thread gets its own
+        try:
+            return self._local.parser
+        except AttributeError:
+            self._local.parser = Parser(arrays=self._arrays, compact=self._compact)
+            return self._local.parser
+
+    def _send(self, connection, request, coding=None):
+        connection.putrequest('POST', self._uri.path, skip_accept_encoding=bool(self._compression))
+        connection.putheaders(self._header_block)
+        if coding:
+            connection.putheader("Content-Encoding", coding)
+
+        if not isinstance(request, bytes):
+            # stream the call as it is encoded, at most chunk_size bytes at a
+            # time; `request` is a Call, or writes a prepared one to a sink
+            connection.putheader("Transfer-Encoding", "chunked")
+            connection.endheaders()
+
+            sink = ChunkedSink(connection.sock, self._chunk_size)
+            if coding:
+                sink = CompressingSink(sink, coding)
+            if isinstance(request, Call):
+                Encoder(sink, references=self._references, version=self._version).encode(request)
+            else:
+                request(sink)
+            sink.close()
+        else:
+            connection.putheader("Content-Length", str(len(request)).encode('utf8'))
+            connection.endheaders()
+            connection.send(request)
+
+        return connection.getresponse()
@@ -1,17 +1,28 @@
+from array import array
 import datetime
+import math
+import sys
 import time
 from struct import pack
 
 from mustaine.protocol import *
+from mustaine._util import utf8_length
 
-# Implementation of Hessian 1.0.2 serialization
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Implementation of Hessian 1.0.2 and 2.0 serialization
 #   see: http://hessian.caucho.com/doc/hessian-1.0-spec.xtp
+#        http://hessian.caucho.com/doc/hessian-serialization.html
 
-ENCODERS = {}
-def encoder_for(data_type):
+ENCODERS  = {}
+ENCODERS2 = {}
+def encoder_for(data_type, version=1):
     def register(f):
         # register function `f` to encode type `data_type`
-        ENCODERS[data_type] = f
+        (ENCODERS if version == 1 else ENCODERS2)[data_type] = f
         return f
     return register
 
@@ -23,21 +34,197 @@ def returns(data_type):
         return wrapped
     return wrap
 
-def encode_object(obj):
-    if type(obj) in ENCODERS:
-        encoder = ENCODERS[type(obj)]
-    else:
-        raise TypeError("mustaine.encoder cannot serialize %s" % (type(obj),))
+WRITERS  = {}
+WRITERS2 = {}
+def writer_for(data_type, version=1):
+    def register(f):
+        # register function `f` to stream values of type `data_type`
+        (WRITERS if version == 1 else WRITERS2)[data_type] = f
+        return f
+    return register
+
+class Encoder(object):
+    """
+    Serializes objects into `sink` piece by piece, rather than building the
+    whole encoding up front. The sink may be a list, which collects the
+    pieces, or any file-like object with a write() method. Pieces may be
+    memoryview slices of the values being encoded, so they should be consumed
+    before those values are modified.
+
+    Container, string and binary types are streamed by the functions in
+    WRITERS, which return the Hessian type name of what they wrote; any other
+    type is encoded whole by its function in ENCODERS.
+
+    With `references` set, a list, tuple, dict or Object met more than once
+    (by identity) is written in full the first time and as a back-reference
+    afterwards, which also makes cyclic graphs encodable.
+
+    `version` selects the wire format, 1 for Hessian 1.0.2 or 2 for Hessian
+    2.0, whose functions are registered in WRITERS2 and ENCODERS2.
+    """
+    def __init__(self, sink, references=False, version=1):
+        if isinstance(sink, list):
+            self.write = sink.append
+        else:
+            self.write = sink.write
+
+        if version == 1:
+            self._writers, self._encoders = WRITERS, ENCODERS
+        elif version == 2:
+            self._writers, self._encoders = WRITERS2, ENCODERS2
+        else:
+            raise ValueError("Unsupported Hessian version %r" % (version,))
+
+        self.version = version
+
+        # id of each container written so far -> its reference number
+        self._refs = {} if references else None
 
-    return encoder(obj)[1]
+        # Hessian 2.0 type name -> its reference number, and (type, field
+        # names) of each class definition -> its reference number
+        self._types   = {}
+        self._classes = {}
+
+    def encode(self, obj):
+        writer = self._writers.get(type(obj))
+        if writer is not None:
+            return writer(self, obj)
+
+        if type(obj) in self._encoders:
+            encoder = self._encoders[type(obj)]
+        else:
+            # classes made on the fly carry their writers (one per version)
+            # rather than registering them for good
+            writers = getattr(type(obj), '_hessian_writers', None)
+            if writers is None:
+                raise TypeError("mustaine.encoder cannot serialize %s" % (type(obj),))
+            return writers[self.version - 1](self, obj)
+
+        data_type, encoded = encoder(obj)
+        self.write(encoded)
+        return data_type
+
+    def reference(self, obj):
+        """
+        Called by container writers before writing `obj`. Returns True, having
+        written a back-reference, if `obj` was seen before; otherwise numbers
+        it the way a parser will (in order of first appearance).
+        """
+        if self._refs is None:
+            return False
+
+        seen = self._refs.get(id(obj))
+        if seen is not None:
+            if self.version == 1:
+                self.write(pack('>cL', b'R', seen[0]))
+            else:
+                self.write(b'Q' + pack_int2(seen[0]))
+            return True
+
+        # obj is kept alive alongside its number, or a container made while
+        # encoding (by a property, say) could die and pass its id on
+        self._refs[id(obj)] = (len(self._refs), obj)
+        return False
+
+def encode_object(obj, references=False, version=1):
+    pieces = []
+    Encoder(pieces, references=references, version=version).encode(obj)
+    return b''.join(pieces)
+
+class PreparedCall(object):
+    """
+    Calls of `method` (with `headers`, Hessian 1.0 only) whose encoding up to
+    the arguments is done once, up front, so that making one only encodes
+    its arguments.
+
+    Overloaded method names depend on the types of the arguments: with
+    `overload` set, `types` (the Hessian type names of the arguments, as
+    Encoder.encode returns them) fixes the name in advance, and arguments
+    of any other type are refused with TypeError. Without `types` such
+    calls are encoded in full each time.
+    """
+    def __init__(self, method, headers=None, overload=False, types=None, references=False, version=1):
+        self.method     = method
+        self.headers    = headers or dict()
+        self.overload   = overload
+        self.references = references
+        self.version    = version
+
+        self._types  = None
+        self._prefix = None
+        self._refs   = None
+
+        if types and not overload:
+            raise TypeError("Argument types only name overloaded methods")
+        if overload and types is None:
+            return
+
+        name = method
+        if overload:
+            self._types = tuple(t.encode('utf-8') if isinstance(t, str) else t for t in types)
+            name = '_'.join([method] + [t.decode('utf-8') for t in self._types])
+        name = name.encode('utf-8')
+
+        pieces  = []
+        encoder = Encoder(pieces, references=references, version=version)
+        if version == 1:
+            encoder.write(pack('>cBB', b'c', 1, 0))
+            write_call_headers(encoder, self.headers)
+            encoder.write(pack('>cH', b'm', len(name)) + name)
+        else:
+            if self.headers:
+                raise TypeError("Hessian 2.0 calls cannot carry headers")
+
+            encoder.write(b'H\x02\x00C')
+            encoder.encode(name)
+            if self._types is not None:
+                encoder.write(pack_int2(len(self._types)))
+
+        self._prefix = b''.join(pieces)
+        self._refs   = encoder._refs # those taken by header values
+
+    def write(self, sink, args):
+        """ Write the call of the method with `args` to `sink`, as Encoder would """
+        encoder = Encoder(sink, references=self.references, version=self.version)
+
+        if self._prefix is None:
+            encoder.encode(Call(self.method, args, self.headers, overload=True))
+            return
+
+        if self._refs:
+            encoder._refs.update(self._refs)
+
+        encoder.write(self._prefix)
+        if self._types is None:
+            if self.version == 2:
+                encoder.write(pack_int2(len(args)))
+            for arg in args:
+                encoder.encode(arg)
+        else:
+            if len(args) != len(self._types):
+                raise TypeError("%s takes %d arguments (%d given)" % (self.method, len(self._types), len(args)))
+            for arg, data_type in zip(args, self._types):
+                if encoder.encode(arg) != data_type:
+                    raise TypeError("%s expects %s arguments, got %s" % (
+                        self.method, b', '.join(self._types).decode('utf-8'), type(arg).__name__))
+
+        if self.version == 1:
+            encoder.write(b'z')
+
+    def encode(self, args):
+        pieces = []
+        self.write(pieces, args)
+        return b''.join(pieces)
 
 
 @encoder_for(type(None))
+@encoder_for(type(None), version=2)
 @returns(b'null')
 def encode_null(_):
     return b'N'
 
 @encoder_for(bool)
+@encoder_for(bool, version=2)
 @returns(b'bool')
 def encode_boolean(value):
     if value:
@@ -65,117 +252,504 @@ def encode_double(value):
 def encode_date(value):
     return pack('>cq', b'd', int(time.mktime(value.timetuple())) * 1000)
 
-@encoder_for(bytes)
-@returns(b'string')
-def encode_string(value):
-    encoded = b''
-
-    while len(value) > 65535:
-        encoded += pack('>cH', b's', 65535)
-        encoded += value[:65535]
-        value    = value[65535:]
-
-    encoded += pack('>cH', b'S', len(value.decode('utf-8')))
-    encoded += value
-    return encoded
-
-@encoder_for(str)
-@returns(b'string')
-def encode_unicode(value):
-    encoded = b''
-
-    while len(value) > 65535:
-        encoded += pack('>cH', b's', 65535)
-        encoded += value[:65535].encode('utf-8')
-        value    = value[65535:]
-
-    encoded += pack('>cH', b'S', len(value))
-    encoded += value.encode('utf-8')
-    return encoded
-
-@encoder_for(list)
-@returns(b'list')
-def encode_list(obj):
-    encoded = b''.join(map(encode_object, obj))
-    return pack('>2cl', b'V', b'l', -1) + encoded + b'z'
-
-@encoder_for(tuple)
-@returns(b'list')
-def encode_tuple(obj):
-    encoded = b''.join(map(encode_object, obj))
-    return pack('>2cl', b'V', b'l', len(obj)) + encoded + b'z'
-
-def encode_keyval(pair):
-    return b''.join((encode_object(pair[0]), encode_object(pair[1])))
-
-@encoder_for(dict)
-@returns(b'map')
-def encode_map(obj):
-    encoded = b''.join(map(encode_keyval, list(obj.items())))
-    return pack('>c', b'M') + encoded + b'z'
-
-@encoder_for(Object)
-def encode_mobject(obj):
-    encoded  = pack('>cH', b't', len(obj._meta_type)) + obj._meta_type.encode('utf8')
-    members  = obj.__getstate__()
+# strings and binaries longer than this go out in several chunks
+CHUNK_LIMIT = 65535
+
+def utf8_chunks(value):
+    # split UTF-8 `value` into (final, length, data) chunks of no more than
+    # CHUNK_LIMIT bytes (and so characters), backing up so no character is
+    # split in two; lengths count characters
+    view  = memoryview(value)
+    ascii = value.isascii()
+    start = 0
+
+    while len(value) - start > CHUNK_LIMIT:
+        end = start + CHUNK_LIMIT
+        if not ascii:
+            # a character has at most three continuation bytes
+            lowest = max(start + 1, end - 3)
+            while end >= lowest and 0x80 <= value[end] < 0xC0:
+                end -= 1
+            if end < lowest:
+                raise UnicodeDecodeError('utf-8', bytes(value[end:start + CHUNK_LIMIT + 1]), 0, 1, 'invalid continuation byte')
+
+        length = end - start if ascii else utf8_length(value[start:end])
+        yield False, length, view[start:end]
+        start = end
+
+    length = len(value) - start if ascii else utf8_length(value[start:])
+    yield True, length, view[start:]
+
+def unicode_chunks(value):
+    # as utf8_chunks, for a str of which CHUNK_LIMIT characters are encoded at a time
+    last = max(len(value) - 1, 0) // CHUNK_LIMIT * CHUNK_LIMIT
+
+    for start in range(0, last, CHUNK_LIMIT):
+        yield False, CHUNK_LIMIT, value[start:start + CHUNK_LIMIT].encode('utf-8')
+
+    yield True, len(value) - last, value[last:].encode('utf-8')
+
+def binary_chunks(value):
+    view = memoryview(value)
+    last = max(len(view) - 1, 0) // CHUNK_LIMIT * CHUNK_LIMIT
+
+    for start in range(0, last, CHUNK_LIMIT):
+        yield False, CHUNK_LIMIT, view[start:start + CHUNK_LIMIT]
+
+    yield True, len(view) - last, view[last:]
+
+@writer_for(bytes)
+def write_string(encoder, value):
+    for final, length, data in utf8_chunks(value):
+        encoder.write(pack('>cH', b'S' if final else b's', length))
+        encoder.write(data)
+    return b'string'
+
+@writer_for(str)
+def write_unicode(encoder, value):
+    for final, length, data in unicode_chunks(value):
+        encoder.write(pack('>cH', b'S' if final else b's', length))
+        encoder.write(data)
+    return b'string'
+
+@writer_for(list)
+def write_list(encoder, obj):
+    if encoder.reference(obj):
+        return b'list'
+
+    encoder.write(pack('>2cl', b'V', b'l', -1))
+    for item in obj:
+        encoder.encode(item)
+    encoder.write(b'z')
+    return b'list'
+
+@writer_for(tuple)
+def write_tuple(encoder, obj):
+    if encoder.reference(obj):
+        return b'list'
+
+    encoder.write(pack('>2cl', b'V', b'l', len(obj)))
+    for item in obj:
+        encoder.encode(item)
+    encoder.write(b'z')
+    return b'list'
+
+# numeric arrays go out as typed lists of full-width values, packed in one
+# step: the list type, the element tag and size, and the array.array
+# typecode and numpy dtype used to pack the elements
+_DOUBLES = (b'[double', b'D', 8, 'd', '>f8')
+_INTS    = (b'[int',    b'I', 4, 'i', '>i4')
+_LONGS   = (b'[long',   b'L', 8, 'q', '>i8')
+
+# the numpy dtype kind (float, signed or unsigned int) of array.array typecodes
+_KINDS = dict([(code, 'f') for code in 'fd'] + [(code, 'i') for code in 'bhilq'] + [(code, 'u') for code in 'BHILQ'])
+
+def array_elements(obj):
+    # the list type of array.array or 1-D numpy array `obj`, its length and
+    # its elements, tags included
+    if isinstance(obj, array):
+        kind, itemsize, element = _KINDS.get(obj.typecode), obj.itemsize, obj.typecode
+    elif obj.ndim == 1:
+        kind, itemsize, element = obj.dtype.kind, obj.dtype.itemsize, obj.dtype
+    else:
+        raise TypeError("mustaine.encoder can only serialize 1-dimensional arrays")
+
+    # numbers that might not fit in 32 signed bits go out as longs
+    if kind == 'f':
+        type_name, tag, size, typecode, dtype = _DOUBLES
+    elif kind == 'i' and itemsize <= 4 or kind == 'u' and itemsize < 4:
+        type_name, tag, size, typecode, dtype = _INTS
+    elif kind == 'i' or kind == 'u':
+        type_name, tag, size, typecode, dtype = _LONGS
+    else:
+        raise TypeError("mustaine.encoder cannot serialize arrays of %s" % (element,))
+
+    # unsigned 64-bit values from 2**63 up have no signed long to go as
+    if kind == 'u' and itemsize == 8 and len(obj) and int(max(obj) if isinstance(obj, array) else obj.max()) >= 1 << 63:
+        raise ValueError("mustaine.encoder cannot serialize %s values beyond the range of a long" % (element,))
+
+    if isinstance(obj, array):
+        values = array(typecode, obj)
+        if sys.byteorder == 'little':
+            values.byteswap()
+        values = values.tobytes()
+    else:
+        values = obj.astype(dtype).tobytes()
+
+    # each byte of the values is interleaved with the tags in one strided copy
+    count    = len(values) // size
+    stride   = size + 1
+    elements = bytearray(count * stride)
+    elements[0::stride] = tag * count
+    for k in range(size):
+        elements[k + 1::stride] = values[k::size]
+
+    return type_name, count, elements
+
+@writer_for(array)
+def write_array(encoder, obj):
+    if encoder.reference(obj):
+        return b'list'
+
+    type_name, length, elements = array_elements(obj)
+    encoder.write(pack('>2cH', b'V', b't', len(type_name)) + type_name + pack('>cl', b'l', length))
+    encoder.write(elements)
+    encoder.write(b'z')
+    return b'list'
+
+if numpy is not None:
+    writer_for(numpy.ndarray)(write_array)
+
+@writer_for(dict)
+def write_map(encoder, obj):
+    if encoder.reference(obj):
+        return b'map'
+
+    encoder.write(b'M')
+    for key, value in obj.items():
+        encoder.encode(key)
+        encoder.encode(value)
+    encoder.write(b'z')
+    return b'map'
+
+@writer_for(Object)
+def write_mobject(encoder, obj):
+    meta_type = obj._meta_type
+    if isinstance(meta_type, str):
+        meta_type = meta_type.encode('utf-8')
+
+    if encoder.reference(obj):
+        return meta_type.rpartition(b'.')[2]
+
+    encoder.write(pack('>2cH', b'M', b't', len(meta_type)) + meta_type)
+
+    members = obj.__getstate__()
     del members['__meta_type'] # this is here for pickling. we don't want or need it
 
-    encoded += b''.join(map(encode_keyval, list(members.items())))
-    return (obj._meta_type.rpartition('.')[2], pack('>c', b'M') + encoded + b'z')
+    for key, value in members.items():
+        encoder.encode(key)
+        encoder.encode(value)
+    encoder.write(b'z')
+    return meta_type.rpartition(b'.')[2]
+
+@writer_for(Remote)
+def write_remote(encoder, obj):
+    type_name = obj.type_name
+    if isinstance(type_name, str):
+        type_name = type_name.encode('utf-8')
+
+    encoder.write(pack('>2cH', b'r', b't', len(type_name)) + type_name)
+    encoder.encode(obj.url)
+    return b'remote'
+
+@writer_for(Binary)
+def write_binary(encoder, obj):
+    for final, length, data in binary_chunks(obj.value):
+        encoder.write(pack('>cH', b'B' if final else b'b', length))
+        encoder.write(data)
+    return b'binary'
+
+@writer_for(Call)
+def write_call(encoder, call):
+    method = call.method.encode('utf8')
+
+    encoder.write(pack('>cBB', b'c', 1, 0))
+    write_call_headers(encoder, call.headers)
+
+    if not call.overload:
+        encoder.write(pack('>cH', b'm', len(method)) + method)
+        for arg in call.args:
+            encoder.encode(arg)
+    else:
+        # overloaded method names carry the argument types, so the arguments
+        # have to be encoded (and held) before the name can be written
+        arguments = []
+        write, encoder.write = encoder.write, arguments.append
+        try:
+            for arg in call.args:
+                method += b'_' + encoder.encode(arg)
+        finally:
+            encoder.write = write
+
+        encoder.write(pack('>cH', b'm', len(method)) + method)
+        for piece in arguments:
+            encoder.write(piece)
+
+    encoder.write(b'z')
+    return b'call'
+
+def write_call_headers(encoder, headers):
+    for header,value in list(headers.items()):
+        if not isinstance(header, str):
+            raise TypeError("Call header keys must be strings")
 
-@encoder_for(Remote)
-@returns(b'remote')
-def encode_remote(obj):
-    encoded = encode_string(obj.url)
-    return pack('>2cH', b'r', b't', len(obj.type_name)) + obj.type_name + encoded
+        header = header.encode('utf-8')
+        encoder.write(pack('>cH', b'H', len(header)) + header)
+        encoder.encode(value)
 
-@encoder_for(Binary)
-@returns(b'binary')
-def encode_binary(obj):
-    encoded = b''
-    value   = obj.value
+@writer_for(Reply)
+def write_reply(encoder, reply):
+    encoder.write(pack('>cBB', b'r', 1, 0))
 
-    while len(value) > 65535:
-        encoded += pack('>cH', b'b', 65535)
-        encoded += value[:65535]
-        value    = value[65535:]
+    for header, value in list(reply.headers.items()):
+        header = header.encode('utf-8')
+        encoder.write(pack('>cH', b'H', len(header)) + header)
+        encoder.encode(value)
 
-    encoded += pack('>cH', b'B', len(value))
-    encoded += value
+    if isinstance(reply.value, Fault):
+        encoder.write(b'f')
+        write_fault_entries(encoder, reply.value)
+        encoder.write(b'z')
+    else:
+        encoder.encode(reply.value)
+
+    encoder.write(b'z')
+    return b'reply'
+
+def write_fault_entries(encoder, fault):
+    # faults are maps with a fixed set of keys; in Hessian 1.0 the map's
+    # 'M' tag is left out
+    for key in ('code', 'message', 'detail'):
+        encoder.encode(key)
+        encoder.encode(getattr(fault, key))
+
+
+# Implementation of Hessian 2.0 serialization
+#   see: http://hessian.caucho.com/doc/hessian-serialization.html
+
+def pack_int2(value):
+    # the shortest encoding of a 32-bit int
+    if -0x10 <= value <= 0x2f:
+        return bytes((0x90 + value,))
+    elif -0x800 <= value <= 0x7ff:
+        return bytes((0xc8 + (value >> 8), value & 0xff))
+    elif -0x40000 <= value <= 0x3ffff:
+        return pack('>BH', 0xd4 + (value >> 16), value & 0xffff)
+    else:
+        return pack('>cl', b'I', value)
+
+def pack_string2(final, length):
+    # the header of a string chunk of `length` characters
+    if not final:
+        return pack('>cH', b'R', length)
+    elif length < 0x20:
+        return bytes((length,))
+    elif length < 0x400:
+        return bytes((0x30 + (length >> 8), length & 0xff))
+    else:
+        return pack('>cH', b'S', length)
+
+def pack_binary2(final, length):
+    # the header of a binary chunk of `length` bytes
+    if not final:
+        return pack('>cH', b'A', length)
+    elif length < 0x10:
+        return bytes((0x20 + length,))
+    elif length < 0x400:
+        return bytes((0x34 + (length >> 8), length & 0xff))
+    else:
+        return pack('>cH', b'B', length)
+
+def write2_type(encoder, type_name):
+    # types are written by name the first time, then by reference number
+    index = encoder._types.get(type_name)
+    if index is None:
+        encoder._types[type_name] = len(encoder._types)
+        encoder.encode(type_name)
+    else:
+        encoder.write(pack_int2(index))
+
+@encoder_for(int, version=2)
+def encode2_int(value):
+    if -0x80000000 <= value <= 0x7fffffff:
+        return b'int', pack_int2(value)
+    else:
+        return b'long', pack('>cq', b'L', value)
 
-    return encoded
+@encoder_for(float, version=2)
+@returns(b'double')
+def encode2_double(value):
+    if not math.isfinite(value) or (value == 0.0 and math.copysign(1.0, value) < 0):
+        return pack('>cd', b'D', value)
+
+    if value.is_integer():
+        if value == 0.0:
+            return b'\x5b'
+        elif value == 1.0:
+            return b'\x5c'
+        elif -0x80 <= value <= 0x7f:
+            return pack('>Bb', 0x5d, int(value))
+        elif -0x8000 <= value <= 0x7fff:
+            return pack('>Bh', 0x5e, int(value))
+
+    # doubles with at most three decimals travel as thousandths (checking
+    # the range first, as huge ones overflow once multiplied)
+    if -0x80000000 <= value * 1000 <= 0x7fffffff:
+        mills = round(value * 1000)
+        if -0x80000000 <= mills <= 0x7fffffff and 0.001 * mills == value:
+            return pack('>Bl', 0x5f, mills)
 
-@encoder_for(Call)
-@returns(b'call')
-def encode_call(call):
-    method    = call.method.encode('utf8')
-    headers   = b''
-    arguments = b''
+    return pack('>cd', b'D', value)
 
-    for header,value in list(call.headers.items()):
-        if not isinstance(header, str):
-            raise TypeError("Call header keys must be strings")
+@encoder_for(datetime.datetime, version=2)
+@returns(b'date')
+def encode2_date(value):
+    millis = int(time.mktime(value.timetuple())) * 1000
+
+    # whole minutes have a compact form
+    if millis % 60000 == 0 and -0x80000000 <= millis // 60000 <= 0x7fffffff:
+        return pack('>cl', b'K', millis // 60000)
+
+    return pack('>cq', b'J', millis)
+
+@writer_for(bytes, version=2)
+def write2_string(encoder, value):
+    for final, length, data in utf8_chunks(value):
+        encoder.write(pack_string2(final, length))
+        encoder.write(data)
+    return b'string'
+
+@writer_for(str, version=2)
+def write2_unicode(encoder, value):
+    for final, length, data in unicode_chunks(value):
+        encoder.write(pack_string2(final, length))
+        encoder.write(data)
+    return b'string'
+
+@writer_for(Binary, version=2)
+def write2_binary(encoder, obj):
+    for final, length, data in binary_chunks(obj.value):
+        encoder.write(pack_binary2(final, length))
+        encoder.write(data)
+    return b'binary'
+
+@writer_for(list, version=2)
+@writer_for(tuple, version=2)
+def write2_list(encoder, obj):
+    if encoder.reference(obj):
+        return b'list'
+
+    # lengths are always known up front, so lists are written fixed-length
+    if len(obj) < 8:
+        encoder.write(bytes((0x78 + len(obj),)))
+    else:
+        encoder.write(b'X' + pack_int2(len(obj)))
+
+    for item in obj:
+        encoder.encode(item)
+    return b'list'
+
+@writer_for(array, version=2)
+def write2_array(encoder, obj):
+    if encoder.reference(obj):
+        return b'list'
+
+    # the compact forms of numbers can't be packed in bulk, so elements
+    # keep their full width
+    type_name, length, elements = array_elements(obj)
+    if length < 8:
+        encoder.write(bytes((0x70 + length,)))
+        write2_type(encoder, type_name)
+    else:
+        encoder.write(b'V')
+        write2_type(encoder, type_name)
+        encoder.write(pack_int2(length))
+
+    encoder.write(elements)
+    return b'list'
+
+if numpy is not None:
+    writer_for(numpy.ndarray, version=2)(write2_array)
+
+@writer_for(dict, version=2)
+def write2_map(encoder, obj):
+    if encoder.reference(obj):
+        return b'map'
+
+    encoder.write(b'H')
+    for key, value in obj.items():
+        encoder.encode(key)
+        encoder.encode(value)
+    encoder.write(b'Z')
+    return b'map'
+
+@writer_for(Object, version=2)
+def write2_mobject(encoder, obj):
+    # an Object is written as a class definition (its type and field names),
+    # once per message, followed by the values of its fields in that order
+    meta_type = obj._meta_type
+    if isinstance(meta_type, str):
+        meta_type = meta_type.encode('utf-8')
+
+    if encoder.reference(obj):
+        return meta_type.rpartition(b'.')[2]
+
+    members = obj.__getstate__()
+    del members['__meta_type']
+
+    definition = (meta_type, tuple(members))
+    index = encoder._classes.get(definition)
+    if index is None:
+        index = encoder._classes[definition] = len(encoder._classes)
+
+        encoder.write(b'C')
+        encoder.encode(meta_type)
+        encoder.write(pack_int2(len(members)))
+        for key in members:
+            encoder.encode(key)
+
+    if index < 0x10:
+        encoder.write(bytes((0x60 + index,)))
+    else:
+        encoder.write(b'O' + pack_int2(index))
 
-        headers += pack('>cH', b'H', len(header)) + header
-        headers += encode_object(value)
+    for value in members.values():
+        encoder.encode(value)
+    return meta_type.rpartition(b'.')[2]
 
-    # TODO: this is mostly duplicated at the top of the file in encode_object. dedup
-    for arg in call.args:
-        if type(arg) in ENCODERS:
-            encoder = ENCODERS[type(arg)]
-        else:
-            raise TypeError("mustaine.encoder cannot serialize %s" % (type(arg),))
+@writer_for(Call, version=2)
+def write2_call(encoder, call):
+    if call.headers:
+        raise TypeError("Hessian 2.0 calls cannot carry headers")
 
-        data_type, arg = encoder(arg)
-        if call.overload:
-            method    += b'_' + data_type
-        arguments += arg
+    method = call.method.encode('utf8')
+    args   = list(call.args)
 
-    encoded  = pack('>cBB', b'c', 1, 0)
-    encoded += headers
-    encoded += pack('>cH', b'm', len(method)) + method
-    encoded += arguments
-    encoded += b'z'
+    encoder.write(b'H\x02\x00C')
 
-    return encoded
+    if not call.overload:
+        encoder.encode(method)
+        encoder.write(pack_int2(len(args)))
+        for arg in args:
+            encoder.encode(arg)
+    else:
+        # as in write_call, the arguments are held until the name is known
+        arguments = []
+        write, encoder.write = encoder.write, arguments.append
+        try:
+            for arg in args:
+                method += b'_' + encoder.encode(arg)
+        finally:
+            encoder.write = write
+
+        encoder.encode(method)
+        encoder.write(pack_int2(len(args)))
+        for piece in arguments:
+            encoder.write(piece)
+
+    return b'call'
+
+@writer_for(Reply, version=2)
+def write2_reply(encoder, reply):
+    if reply.headers:
+        raise TypeError("Hessian 2.0 replies cannot carry headers")
+
+    if isinstance(reply.value, Fault):
+        encoder.write(b'H\x02\x00FH')
+        write_fault_entries(encoder, reply.value)
+        encoder.write(b'Z')
+    else:
+        encoder.write(b'H\x02\x00R')
+        encoder.encode(reply.value)
 
+    return b'reply'
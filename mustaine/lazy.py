@@ -0,0 +1,527 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+import struct
+
+from mustaine.parser import Parser, ParseError, BufferInput, _SHORT, _REF, _END, _END2, _TYPE, _LENGTH, _STRING2_FINAL, _BINARY2_FINAL
+from mustaine.protocol import Object
+
+# Lazy decoding of payloads held in memory. Before a top-level value is
+# decoded, one pass over its bytes notes where each container inside it
+# starts and ends (and so how containers are numbered for references); lists
+# and maps are then returned as views that find and decode their elements
+# only when asked for them.
+
+# the size of values whose size follows from their tag alone, 0 where it doesn't
+_SIZES1 = bytearray(256)
+_SIZES2 = bytearray(256)
+
+for codes, size in ((b'NTF', 1), (b'I', 5), (b'R', 5), (b'LDd', 9)):
+    for code in codes:
+        _SIZES1[code] = size
+
+for codes, size in ((b'NTF', 1), (range(0x80, 0xc0), 1), (range(0xc0, 0xd0), 2), (range(0xd0, 0xd8), 3),
+                    (range(0xd8, 0xf0), 1), (range(0xf0, 0x100), 2), (range(0x38, 0x40), 3), (b'IYK', 5),
+                    (b'LDJ', 9), (b'[\\', 1), (b']', 2), (b'^', 3), (b'_', 5)):
+    for code in codes:
+        _SIZES2[code] = size
+
+for code in range(0x20, 0x30):
+    _SIZES2[code] = 1 + code - 0x20
+
+_CONTAINERS1 = frozenset(b'VM')
+_CONTAINERS2 = frozenset(list(b'UVWXHMO') + list(range(0x60, 0x80)))
+_MAPS        = frozenset(list(b'HMO') + list(range(0x60, 0x70)))
+
+
+class LazyList(Sequence):
+    """
+    A read-only list whose elements are decoded on first access and kept.
+    Compares equal to a list with the same elements.
+    """
+    def __init__(self, parser, start, stop):
+        self._parser  = parser
+        self._start   = start
+        self._stop    = stop
+        self._offsets = None
+        self._items   = None
+
+    def _index(self):
+        if self._offsets is None:
+            self._offsets = self._parser._index(self._start, self._stop)
+            self._items   = [_MISSING] * len(self._offsets)
+
+    def __len__(self):
+        self._index()
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        self._index()
+        item = self._items[index]
+        if item is _MISSING:
+            item = self._items[index] = self._parser._decode_at(self._offsets[index])
+
+        return item
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (list, LazyList)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+        return NotImplemented
+
+    def __repr__(self):
+        return "<mustaine.lazy.LazyList of %d items>" % (len(self),)
+
+
+class LazyMap(Mapping):
+    """
+    A read-only dict. The keys are decoded together on first access, each
+    value when it is first looked up.
+    """
+    def __init__(self, parser, start, stop):
+        self._parser = parser
+        self._start  = start
+        self._stop   = stop
+        self._keys   = None
+        self._values = {}
+
+    def _index(self):
+        if self._keys is None:
+            offsets = self._parser._index(self._start, self._stop)
+            decode  = self._parser._decode_at
+
+            keys = {}
+            for n in range(0, len(offsets), 2):
+                keys[decode(offsets[n])] = offsets[n + 1]
+
+            self._keys = keys
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            self._index()
+            value = self._values[key] = self._parser._decode_at(self._keys[key])
+            return value
+
+    def __iter__(self):
+        self._index()
+        return iter(self._keys)
+
+    def __len__(self):
+        self._index()
+        return len(self._keys)
+
+    def __repr__(self):
+        return "<mustaine.lazy.LazyMap of %d items>" % (len(self),)
+
+_MISSING = object()
+
+
+class LazyParser(Parser):
+    """
+    Decodes in-memory payloads (parse_string only) into LazyList and LazyMap
+    views instead of lists and dicts; typed maps still become Objects (or
+    instances of the class registered for their type, or compact objects
+    with `compact` set, see Parser), whose fields are decoded up front but
+    may themselves be views. Lists are always views, so `arrays` is refused.
+
+    References resolve to the view of the container they point at, decoded
+    or not. Views decode from the payload as they are used, so they keep it
+    alive, and each payload is decoded by a parser of its own.
+    """
+    HANDLERS = dict(Parser.HANDLERS)
+    HANDLERS.update({
+        b'V': '_lazy_container',
+        b'M': '_lazy_container',
+        b'R': '_lazy_ref',
+    })
+
+    HANDLERS2 = Parser.HANDLERS2 + (
+        (b'UVWXHMO',        '_lazy_container'),
+        (range(0x60, 0x80), '_lazy_container'),
+        (b'Q',              '_lazy_ref2'),
+        (b'C',              '_lazy_class_def'),
+    )
+
+    def __init__(self, arrays=False, compact=False, cache_size=1024):
+        if arrays:
+            raise TypeError('LazyParser decodes lists into views, not arrays')
+        Parser.__init__(self, compact=compact, cache_size=cache_size)
+
+    def parse_string(self, bypesarray):
+        if isinstance(bypesarray, str):
+            bypesarray = bypesarray.encode('utf-8')
+        elif not isinstance(bypesarray, bytes):
+            bypesarray = bytes(bypesarray)
+
+        # a parser of its own, built as this one was
+        parser = self.__class__(compact=self._compact, cache_size=self._cache_size)
+        parser._data = bypesarray
+        return parser._parse(BufferInput(bypesarray))
+
+    def parse_stream(self, stream):
+        raise TypeError('LazyParser can only decode payloads held in memory')
+
+    def _begin(self, input):
+        Parser._begin(self, input)
+
+        # where each container scanned so far starts and ends, and its
+        # reference number; all three grow in payload order
+        self._offsets = array('q')
+        self._ends    = array('q')
+        self._numbers = array('q')
+        self._scanned = 0
+
+    def _lazy_container(self, code):
+        start = self._input.tell() - 1
+        if start >= self._scanned:
+            self._scanned = self._scan(start)
+
+        index = bisect_left(self._offsets, start)
+        value = self._refs[self._numbers[index]]
+        if value is None:
+            value = self._materialize(index)
+
+        self._input.seek(self._ends[index])
+        return value
+
+    def _lazy_ref(self, code):
+        return self._resolve(self._unpack(_REF))
+
+    def _lazy_ref2(self, code):
+        return self._resolve(self._read2_int())
+
+    def _read_shared_ref(self, code):
+        # compact mode's reference handler, as in Parser
+        value = self._lazy_ref(code) if code == 0x52 else self._lazy_ref2(code)
+        if type(value) is Object:
+            self._shared.add(id(value))
+        return value
+
+    def _lazy_class_def(self, code):
+        # a definition inside a scanned value was recorded by the scan
+        if self._input.tell() > self._scanned:
+            self._read2_class_definition()
+        else:
+            self._input.seek(self._skip_class_definition(self._input.tell()))
+
+        code = self._read_tag()
+        return self._dispatch[code](code)
+
+    def _resolve(self, number):
+        try:
+            value = self._refs[number]
+        except IndexError:
+            raise ParseError("Encountered undefined reference %d" % (number,))
+
+        if value is None:
+            # materializing reads elsewhere in the payload
+            pos   = self._input.tell()
+            value = self._materialize(bisect_left(self._numbers, number))
+            self._input.seek(pos)
+
+        return value
+
+    def _decode_at(self, pos):
+        self._input.seek(pos)
+        code = self._read_tag()
+        return self._dispatch[code](code)
+
+    def _materialize(self, index):
+        # build the view (or Object) for the container scanned as `index`
+        start  = self._offsets[index]
+        number = self._numbers[index]
+        code   = self._data[start]
+
+        type_name, pos, end, count, fields = self._header(start, code, False)
+        stop = self._ends[index] - (1 if end is not None else 0)
+
+        if fields is not None:
+            result, schema = self._new_object(type_name, fields)
+            self._refs[number] = result
+
+            self._input.seek(pos)
+            self._read_fields(result, fields, schema)
+
+        elif type_name and code in _MAPS:
+            result, schema = self._new_object(type_name)
+            self._refs[number] = result
+
+            self._input.seek(pos)
+            self._read_map_entries(result, self._read_tag(), end, schema)
+            if self._compact and type(result) is Object:
+                result = self._compact_map(result, number)
+
+        elif code in _MAPS:
+            result = self._refs[number] = LazyMap(self, pos, stop)
+
+        else:
+            result = self._refs[number] = LazyList(self, pos, stop)
+
+        return result
+
+    def _header(self, pos, code, record):
+        # reads the header of the container at `pos`, returning its type, the
+        # offset of its first element, its end tag or element count, and the
+        # field names of an object
+        input = self._input
+        input.seek(pos + 1)
+
+        type   = None
+        end    = None
+        count  = None
+        fields = None
+
+        if self._dispatch is self._dispatch1:
+            end  = _END
+            next = self._read_tag()
+
+            if next == _TYPE:
+                type = self._read(self._unpack(_SHORT)) or None
+                next = self._read_tag()
+
+            if code == 0x56 and next == _LENGTH:
+                self._read(4)
+                next = self._read_tag()
+
+            return type, input.tell() - 1, end, count, fields
+
+        if code in (0x55, 0x56, 0x4d) or 0x70 <= code < 0x78:
+            type = self._read2_type(record) or None
+            if type is not None:
+                type = type.encode('utf-8')
+
+        if code in (0x55, 0x57, 0x48, 0x4d):
+            end = _END2
+        elif code in (0x56, 0x58):
+            count = self._read2_int()
+        elif code >= 0x70:
+            count = (code - 0x70) % 8
+        else:
+            index = self._read2_int() if code == 0x4f else code - 0x60
+            try:
+                type, fields = self._classes[index]
+            except IndexError:
+                raise ParseError("Encountered undefined class reference %d" % (index,))
+
+            count = len(fields)
+
+        return type, input.tell(), end, count, fields
+
+    def _scan(self, pos):
+        # walk the value at `pos` without decoding it, numbering its
+        # containers and noting where each ends; returns where it ends
+        data     = self._data
+        version2 = self._dispatch is self._dispatch2
+        sizes    = _SIZES2 if version2 else _SIZES1
+        opens    = _CONTAINERS2 if version2 else _CONTAINERS1
+        utf8_end = self._input.utf8_end
+        short    = _SHORT.unpack_from
+        offsets  = self._offsets
+        ends     = self._ends
+        numbers  = self._numbers
+        refs     = self._refs
+        stack    = []
+
+        try:
+            while True:
+                code = data[pos]
+                size = sizes[code]
+
+                # scalars, with the common strings inlined
+                if size:
+                    pos += size
+                elif code == 0x53 or (version2 and code < 0x20):
+                    if code == 0x53:
+                        start, length = pos + 3, short(data, pos + 1)[0]
+                    else:
+                        start, length = pos + 1, code
+
+                    pos = start + length
+                    if not data[start:pos].isascii():
+                        pos = utf8_end(start, length)
+
+                elif code in opens:
+                    stack.append([len(offsets), None, None])
+                    offsets.append(pos)
+                    ends.append(0)
+                    numbers.append(len(refs))
+                    refs.append(None)
+
+                    if version2:
+                        if code == 0x48 or code == 0x57:
+                            pos += 1
+                            stack[-1][1] = _END2
+                        elif code >= 0x78:
+                            pos += 1
+                            stack[-1][2] = code - 0x78
+                        else:
+                            _, pos, stack[-1][1], stack[-1][2], _ = self._header(pos, code, True)
+                    else:
+                        # the optional type and length of Hessian 1.0 headers
+                        pos += 1
+                        if data[pos] == _TYPE:
+                            pos += 3 + short(data, pos + 1)[0]
+                        if code == 0x56 and data[pos] == _LENGTH:
+                            pos += 5
+                        stack[-1][1] = _END
+
+                elif version2 and code == 0x43:
+                    self._input.seek(pos + 1)
+                    self._read2_class_definition()
+                    pos = self._input.tell()
+                    continue
+                else:
+                    pos = self._skip_scalar(pos, code, version2)
+
+                # close the containers this value completed
+                while stack:
+                    frame = stack[-1]
+                    if frame[2] is not None:
+                        if frame[2]:
+                            frame[2] -= 1
+                            break
+                    elif data[pos] != frame[1]:
+                        break
+                    else:
+                        pos += 1
+
+                    ends[frame[0]] = pos
+                    stack.pop()
+                else:
+                    break
+        except (IndexError, struct.error):
+            raise ParseError('Encountered unexpected end of stream')
+
+        if pos > len(data):
+            raise ParseError('Encountered unexpected end of stream')
+
+        return pos
+
+    def _index(self, pos, stop):
+        # the offsets of the values between `pos` and `stop`, stepping over
+        # scalars as _scan does and over containers by their noted ends
+        data     = self._data
+        version2 = self._dispatch is self._dispatch2
+        sizes    = _SIZES2 if version2 else _SIZES1
+        opens    = _CONTAINERS2 if version2 else _CONTAINERS1
+        utf8_end = self._input.utf8_end
+        short    = _SHORT.unpack_from
+        starts   = self._offsets
+        ends     = self._ends
+
+        offsets = array('q')
+        append  = offsets.append
+        while pos < stop:
+            append(pos)
+            code = data[pos]
+            size = sizes[code]
+
+            if size:
+                pos += size
+            elif code == 0x53 or (version2 and code < 0x20):
+                if code == 0x53:
+                    start, length = pos + 3, short(data, pos + 1)[0]
+                else:
+                    start, length = pos + 1, code
+
+                pos = start + length
+                if not data[start:pos].isascii():
+                    pos = utf8_end(start, length)
+
+            elif code in opens:
+                pos = ends[bisect_left(starts, pos)]
+            else:
+                pos = self._skip(pos)
+
+        return offsets
+
+    def _skip(self, pos):
+        data     = self._data
+        code     = data[pos]
+        version2 = self._dispatch is self._dispatch2
+
+        size = (_SIZES2 if version2 else _SIZES1)[code]
+        if size:
+            return pos + size
+        elif code in (_CONTAINERS2 if version2 else _CONTAINERS1):
+            return self._ends[bisect_left(self._offsets, pos)]
+        elif version2 and code == 0x43:
+            return self._skip(self._skip_class_definition(pos + 1))
+        else:
+            return self._skip_scalar(pos, code, version2)
+
+    def _skip_class_definition(self, pos):
+        self._input.seek(pos)
+        self._read2_string_value()
+        for _ in range(self._read2_int()):
+            self._read2_string_value()
+
+        return self._input.tell()
+
+    def _skip_scalar(self, pos, code, version2):
+        data     = self._data
+        utf8_end = self._input.utf8_end
+        short    = _SHORT.unpack_from
+
+        if not version2:
+            if code in (0x53, 0x58, 0x73, 0x78):
+                while data[pos] == code | 0x20:
+                    pos = utf8_end(pos + 3, short(data, pos + 1)[0])
+                if data[pos] != code & ~0x20:
+                    raise ParseError("Expected terminal string segment, got %r" % (data[pos:pos + 1],))
+                return utf8_end(pos + 3, short(data, pos + 1)[0])
+
+            elif code in (0x42, 0x62):
+                while data[pos] == 0x62:
+                    pos += 3 + short(data, pos + 1)[0]
+                if data[pos] != 0x42:
+                    raise ParseError("Expected terminal binary segment, got %r" % (data[pos:pos + 1],))
+                return pos + 3 + short(data, pos + 1)[0]
+
+            elif code == 0x72:
+                pos += 1
+                if data[pos] == _TYPE:
+                    pos += 3 + short(data, pos + 1)[0]
+                return self._skip_scalar(pos, data[pos], False)
+
+        else:
+            if code < 0x20:
+                return utf8_end(pos + 1, code)
+            elif 0x30 <= code < 0x34:
+                return utf8_end(pos + 2, ((code - 0x30) << 8) + data[pos + 1])
+            elif 0x34 <= code < 0x38:
+                return pos + 2 + ((code - 0x34) << 8) + data[pos + 1]
+            elif code == 0x53:
+                return utf8_end(pos + 3, short(data, pos + 1)[0])
+            elif code == 0x42:
+                return pos + 3 + short(data, pos + 1)[0]
+
+            elif code == 0x52:
+                while data[pos] == 0x52:
+                    pos = utf8_end(pos + 3, short(data, pos + 1)[0])
+                if data[pos] not in _STRING2_FINAL:
+                    raise ParseError("Expected terminal string segment, got %r" % (data[pos:pos + 1],))
+                return self._skip_scalar(pos, data[pos], True)
+
+            elif code == 0x41:
+                while data[pos] == 0x41:
+                    pos += 3 + short(data, pos + 1)[0]
+                if data[pos] not in _BINARY2_FINAL:
+                    raise ParseError("Expected terminal binary segment, got %r" % (data[pos:pos + 1],))
+                return pos + (_SIZES2[data[pos]] or self._skip_scalar(pos, data[pos], True) - pos)
+
+            elif code == 0x51:
+                size = _SIZES2[data[pos + 1]]
+                if size:
+                    return pos + 1 + size
+
+        raise ParseError("Unknown type marker %r" % (bytes((code,)),))
@@ -1,34 +1,445 @@
+from array import array
+from struct import Struct
 import datetime
-from struct import unpack
-
-from io import BytesIO
+import sys
 
 from mustaine.protocol import *
+from mustaine.schema import SCHEMAS, compact_schema
+from mustaine._util import BufferedReader, gather_run, utf8_length, utf8_sequence_length
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-# Implementation of Hessian 1.0.2 deserialization
+# Implementation of Hessian 1.0.2 and 2.0 deserialization
 #   see: http://hessian.caucho.com/doc/hessian-1.0-spec.xtp
+#        http://hessian.caucho.com/doc/hessian-serialization.html
 
 class ParseError(Exception):
     pass
 
+_INT    = Struct('>l')
+_LONG   = Struct('>q')
+_DOUBLE = Struct('>d')
+_REF    = Struct('>L')
+_SHORT  = Struct('>H')
+_INT16  = Struct('>h')
+_INT8   = Struct('>b')
+
+# tag bytes compared while walking lists and maps
+_END    = ord('z')
+_TYPE   = ord('t')
+_LENGTH = ord('l')
+
+# Hessian 2.0 ends variable-length lists and maps with an upper case 'Z', and
+# lets strings and binaries finish in any of their compact forms
+_END2          = ord('Z')
+_STRING2_FINAL = frozenset(list(range(0x00, 0x20)) + list(range(0x30, 0x34)) + [ord('S')])
+_STRING2       = _STRING2_FINAL | {ord('R')}
+_BINARY2_FINAL = frozenset(list(range(0x20, 0x30)) + list(range(0x34, 0x38)) + [ord('B')])
+
+# a Hessian 2.0 call in a version 1 envelope ('c\x02\x00') ends with a 'z' that
+# is also a two-element list, so where its arguments end can't be told
+_CALL2_ENVELOPE = "Hessian 2.0 calls must come in a Hessian 2.0 envelope ('H\\x02\\x00C')"
+
+# names longer than this are not worth keeping in a parser's intern cache
+_INTERN_LENGTH = 128
+
+# the fixed-size values Parser(arrays=True) decodes in bulk, the same in both
+# versions: their size, and the array.array typecode and numpy dtype they
+# are decoded into
+_RUNS = {
+    ord('D'): (8, 'd', '>f8'),
+    ord('I'): (4, 'i', '>i4'),
+    ord('L'): (8, 'q', '>i8'),
+}
+
+# Parsers pull bytes through one of two inputs. Both provide the same five
+# primitives: read(n) returns exactly n bytes, read_tag() returns the next
+# byte as an int, unpack(struct) returns the single value of a fixed-size
+# struct, read_utf8(n) returns a string of n characters, and
+# read_run(tag, size, limit) returns the `size`-byte payloads of one or more
+# consecutive `tag` values (at most `limit`, the first tag already read),
+# joined together, stopping short of the next tag.
+
+class StreamInput(object):
+    """ Reads from any object with a read() method """
+    def __init__(self, stream):
+        self._stream = stream
+
+    def read(self, n):
+        try:
+            r = self._stream.read(n)
+        except (IOError, EOFError):
+            raise ParseError('Encountered unexpected end of stream')
+        else:
+            if len(r) < n:
+                raise ParseError('Encountered unexpected end of stream')
+
+        return r
+
+    def read_tag(self):
+        return self.read(1)[0]
+
+    def unpack(self, struct):
+        return struct.unpack(self.read(struct.size))[0]
+
+    def read_utf8(self, length):
+        # every character has exactly one byte that is not a continuation
+        # byte, so each read of `remaining` bytes can never overshoot; keep
+        # reading until all characters have started, then finish the last one
+        chunks    = []
+        remaining = length
+        while remaining:
+            chunk = self.read(remaining)
+            chunks.append(chunk)
+            remaining -= utf8_length(chunk)
+
+        if chunks and not chunk.isascii():
+            for back in range(1, min(4, len(chunk)) + 1):
+                lead = chunk[-back]
+                if not 0x80 <= lead < 0xC0:
+                    break
+
+            missing = utf8_sequence_length(lead) - back
+            if missing > 0:
+                chunks.append(self.read(missing))
+
+        try:
+            if len(chunks) == 1:
+                return chunk.decode('utf-8')
+            else:
+                return b''.join(chunks).decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise ParseError("Encountered malformed UTF-8 string: %s" % (e,))
+
+    def read_run(self, tag, size, limit=None):
+        # a plain stream can't look ahead for the next tag, so runs are
+        # handed over one value at a time
+        return self.read(size)
+
+
+class ReaderInput(StreamInput):
+    """
+    Reads from a mustaine._util.BufferedReader, whose buffer already offers
+    the tag and number primitives; they are used without another layer of
+    calls, and the reader's EOFError is translated by Parser.parse_stream.
+    """
+    def __init__(self, reader):
+        self._stream  = reader
+        self.read     = reader.read
+        self.read_tag = reader.read_byte
+        self.unpack   = reader.unpack
+
+    def read_run(self, tag, size, limit=None):
+        # as much of the run as is buffered at the moment
+        window = self._stream.peek(size)
+        count, values = gather_run(window, 0, len(window), tag, size, limit)
+        if not count:
+            raise ParseError('Encountered unexpected end of stream')
+
+        self._stream.read(count * (size + 1) - 1)
+        return values
+
+
+class BufferInput(object):
+    """
+    Decodes a payload held entirely in memory by tracking an offset into it.
+    Tags and numbers are read in place, and only strings and binaries are
+    copied out of the buffer.
+    """
+    def __init__(self, data):
+        if not isinstance(data, bytes):
+            data = bytes(data)
+
+        self._data = data
+        self._view = memoryview(data)
+        self._size = len(data)
+        self._pos  = 0
+
+    def read(self, n):
+        pos = self._pos
+        end = pos + n
+        if end > self._size:
+            raise ParseError('Encountered unexpected end of stream')
+
+        self._pos = end
+        return self._data[pos:end]
+
+    def read_tag(self):
+        pos = self._pos
+        if pos >= self._size:
+            raise ParseError('Encountered unexpected end of stream')
+
+        self._pos = pos + 1
+        return self._data[pos]
+
+    def unpack(self, struct):
+        pos = self._pos
+        end = pos + struct.size
+        if end > self._size:
+            raise ParseError('Encountered unexpected end of stream')
+
+        self._pos = end
+        return struct.unpack_from(self._data, pos)[0]
+
+    def read_utf8(self, length):
+        start = self._pos
+        end   = start + length
+        chunk = self._data[start:end]
+
+        if len(chunk) < length:
+            raise ParseError('Encountered unexpected end of stream')
+
+        if not chunk.isascii():
+            end   = self.utf8_end(start, length)
+            chunk = self._view[start:end]
+
+        self._pos = end
+        try:
+            return str(chunk, 'utf-8')
+        except UnicodeDecodeError as e:
+            raise ParseError("Encountered malformed UTF-8 string: %s" % (e,))
+
+    def utf8_end(self, start, length):
+        # the offset just past `length` characters starting at `start`;
+        # character starts are counted window by window as StreamInput does,
+        # then the last character is completed from its lead byte (what
+        # follows may itself look like a continuation byte in Hessian 2.0)
+        data = self._data
+        end  = start + length
+        if end <= self._size and data[start:end].isascii():
+            return end
+
+        end       = start
+        remaining = length
+        while remaining:
+            window = data[end:end + remaining]
+            if len(window) < remaining:
+                raise ParseError('Encountered unexpected end of stream')
+
+            remaining -= utf8_length(window)
+            end       += len(window)
+
+        if end > start:
+            lead = end - 1
+            while lead > start and 0x80 <= data[lead] < 0xC0:
+                lead -= 1
+
+            end = max(end, lead + utf8_sequence_length(data[lead]))
+            if end > self._size:
+                raise ParseError('Encountered unexpected end of stream')
+
+        return end
+
+    def read_run(self, tag, size, limit=None):
+        count, values = gather_run(self._data, self._pos, self._size, tag, size, limit)
+        if not count:
+            raise ParseError('Encountered unexpected end of stream')
+
+        self._pos += count * (size + 1) - 1
+        return values
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos):
+        self._pos = pos
+
+
 class Parser(object):
+    # value handlers, keyed by the tag byte that introduces the value
+    HANDLERS = {
+        b'N': '_read_null',
+        b'T': '_read_true',
+        b'F': '_read_false',
+        b'I': '_read_int',
+        b'L': '_read_long',
+        b'D': '_read_double',
+        b'd': '_read_date',
+        b's': '_read_string_chunks',
+        b'x': '_read_string_chunks',
+        b'S': '_read_string_object',
+        b'X': '_read_string_object',
+        b'b': '_read_binary_chunks',
+        b'B': '_read_binary_object',
+        b'r': '_read_remote_object',
+        b'R': '_read_ref',
+        b'V': '_read_list_object',
+        b'M': '_read_map_object',
+    }
+
+    # Hessian 2.0 value handlers, keyed by the tag bytes that introduce them
+    HANDLERS2 = (
+        (range(0x00, 0x20), '_read2_compact_string'),
+        (range(0x20, 0x30), '_read2_compact_binary'),
+        (range(0x30, 0x34), '_read2_medium_string'),
+        (range(0x34, 0x38), '_read2_medium_binary'),
+        (range(0x38, 0x40), '_read2_long_3'),
+        (b'A',              '_read2_binary_chunks'),
+        (b'B',              '_read2_binary'),
+        (b'C',              '_read2_class_def'),
+        (b'D',              '_read_double'),
+        (b'F',              '_read_false'),
+        (b'H',              '_read2_map'),
+        (b'I',              '_read_int'),
+        (b'J',              '_read2_date'),
+        (b'K',              '_read2_date_minutes'),
+        (b'L',              '_read_long'),
+        (b'M',              '_read2_map'),
+        (b'N',              '_read_null'),
+        (b'O',              '_read2_object'),
+        (b'Q',              '_read2_ref'),
+        (b'R',              '_read2_string_chunks'),
+        (b'S',              '_read2_string'),
+        (b'T',              '_read_true'),
+        (b'UW',             '_read2_variable_list'),
+        (b'VX',             '_read2_fixed_list'),
+        (b'Y',              '_read_int'),
+        (b'[\\]^_',      '_read2_double'),
+        (range(0x60, 0x70), '_read2_object'),
+        (range(0x70, 0x80), '_read2_fixed_list'),
+        (range(0x80, 0xc0), '_read2_int_1'),
+        (range(0xc0, 0xd0), '_read2_int_2'),
+        (range(0xd0, 0xd8), '_read2_int_3'),
+        (range(0xd8, 0xf0), '_read2_long_1'),
+        (range(0xf0, 0x100), '_read2_long_2'),
+    )
+
+    # iterparse handlers for values that are not decoded whole; each returns
+    # the event to yield and the _Frame of a container left open, if any
+    OPENERS = {
+        b'V': '_open_list',
+        b'M': '_open_map',
+        b'R': '_open_ref',
+    }
+
+    OPENERS2 = (
+        (b'UW',             '_open2_variable_list'),
+        (b'VX',             '_open2_fixed_list'),
+        (range(0x70, 0x80), '_open2_fixed_list'),
+        (b'HM',             '_open2_map'),
+        (b'O',              '_open2_object'),
+        (range(0x60, 0x70), '_open2_object'),
+        (b'Q',              '_open2_ref'),
+    )
+
+    def __init__(self, arrays=False, compact=False, cache_size=1024):
+        """
+        With `arrays` set, lists made up of doubles, ints or longs alone are
+        decoded in bulk into numpy arrays, or into array.array objects where
+        numpy is not installed. Lists that merely start with such values
+        still become lists, but their leading run is decoded in bulk too.
+
+        With `compact` set, typed values of unregistered types are decoded
+        into __slots__ classes made for each type and set of field names
+        (see mustaine.schema.CompactObject) rather than into Objects. A typed
+        map referred to from within itself stays an Object.
+
+        Map keys and type names are shared between the values decoded by one
+        parser through a cache of up to `cache_size` names (0 disables it),
+        as the same few tend to recur across many maps.
+        """
+        self._arrays  = arrays
+        self._compact = compact
+
+        self._interned   = {}
+        self._cache_size = cache_size
+
+        # 256-entry tables of bound handlers, indexed by tag byte, one for
+        # each protocol version; the message header picks which one is used
+        self._dispatch1 = [self._read_unknown] * 256
+        for code, handler in self.HANDLERS.items():
+            self._dispatch1[ord(code)] = getattr(self, handler)
+
+        self._dispatch2 = [self._read_unknown] * 256
+        for codes, handler in self.HANDLERS2:
+            for code in codes:
+                self._dispatch2[code] = getattr(self, handler)
+
+        self._dispatch = self._dispatch1
+
+        if compact:
+            # a typed map is only known to be compactable once read whole, so
+            # references handing it out before then are watched for
+            self._dispatch1[ord('R')] = self._dispatch2[ord('Q')] = self._read_shared_ref
+
+        # the same, for the containers and references iterparse opens itself
+        self._openers1 = dict((ord(code), getattr(self, opener)) for code, opener in self.OPENERS.items())
+        self._openers2 = dict((code, getattr(self, opener)) for codes, opener in self.OPENERS2 for code in codes)
+
     def parse_string(self, bypesarray):
         if isinstance(bypesarray, str):
-            stream = BytesIO(bypesarray.encode('utf-8'))
-        else:
-            stream = BytesIO(bypesarray)
+            bypesarray = bypesarray.encode('utf-8')
 
-        return self.parse_stream(stream)
+        # whole payloads in memory are decoded in place, by offset
+        return self._parse(BufferInput(bypesarray))
 
     def parse_stream(self, stream):
-        self._refs   = []
-        self._result = None
-
-        if hasattr(stream, 'read') and hasattr(stream.read, '__call__'):
-            self._stream = stream
+        if isinstance(stream, BufferedReader):
+            try:
+                return self._parse(ReaderInput(stream))
+            except EOFError:
+                raise ParseError('Encountered unexpected end of stream')
+        elif hasattr(stream, 'read') and hasattr(stream.read, '__call__'):
+            return self._parse(StreamInput(stream))
         else:
             raise TypeError('Stream parser can only handle objects supporting read()')
 
+    def iterparse(self, source):
+        """
+        Decodes a message piece by piece as it is read from `source` (a
+        stream, as for parse_stream, or a bytes-like payload), yielding
+        (event, value) pairs instead of building the object graph:
+
+            start_call, end_call, start_reply, end_reply    None
+            header, method                                  the name
+            fault                                           a Fault
+            start_list                                      the list type, or None
+            start_map                                       the map or object type, or None
+            key                                             the key, decoded whole
+            end_list, end_map                               None
+            value                                           a scalar, string or Binary
+            ref                                             a reference number
+
+        Containers are numbered from 0 in the order they start, which is what
+        a `ref` event's value refers to; since nothing is kept, resolving it
+        is up to the caller. Chunked strings and binaries are joined into a
+        single value.
+        """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            input = BufferInput(source)
+        elif isinstance(source, BufferedReader):
+            input = ReaderInput(source)
+        elif hasattr(source, 'read') and hasattr(source.read, '__call__'):
+            input = StreamInput(source)
+        else:
+            raise TypeError('Event parser can only handle bytes or objects supporting read()')
+
+        try:
+            yield from self._iterparse(input)
+        except EOFError:
+            raise ParseError('Encountered unexpected end of stream')
+
+    def _begin(self, input):
+        self._refs     = []
+        self._types    = []
+        self._classes  = []
+        self._shared   = set()
+        self._result   = None
+        self._dispatch = self._dispatch1
+
+        # the primitive readers are bound straight to the input for speed
+        self._input     = input
+        self._read      = input.read
+        self._read_tag  = input.read_tag
+        self._unpack    = input.unpack
+        self._read_utf8 = input.read_utf8
+
+    def _parse(self, input):
+        self._begin(input)
+
         while True:
             code = self._read(1)
 
@@ -37,7 +448,9 @@ class Parser(object):
                     raise ParseError('Encountered duplicate type header')
 
                 version = self._read(2)
-                if version != b'\x01\x00':
+                if version == b'\x02\x00':
+                    raise ParseError(_CALL2_ENVELOPE)
+                elif version != b'\x01\x00':
                     raise ParseError("Encountered unrecognized call version %r" % (version,))
 
                 self._result = Call()
@@ -48,19 +461,30 @@ class Parser(object):
                     raise ParseError('Encountered duplicate type header')
 
                 version = self._read(2)
-                if version != b'\x01\x00':
+                if version == b'\x02\x00':
+                    return self._read_reply2_body()
+                elif version != b'\x01\x00':
                     raise ParseError("Encountered unrecognized reply version %r" % (version,))
 
                 self._result = Reply()
                 continue
 
+            elif code == b'H' and self._result is None:
+                version = self._read(2)
+                if version != b'\x02\x00':
+                    raise ParseError("Encountered unrecognized message version %r" % (version,))
+
+                # a Hessian 2.0 envelope holds exactly one message, unterminated
+                self._dispatch = self._dispatch2
+                return self._read_message2()
+
             else:
                 if not self._result:
                     raise ParseError("Invalid Hessian message marker: %r" % (code,))
 
                 if   code == b'H':
-                    key, value = self._read_keyval()
-                    self._result.headers[key] = value
+                    key = self._read(self._unpack(_SHORT)).decode('utf-8')
+                    self._result.headers[key] = self._read_object(self._read_tag())
                     continue
 
                 elif code == b'm':
@@ -70,7 +494,7 @@ class Parser(object):
                     if self._result.method:
                         raise ParseError('Encountered duplicate method name definition')
 
-                    self._result.method = self._read(unpack('>H', self._read(2))[0])
+                    self._result.method = self._read(self._unpack(_SHORT)).decode('utf-8')
                     continue
 
                 elif code == b'f':
@@ -88,98 +512,105 @@ class Parser(object):
 
                 else:
                     if isinstance(self._result, Call):
-                        self._result.args.append(self._read_object(code))
+                        self._result.args.append(self._read_object(code[0]))
                     else:
                         if self._result.value:
                             raise ParseError('Encountered illegal extra object within reply')
 
-                        self._result.value = self._read_object(code)
+                        self._result.value = self._read_object(code[0])
 
         # have to hit a 'z' to land here, TODO derefs?
         return self._result
 
 
-    def _read(self, n):
-        try:
-            r = self._stream.read(n)
-        except IOError:
-            raise ParseError('Encountered unexpected end of stream')
-        except:
-            raise
-        else:
-            if len(r) == 0:
-                raise ParseError('Encountered unexpected end of stream')
+    def _read_object(self, code):
+        return self._dispatch[code](code)
 
-        return r
+    def _read_null(self, code):
+        return None
 
-    def _read_object(self, code):
-        if   code == b'N':
-            return None
-        elif code == b'T':
-            return True
-        elif code == b'F':
-            return False
-        elif code == b'I':
-            return int(unpack('>l', self._read(4))[0])
-        elif code == b'L':
-            return int(unpack('>q', self._read(8))[0])
-        elif code == b'D':
-            return float(unpack('>d', self._read(8))[0])
-        elif code == b'd':
-            return self._read_date()
-        elif code == b's' or code == b'x':
-            fragment = self._read_string()
-            next     = self._read(1)
-            if next.lower() == code:
-                return fragment + self._read_object(next)
-            else:
-                raise ParseError("Expected terminal string segment, got %r" % (next,))
-        elif code == b'S' or code == b'X':
-            return self._read_string()
-        elif code == b'b':
-            fragment = self._read_binary()
-            next     = self._read(1)
-            if next.lower() == code:
-                return fragment + self._read_object(next)
-            else:
-                raise ParseError("Expected terminal binary segment, got %r" % (next,))
-        elif code == b'B':
-            return self._read_binary()
-        elif code == b'r':
-            return self._read_remote()
-        elif code == b'R':
-            return self._refs[unpack(">L", self._read(4))[0]]
-        elif code == b'V':
-            return self._read_list()
-        elif code == b'M':
-            return self._read_map()
-        else:
-            raise ParseError("Unknown type marker %r" % (code,))
+    def _read_true(self, code):
+        return True
+
+    def _read_false(self, code):
+        return False
+
+    def _read_int(self, code):
+        return self._unpack(_INT)
+
+    def _read_long(self, code):
+        return self._unpack(_LONG)
+
+    def _read_double(self, code):
+        return self._unpack(_DOUBLE)
+
+    def _read_string_chunks(self, code):
+        # any number of non-final chunks (code) followed by a final one
+        # (code in upper case), gathered first and joined once
+        fragments = [self._read_string()]
+        next      = self._read_tag()
+        while next == code:
+            fragments.append(self._read_string())
+            next = self._read_tag()
+
+        if next != code & ~0x20:
+            raise ParseError("Expected terminal string segment, got %r" % (bytes((next,)),))
+
+        fragments.append(self._read_string())
+        return ''.join(fragments)
+
+    def _read_string_object(self, code):
+        return self._read_string()
+
+    def _read_binary_chunks(self, code):
+        # as _read_string_chunks, wrapping the joined bytes just once
+        fragments = [self._read(self._unpack(_SHORT))]
+        next      = self._read_tag()
+        while next == code:
+            fragments.append(self._read(self._unpack(_SHORT)))
+            next = self._read_tag()
+
+        if next != code & ~0x20:
+            raise ParseError("Expected terminal binary segment, got %r" % (bytes((next,)),))
+
+        fragments.append(self._read(self._unpack(_SHORT)))
+        return Binary(b''.join(fragments))
+
+    def _read_binary_object(self, code):
+        return self._read_binary()
 
-    def _read_date(self):
-        timestamp = unpack('>q', self._read(8))[0]
+    def _read_remote_object(self, code):
+        return self._read_remote()
+
+    def _read_ref(self, code):
+        return self._refs[self._unpack(_REF)]
+
+    def _read_shared_ref(self, code):
+        # compact mode's reference handler in both versions, noting the
+        # Objects it hands out
+        value = self._read_ref(code) if code == 0x52 else self._read2_ref(code)
+        if type(value) is Object:
+            self._shared.add(id(value))
+        return value
+
+    def _read_list_object(self, code):
+        return self._read_list()
+
+    def _read_map_object(self, code):
+        return self._read_map()
+
+    def _read_unknown(self, code):
+        raise ParseError("Unknown type marker %r" % (bytes((code,)),))
+
+    def _read_date(self, code=None):
+        timestamp = self._unpack(_LONG)
         return datetime.datetime.fromtimestamp(timestamp / 1000)
 
     def _read_string(self):
-        len = unpack('>H', self._read(2))[0]
-
-        bytes = []
-        while len > 0:
-            byte = self._read(1)
-            if ord(byte) in range(0x00, 0x7F):
-                bytes.append(byte)
-            elif ord(byte) in range(0xC2, 0xDF):
-                bytes.append(byte + self._read(1))
-            elif ord(byte) in range(0xE0, 0xEF):
-                bytes.append(byte + self._read(2))
-            elif ord(byte) in range(0xF0, 0xF4):
-                bytes.append(byte + self._read(3))
-            len -= 1
-
-        return b''.join(bytes).decode('utf-8')
+        return self._read_utf8(self._unpack(_SHORT))
 
     def _read_binary(self):
-        len = unpack('>H', self._read(2))[0]
+        len = self._unpack(_SHORT)
         return Binary(self._read(len))
 
     def _read_remote(self):
@@ -187,7 +618,7 @@ class Parser(object):
         code = self._read(1)
 
         if code == b't':
-            r.type = self._read(unpack('>H', self._read(2))[0])
+            r.type = self._read(self._unpack(_SHORT))
             code   = self._read(1)
         else:
             r.type = None
@@ -195,61 +626,172 @@ class Parser(object):
         if code != b's' and code != b'S':
             raise ParseError("Expected string object while parsing Remote object URL")
 
+        code = code[0]
         r.url = self._read_object(code)
         return r
 
     def _read_list(self):
-        code = self._read(1)
+        code = self._read_tag()
 
-        if code == b't':
+        if code == _TYPE:
             # read and discard list type
-            self._read(unpack('>H', self._read(2))[0])
-            code = self._read(1)
+            self._read(self._unpack(_SHORT))
+            code = self._read_tag()
 
-        if code == b'l':
+        if code == _LENGTH:
             # read and discard list length
             self._read(4)
-            code = self._read(1)
+            code = self._read_tag()
 
         result = []
+        if self._arrays and code in _RUNS:
+            run, code = self._read_run(code)
+            if code == _END:
+                self._refs.append(run)
+                return run
+
+            result = run.tolist()
+
         self._refs.append(result)
 
-        while code != b'z':
-            result.append(self._read_object(code))
-            code = self._read(1)
+        append   = result.append
+        dispatch = self._dispatch
+        read_tag = self._read_tag
+        while code != _END:
+            append(dispatch[code](code))
+            code = read_tag()
 
         return result
 
+    def _read_run(self, code, limit=None):
+        # decode the values of the run `code` starts in bulk, returning them
+        # as an array along with the tag that ended the run (None once the
+        # run reaches `limit`)
+        size, typecode, dtype = _RUNS[code]
+
+        read_run = self._input.read_run
+        chunks   = []
+        count    = 0
+        while True:
+            values = read_run(code, size, None if limit is None else limit - count)
+            chunks.append(values)
+            count += len(values) // size
+
+            if count == limit:
+                next = None
+                break
+
+            next = self._read_tag()
+            if next != code:
+                break
+
+        values = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+        if numpy is not None:
+            return numpy.frombuffer(values, dtype).astype(dtype[1:]), next
+
+        result = array(typecode)
+        result.frombytes(values)
+        if sys.byteorder == 'little':
+            result.byteswap()
+
+        return result, next
+
     def _read_map(self):
-        code = self._read(1)
+        code = self._read_tag()
 
-        if code == b't':
-            type_len = unpack('>H', self._read(2))[0]
+        if code == _TYPE:
+            type_len = self._unpack(_SHORT)
             if type_len > 0:
                 # a typed map deserializes to an object
-                result = Object(self._read(type_len))
+                result, schema = self._new_object(self._intern(self._read(type_len)))
             else:
-                result = {}
+                result, schema = {}, None
 
-            code = self._read(1)
+            code = self._read_tag()
         else:
             # untyped maps deserialize to a dict
-            result = {}
+            result, schema = {}, None
 
+        index = len(self._refs)
         self._refs.append(result)
+        result = self._read_map_entries(result, code, _END, schema)
+
+        if self._compact and type(result) is Object:
+            result = self._compact_map(result, index)
+        return result
+
+    def _new_object(self, meta_type, fields=None):
+        # typed values become instances of the class registered for their
+        # type (see mustaine.schema), compact objects where their `fields`
+        # are known up front and compact mode is on, and Objects otherwise
+        schema = SCHEMAS.get(meta_type)
+        if schema is None and fields is not None and self._compact:
+            schema = compact_schema(meta_type, fields)
+
+        if schema is None:
+            return Object(meta_type), None
+
+        return schema.new(), schema
+
+    def _compact_map(self, obj, index):
+        # swap the Object a typed map was read into, reference number `index`,
+        # for a compact object, unless it has been handed out already
+        if id(obj) in self._shared:
+            return obj
 
-        fields = {}
-        while code != b'z':
-            key, value  = self._read_keyval(code)
+        state  = obj.__getstate__()
+        schema = compact_schema(state.pop('__meta_type'), tuple(state))
+        if schema is None:
+            return obj
 
-            if isinstance(result, Object):
+        result  = schema.new()
+        setattr = object.__setattr__
+        for name, value in state.items():
+            setattr(result, name, value)
+
+        self._refs[index] = result
+        return result
+
+    def _read_map_entries(self, result, code, end, schema=None):
+        # fill `result` with key/value pairs starting at tag `code`, up to the
+        # `end` tag; typed maps are Objects, whose keys are attribute names,
+        # or instances of a registered class, whose fields are set in place
+        fields   = {}
+        dispatch = self._dispatch
+        read_tag = self._read_tag
+        typed    = isinstance(result, Object)
+
+        if schema is not None:
+            known   = schema.known
+            setattr = object.__setattr__
+            while code != end:
+                key   = dispatch[code](code)
+                code  = read_tag()
+                value = dispatch[code](code)
+                if key in known:
+                    setattr(result, key, value)
+                code = read_tag()
+
+            return result
+
+        interned = self._interned.get
+        intern   = self._intern
+        while code != end:
+            key   = dispatch[code](code)
+            code  = read_tag()
+            value = dispatch[code](code)
+
+            if type(key) is str:
+                key = interned(key) or intern(key)
+
+            if typed:
                 fields[str(key)] = value
             else:
                 fields[key] = value
 
-            code = self._read(1)
+            code = read_tag()
 
-        if isinstance(result, Object):
+        if typed:
             fields['__meta_type'] = result._meta_type
             result.__setstate__(fields)
         else:
@@ -257,13 +799,559 @@ class Parser(object):
 
         return result
 
+    def _intern(self, name):
+        # the copy of a key or type name shared by everything this parser
+        # decodes; the cache drops its oldest names when full, and long names
+        # are never kept, so hostile payloads can't grow it without limit
+        interned = self._interned.get(name)
+        if interned is not None:
+            return interned
+
+        if len(name) > _INTERN_LENGTH or not self._cache_size:
+            return name
+
+        if len(self._interned) >= self._cache_size:
+            del self._interned[next(iter(self._interned))]
+
+        self._interned[name] = name
+        return name
+
     def _read_fault(self):
         fault = self._read_map()
         return Fault(fault['code'], fault['message'], fault.get('detail'))
 
-    def _read_keyval(self, first=None):
-        key   = self._read_object(first or self._read(1))
-        value = self._read_object(self._read(1))
 
-        return key, value
+    # Hessian 2.0
+
+    def _read_message2(self):
+        code = self._read_tag()
+
+        if code == ord('C'):
+            self._result = Call()
+            self._result.method = self._read2_string_value()
+            self._result.args   = [self._read_object(self._read_tag()) for _ in range(self._read2_int())]
+
+        elif code == ord('R'):
+            self._result = Reply(self._read_object(self._read_tag()))
+
+        elif code == ord('F'):
+            fault = self._read_object(self._read_tag())
+            self._result = Reply(Fault(fault['code'], fault['message'], fault.get('detail')))
+
+        else:
+            raise ParseError("Invalid Hessian 2.0 message marker: %r" % (bytes((code,)),))
+
+        return self._result
+
+    def _read_reply2_body(self):
+        # a Hessian 2.0 body in a version 1 envelope ('r\x02\x00'): a fault
+        # or exactly one value, then the 'z'; tags that are envelope markers
+        # in version 1 ('H', 'm', 'z') are values here
+        self._dispatch = self._dispatch2
+        code = self._read_tag()
+        if code == ord('f'):
+            self._result = Reply(self._read_fault())
+        else:
+            self._result = Reply(self._read_object(code))
+
+        if self._read_tag() != _END:
+            raise ParseError('Encountered illegal extra object within reply')
+        return self._result
+
+    def _read2_int(self, code=None):
+        # lengths, counts and indices are plain int values
+        if code is None:
+            code = self._read_tag()
+
+        value = self._dispatch[code](code)
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ParseError("Expected integer, got %r" % (bytes((code,)),))
+
+        return value
+
+    def _read2_string_value(self):
+        code = self._read_tag()
+        if code not in _STRING2:
+            raise ParseError("Expected string, got %r" % (bytes((code,)),))
+
+        return self._dispatch[code](code)
+
+    def _read2_type(self, record=True):
+        # a type is given by name the first time, then by its index
+        code = self._read_tag()
+        if code in _STRING2:
+            type = self._dispatch[code](code)
+            if record:
+                self._types.append(type)
+            return type
+
+        index = self._read2_int(code)
+        try:
+            return self._types[index]
+        except IndexError:
+            raise ParseError("Encountered undefined type reference %d" % (index,))
+
+    def _read2_compact_string(self, code):
+        return self._read_utf8(code)
+
+    def _read2_medium_string(self, code):
+        return self._read_utf8(((code - 0x30) << 8) + self._read_tag())
+
+    def _read2_string(self, code):
+        return self._read_utf8(self._unpack(_SHORT))
+
+    def _read2_string_chunks(self, code):
+        fragments = []
+        while code == 0x52:
+            fragments.append(self._read_utf8(self._unpack(_SHORT)))
+            code = self._read_tag()
+
+        if code not in _STRING2_FINAL:
+            raise ParseError("Expected terminal string segment, got %r" % (bytes((code,)),))
+
+        fragments.append(self._dispatch[code](code))
+        return ''.join(fragments)
+
+    def _read2_compact_binary(self, code):
+        return Binary(self._read(code - 0x20))
+
+    def _read2_medium_binary(self, code):
+        return Binary(self._read(((code - 0x34) << 8) + self._read_tag()))
+
+    def _read2_binary(self, code):
+        return Binary(self._read(self._unpack(_SHORT)))
+
+    def _read2_binary_chunks(self, code):
+        fragments = []
+        while code == 0x41:
+            fragments.append(self._read(self._unpack(_SHORT)))
+            code = self._read_tag()
+
+        if code not in _BINARY2_FINAL:
+            raise ParseError("Expected terminal binary segment, got %r" % (bytes((code,)),))
+
+        fragments.append(self._dispatch[code](code).value)
+        return Binary(b''.join(fragments))
+
+    def _read2_int_1(self, code):
+        return code - 0x90
+
+    def _read2_int_2(self, code):
+        return ((code - 0xc8) << 8) + self._read_tag()
+
+    def _read2_int_3(self, code):
+        return ((code - 0xd4) << 16) + self._unpack(_SHORT)
+
+    def _read2_long_1(self, code):
+        return code - 0xe0
+
+    def _read2_long_2(self, code):
+        return ((code - 0xf8) << 8) + self._read_tag()
+
+    def _read2_long_3(self, code):
+        return ((code - 0x3c) << 16) + self._unpack(_SHORT)
+
+    def _read2_double(self, code):
+        if code == 0x5b:
+            return 0.0
+        elif code == 0x5c:
+            return 1.0
+        elif code == 0x5d:
+            return float(self._unpack(_INT8))
+        elif code == 0x5e:
+            return float(self._unpack(_INT16))
+        else:
+            # thousandths, as written by the reference implementation
+            return 0.001 * self._unpack(_INT)
+
+    def _read2_date(self, code):
+        return datetime.datetime.fromtimestamp(self._unpack(_LONG) / 1000)
+
+    def _read2_date_minutes(self, code):
+        return datetime.datetime.fromtimestamp(self._unpack(_INT) * 60)
+
+    def _read2_ref(self, code):
+        index = self._read2_int()
+        try:
+            return self._refs[index]
+        except IndexError:
+            raise ParseError("Encountered undefined reference %d" % (index,))
+
+    def _read2_variable_list(self, code):
+        if code == 0x55:
+            self._read2_type()
+
+        result = []
+        code   = self._read_tag()
+        if self._arrays and code in _RUNS:
+            run, code = self._read_run(code)
+            if code == _END2:
+                self._refs.append(run)
+                return run
+
+            result = run.tolist()
+
+        self._refs.append(result)
+
+        append   = result.append
+        dispatch = self._dispatch
+        read_tag = self._read_tag
+        while code != _END2:
+            append(dispatch[code](code))
+            code = read_tag()
+
+        return result
+
+    def _read2_fixed_list(self, code):
+        if code == 0x56:
+            self._read2_type()
+            length = self._read2_int()
+        elif code == 0x58:
+            length = self._read2_int()
+        elif code < 0x78:
+            self._read2_type()
+            length = code - 0x70
+        else:
+            length = code - 0x78
+
+        result = []
+        if self._arrays and length:
+            code = self._read_tag()
+            if code in _RUNS:
+                run, code = self._read_run(code, length)
+                if code is None:
+                    self._refs.append(run)
+                    return run
+
+                result = run.tolist()
+
+            self._refs.append(result)
+            result.append(self._dispatch[code](code))
+            length -= len(result)
+        else:
+            self._refs.append(result)
+
+        append   = result.append
+        dispatch = self._dispatch
+        read_tag = self._read_tag
+        for _ in range(length):
+            code = read_tag()
+            append(dispatch[code](code))
+
+        return result
+
+    def _read2_map(self, code):
+        type_name = self._read2_type() if code == 0x4d else None
+        if type_name:
+            result, schema = self._new_object(self._intern(type_name.encode('utf-8')))
+        else:
+            result, schema = {}, None
+
+        index = len(self._refs)
+        self._refs.append(result)
+        result = self._read_map_entries(result, self._read_tag(), _END2, schema)
+
+        if self._compact and type(result) is Object:
+            result = self._compact_map(result, index)
+        return result
+
+    def _read2_class_def(self, code):
+        self._read2_class_definition()
+
+        # a definition is always followed by the value that needs it
+        code = self._read_tag()
+        return self._dispatch[code](code)
+
+    def _read2_class_definition(self):
+        type_name = self._intern(self._read2_string_value().encode('utf-8'))
+        fields    = tuple(self._intern(self._read2_string_value()) for _ in range(self._read2_int()))
+        self._classes.append((type_name, fields))
+
+    def _read2_object(self, code):
+        index = self._read2_int() if code == 0x4f else code - 0x60
+        try:
+            meta_type, fields = self._classes[index]
+        except IndexError:
+            raise ParseError("Encountered undefined class reference %d" % (index,))
+
+        result, schema = self._new_object(meta_type, fields)
+        self._refs.append(result)
+        return self._read_fields(result, fields, schema)
+
+    def _read_fields(self, result, fields, schema):
+        # read the values of `fields`, in order, into an Object or an
+        # instance of a registered class
+        dispatch = self._dispatch
+        read_tag = self._read_tag
+
+        if schema is None:
+            state = {'__meta_type': result._meta_type}
+            for name in fields:
+                code = read_tag()
+                state[name] = dispatch[code](code)
+
+            result.__setstate__(state)
+            return result
+
+        known   = schema.known
+        setattr = object.__setattr__
+        for name in fields:
+            code  = read_tag()
+            value = dispatch[code](code)
+            if name in known:
+                setattr(result, name, value)
+
+        return result
+
+    # Event parsing
+
+    def _iterparse(self, input):
+        self._begin(input)
+
+        # containers are counted rather than kept
+        self._refs = _StreamedRefs()
+
+        code = self._read_tag()
+        if code == ord('H'):
+            version = self._read(2)
+            if version != b'\x02\x00':
+                raise ParseError("Encountered unrecognized message version %r" % (version,))
+
+            self._dispatch = self._dispatch2
+            code = self._read_tag()
+
+            if code == ord('C'):
+                yield 'start_call', None
+                yield 'method', self._read2_string_value()
+                for _ in range(self._read2_int()):
+                    yield from self._iter_value(self._read_tag())
+                yield 'end_call', None
+
+            elif code == ord('R'):
+                yield 'start_reply', None
+                yield from self._iter_value(self._read_tag())
+                yield 'end_reply', None
+
+            elif code == ord('F'):
+                fault = self._read_object(self._read_tag())
+                yield 'start_reply', None
+                yield 'fault', Fault(fault['code'], fault['message'], fault.get('detail'))
+                yield 'end_reply', None
+
+            else:
+                raise ParseError("Invalid Hessian 2.0 message marker: %r" % (bytes((code,)),))
+
+            return
+
+        if code == ord('c'):
+            kind = 'call'
+        elif code == ord('r'):
+            kind = 'reply'
+        else:
+            raise ParseError("Invalid Hessian message marker: %r" % (bytes((code,)),))
+
+        version = self._read(2)
+        if version == b'\x02\x00':
+            if kind == 'call':
+                raise ParseError(_CALL2_ENVELOPE)
+
+            # as in _read_reply2_body
+            self._dispatch = self._dispatch2
+            yield 'start_reply', None
+            code = self._read_tag()
+            if code == ord('f'):
+                yield 'fault', self._read_fault()
+            else:
+                yield from self._iter_value(code)
+            if self._read_tag() != _END:
+                raise ParseError('Encountered illegal extra object within reply')
+            yield 'end_reply', None
+            return
+        elif version != b'\x01\x00':
+            raise ParseError("Encountered unrecognized %s version %r" % (kind, version,))
+
+        yield 'start_' + kind, None
+
+        while True:
+            code = self._read_tag()
+
+            if code == ord('H'):
+                yield 'header', self._read(self._unpack(_SHORT)).decode('utf-8')
+                yield from self._iter_value(self._read_tag())
+
+            elif code == ord('m'):
+                if kind != 'call':
+                    raise ParseError('Encountered illegal method name within reply')
+
+                yield 'method', self._read(self._unpack(_SHORT)).decode('utf-8')
+
+            elif code == ord('f'):
+                if kind != 'reply':
+                    raise ParseError('Encountered illegal fault within call')
+
+                yield 'fault', self._read_fault()
+
+            elif code == _END:
+                yield 'end_' + kind, None
+                return
+
+            else:
+                yield from self._iter_value(code)
+
+    def _iter_value(self, code):
+        # yields the events of the value starting at tag `code`; open
+        # containers are kept on a stack, so nesting costs no recursion
+        dispatch = self._dispatch
+        read_tag = self._read_tag
+        version2 = dispatch is self._dispatch2
+        openers  = self._openers2 if version2 else self._openers1
+        stack    = []
+
+        while True:
+            if version2 and code == 0x43:
+                # a class definition, followed by the object that needs it
+                self._read2_class_definition()
+                code = read_tag()
+                continue
+
+            opener = openers.get(code)
+            if opener is None:
+                yield 'value', dispatch[code](code)
+            else:
+                event, frame = opener(code)
+                yield event
+                if frame is not None:
+                    stack.append(frame)
+
+            # find the tag of the next value, closing finished containers
+            while stack:
+                frame = stack[-1]
+
+                if frame.fields is not None:
+                    if frame.remaining:
+                        yield 'key', frame.fields[-frame.remaining]
+                        frame.remaining -= 1
+                        code = read_tag()
+                        break
+
+                elif frame.remaining is not None:
+                    if frame.remaining:
+                        frame.remaining -= 1
+                        code = read_tag()
+                        break
+
+                else:
+                    if frame.pending is not None:
+                        code, frame.pending = frame.pending, None
+                    else:
+                        code = read_tag()
+
+                    if code != frame.end:
+                        if frame.map:
+                            yield 'key', dispatch[code](code)
+                            code = read_tag()
+                        break
+
+                stack.pop()
+                yield ('end_map' if frame.map else 'end_list'), None
+            else:
+                return
+
+    def _open_list(self, code):
+        type = None
+        code = self._read_tag()
+
+        if code == _TYPE:
+            type = self._read(self._unpack(_SHORT)).decode('utf-8') or None
+            code = self._read_tag()
+
+        if code == _LENGTH:
+            self._read(4)
+            code = self._read_tag()
+
+        self._refs.append(None)
+        return ('start_list', type), _Frame(False, end=_END, pending=code)
+
+    def _open_map(self, code):
+        type = None
+        code = self._read_tag()
+
+        if code == _TYPE:
+            type = self._read(self._unpack(_SHORT)).decode('utf-8') or None
+            code = self._read_tag()
+
+        self._refs.append(None)
+        return ('start_map', type), _Frame(True, end=_END, pending=code)
+
+    def _open_ref(self, code):
+        return ('ref', self._unpack(_REF)), None
+
+    def _open2_variable_list(self, code):
+        type = self._read2_type() if code == 0x55 else None
+
+        self._refs.append(None)
+        return ('start_list', type), _Frame(False, end=_END2)
+
+    def _open2_fixed_list(self, code):
+        type = None
+        if code == 0x56:
+            type   = self._read2_type()
+            length = self._read2_int()
+        elif code == 0x58:
+            length = self._read2_int()
+        elif code < 0x78:
+            type   = self._read2_type()
+            length = code - 0x70
+        else:
+            length = code - 0x78
+
+        self._refs.append(None)
+        return ('start_list', type), _Frame(False, remaining=length)
+
+    def _open2_map(self, code):
+        type = self._read2_type() or None if code == 0x4d else None
+
+        self._refs.append(None)
+        return ('start_map', type), _Frame(True, end=_END2)
+
+    def _open2_object(self, code):
+        index = self._read2_int() if code == 0x4f else code - 0x60
+        try:
+            meta_type, fields = self._classes[index]
+        except IndexError:
+            raise ParseError("Encountered undefined class reference %d" % (index,))
+
+        self._refs.append(None)
+        return ('start_map', meta_type.decode('utf-8')), _Frame(True, remaining=len(fields), fields=fields)
+
+    def _open2_ref(self, code):
+        return ('ref', self._read2_int()), None
+
+
+class _Frame(object):
+    # a container left open by Parser.iterparse: it ends at tag `end`, after
+    # `remaining` more values, or, for objects, once each of `fields` is read
+    __slots__ = ('map', 'end', 'remaining', 'fields', 'pending')
+
+    def __init__(self, map, end=None, remaining=None, fields=None, pending=None):
+        self.map       = map
+        self.end       = end
+        self.remaining = remaining
+        self.fields    = fields
+        self.pending   = pending
+
+
+class _StreamedRefs(object):
+    # stands in for the reference list during Parser.iterparse, numbering
+    # containers without keeping them
+    def __init__(self):
+        self.count = 0
+
+    def append(self, value):
+        self.count += 1
+
+    def __len__(self):
+        return self.count
 
+    def __getitem__(self, index):
+        raise ParseError("Cannot resolve reference %d while streaming" % (index,))
@@ -0,0 +1,170 @@
+from http.client import HTTPConnection, HTTPSConnection
+import selectors
+import ssl
+import threading
+import time
+
+
+class PoolStats(object):
+    """ Counters describing how a ConnectionPool has been used """
+    def __init__(self):
+        self.hits       = 0 # checkouts served by an idle connection
+        self.misses     = 0 # checkouts that had to open a new connection
+        self.reconnects = 0 # reused connections found dead mid-request
+        self.evictions  = 0 # idle connections dropped as stale or expired
+
+    def __repr__(self):
+        return "<mustaine.pool.PoolStats: hits=%d misses=%d reconnects=%d evictions=%d>" % (
+            self.hits, self.misses, self.reconnects, self.evictions,)
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class _HeaderBlocks(object):
+    def putheaders(self, block):
+        """
+        Send `block`, header lines serialized beforehand by header_block(),
+        where putheader() would send them one by one.
+        """
+        if block:
+            self._buffer.append(block)
+
+class PoolHTTPConnection(_HeaderBlocks, HTTPConnection):
+    pass
+
+class PoolHTTPSConnection(_HeaderBlocks, HTTPSConnection):
+    pass
+
+def header_block(headers):
+    """
+    The (name, value) pairs of `headers` as putheaders() takes them, checked
+    and encoded by putheader() itself (which raises ValueError for names or
+    values that would break the request apart).
+    """
+    connection = HTTPConnection('localhost')
+    connection.putrequest('POST', '/', skip_host=True, skip_accept_encoding=True)
+    for name, value in headers:
+        connection.putheader(name, value)
+    # the request line is the first
+    return b'\r\n'.join(connection._buffer[1:])
+
+
+class PooledConnection(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.created    = time.monotonic()
+        self.last_used  = self.created
+        self.reused     = False
+
+
+class ConnectionPool(object):
+    """
+    A bounded pool of HTTP/1.1 keep-alive connections to a single host.
+
+    At most `max_size` idle connections are retained. Idle connections are
+    evicted once unused for `max_idle` seconds, and any connection is retired
+    once it has been open for `max_lifetime` seconds (None disables either
+    limit).
+
+    The pool is safe to share between threads; each checkout owns its
+    connection exclusively until it is handed back through put() or discard().
+    Its connections take header blocks through putheaders().
+    """
+    def __init__(self, uri, timeout=10, key_file=None, cert_file=None, max_size=4, max_idle=60, max_lifetime=None):
+        if uri.scheme == 'http':
+            self._factory = lambda: PoolHTTPConnection(uri.hostname, uri.port or 80, timeout=timeout)
+        elif uri.scheme == 'https':
+            context = ssl.create_default_context()
+            if cert_file:
+                context.load_cert_chain(cert_file, key_file)
+
+            self._factory = lambda: PoolHTTPSConnection(uri.hostname, uri.port or 443, timeout=timeout, context=context)
+        else:
+            raise NotImplementedError("HessianProxy only supports http:// and https:// URIs")
+
+        self._idle         = []
+        self._max_size     = max_size
+        self._max_idle     = max_idle
+        self._max_lifetime = max_lifetime
+        self.stats         = PoolStats()
+        self._lock         = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+
+        while True:
+            with self._lock:
+                if not self._idle:
+                    self.stats.misses += 1
+                    break
+
+                pooled = self._idle.pop()
+
+            # health checks happen outside the lock, the connection is ours now
+            if self._expired(pooled, now) or self._stale(pooled):
+                with self._lock:
+                    self.stats.evictions += 1
+                pooled.connection.close()
+                continue
+
+            with self._lock:
+                self.stats.hits += 1
+            pooled.reused = True
+            return pooled
+
+        return PooledConnection(self._factory())
+
+    def put(self, pooled):
+        pooled.last_used = time.monotonic()
+
+        if not self._expired(pooled, pooled.last_used):
+            with self._lock:
+                if len(self._idle) < self._max_size:
+                    self._idle.append(pooled)
+                    return
+
+        pooled.connection.close()
+
+    def discard(self, pooled):
+        pooled.connection.close()
+
+    def reconnect(self, pooled):
+        # the server dropped a connection we thought was alive
+        with self._lock:
+            self.stats.reconnects += 1
+        pooled.connection.close()
+        return PooledConnection(self._factory())
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for pooled in idle:
+            pooled.connection.close()
+
+    def _expired(self, pooled, now):
+        if self._max_idle is not None and now - pooled.last_used > self._max_idle:
+            return True
+        if self._max_lifetime is not None and now - pooled.created > self._max_lifetime:
+            return True
+
+        return False
+
+    def _stale(self, pooled):
+        sock = pooled.connection.sock
+        if sock is None:
+            return False
+
+        # an idle keep-alive socket has nothing to say; if it polls readable
+        # the peer has either half-closed it or sent garbage we can't use
+        # (a selector rather than select(), which refuses descriptors past
+        # FD_SETSIZE and would have every connection of a busy process evicted)
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(sock, selectors.EVENT_READ)
+                readable = selector.select(0)
+        except (OSError, ValueError):
+            return True
+
+        return bool(readable)
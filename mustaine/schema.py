@@ -0,0 +1,210 @@
+from collections import OrderedDict
+from operator import attrgetter
+from struct import pack
+import dataclasses
+import keyword
+
+from mustaine.encoder import encode_object, pack_int2, writer_for
+
+# Registered classes: instances of a class registered for a Hessian type are
+# written as objects of that type, and objects of that type are decoded into
+# instances of the class, field by field, without going through Object
+
+SCHEMAS = {} # meta type (bytes) -> Schema
+COMPACT = OrderedDict() # (meta type, fields) -> Schema of a CompactObject class, or None
+
+# the most compact classes kept at once; the least recently used go first, so
+# hostile payloads naming ever new types can't grow the cache without limit
+COMPACT_SIZE = 1024
+
+class Schema(object):
+    """ How instances of `cls` travel as Hessian objects of type `meta_type` """
+    def __init__(self, cls, meta_type, fields):
+        self.cls       = cls
+        self.meta_type = meta_type
+        self.fields    = fields
+        self.known     = frozenset(fields)
+
+        # a tuple of the values of `fields`, in order
+        if len(fields) > 1:
+            self.values = attrgetter(*fields)
+        elif fields:
+            self.values = lambda obj, get=attrgetter(fields[0]): (get(obj),)
+        else:
+            self.values = lambda obj: ()
+
+    def new(self):
+        # instances are filled in field by field, their __init__ is bypassed
+        return self.cls.__new__(self.cls)
+
+    def __repr__(self):
+        return "<mustaine.schema.Schema: %s as %s>" % (self.cls.__name__, self.meta_type.decode('utf-8'),)
+
+def register(meta_type, fields=None):
+    """
+    Class decorator registering the class as Hessian type `meta_type`:
+
+        @register('example.Car')
+        @dataclasses.dataclass
+        class Car(object):
+            color: str
+            model: str
+
+    The fields sent and expected default to those of a dataclass, or to the
+    __slots__ of a class and its bases. Fields of decoded objects that the
+    class does not declare are dropped.
+    """
+    if isinstance(meta_type, str):
+        meta_type = meta_type.encode('utf-8')
+
+    def wrap(cls):
+        schema = Schema(cls, meta_type, declared_fields(cls) if fields is None else tuple(fields))
+
+        SCHEMAS[meta_type] = schema
+        writer_for(cls)(compile_writer(schema))
+        writer_for(cls, version=2)(compile_writer2(schema))
+        return cls
+    return wrap
+
+def declared_fields(cls):
+    if dataclasses.is_dataclass(cls):
+        return tuple(field.name for field in dataclasses.fields(cls))
+
+    fields = []
+    for base in reversed(cls.__mro__):
+        slots = base.__dict__.get('__slots__', ())
+        for name in ((slots,) if isinstance(slots, str) else slots):
+            if name not in ('__dict__', '__weakref__') and name not in fields:
+                fields.append(name)
+
+    if not fields:
+        raise TypeError("%s declares no fields; pass them to register()" % (cls.__name__,))
+
+    return tuple(fields)
+
+def compile_writer(schema):
+    # a writer of typed maps, with the type and keys encoded up front
+    short  = schema.meta_type.rpartition(b'.')[2]
+    header = pack('>2cH', b'M', b't', len(schema.meta_type)) + schema.meta_type
+    keys   = [encode_object(name) for name in schema.fields]
+    values = schema.values
+
+    def write_registered(encoder, obj):
+        if encoder.reference(obj):
+            return short
+
+        write, encode = encoder.write, encoder.encode
+
+        write(header)
+        for key, value in zip(keys, values(obj)):
+            write(key)
+            encode(value)
+        write(b'z')
+        return short
+    return write_registered
+
+def compile_writer2(schema):
+    # a writer of Hessian 2.0 objects, with the class definition encoded up
+    # front; definitions are shared with Objects of the same type and fields
+    short      = schema.meta_type.rpartition(b'.')[2]
+    key        = (schema.meta_type, schema.fields)
+    definition = b''.join([b'C', encode_object(schema.meta_type, version=2), pack_int2(len(schema.fields))] +
+                          [encode_object(name, version=2) for name in schema.fields])
+    values     = schema.values
+
+    def write2_registered(encoder, obj):
+        if encoder.reference(obj):
+            return short
+
+        index = encoder._classes.get(key)
+        if index is None:
+            index = encoder._classes[key] = len(encoder._classes)
+            encoder.write(definition)
+
+        if index < 0x10:
+            encoder.write(bytes((0x60 + index,)))
+        else:
+            encoder.write(b'O' + pack_int2(index))
+
+        encode = encoder.encode
+        for value in values(obj):
+            encode(value)
+        return short
+    return write2_registered
+
+
+# Compact objects: Parser(compact=True) decodes typed values whose type is
+# not registered into instances of a __slots__ class synthesized, once, for
+# their type and field names, instead of into Objects with a __dict__ each
+
+class CompactObject(object):
+    """
+    Base of the classes synthesized for compact objects. Instances behave as
+    Objects do: fields are attributes, the type is `_meta_type`, and their
+    state (as used by pickle) is the same dict an Object's would be.
+    """
+    __slots__ = ()
+
+    _meta_type       = None
+    _hessian_writers = None
+
+    def __repr__(self):
+        return "<%s object at %s>" % (self._meta_type, hex(id(self)),)
+
+    def __getstate__(self):
+        state = dict((name, getattr(self, name)) for name in self.__slots__ if hasattr(self, name))
+        state['__meta_type'] = self._meta_type
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            if name != '__meta_type':
+                object.__setattr__(self, name, value)
+
+    def __reduce__(self):
+        return compact_object, (self._meta_type, self.__slots__), self.__getstate__()
+
+def compact_schema(meta_type, fields):
+    """
+    The Schema of the compact class for `meta_type` and `fields`, built the
+    first time it is asked for; None if the field names can't be slots.
+    """
+    key = (meta_type, fields)
+    try:
+        schema = COMPACT[key]
+        COMPACT.move_to_end(key)
+        return schema
+    except KeyError:
+        pass
+
+    reserved = dir(CompactObject)
+    if len(set(fields)) != len(fields) or not all(
+            isinstance(name, str) and name.isidentifier() and not keyword.iskeyword(name) and
+            name not in reserved and not (name.startswith('__') and not name.endswith('__'))
+            for name in fields):
+        schema = None
+    else:
+        name = meta_type.rpartition(b'.')[2].decode('utf-8', 'replace')
+        cls  = type(name if name.isidentifier() else 'CompactObject', (CompactObject,), {
+            '__slots__':  fields,
+            '_meta_type': meta_type,
+        })
+
+        # written exactly as an Object with the same fields would be; the
+        # writers go with the class (see Encoder.encode), which is dropped
+        # with its last instance once evicted
+        schema = Schema(cls, meta_type, fields)
+        cls._hessian_writers = (compile_writer(schema), compile_writer2(schema))
+
+    schema = COMPACT.setdefault(key, schema)
+    while len(COMPACT) > COMPACT_SIZE:
+        try:
+            COMPACT.popitem(last=False)
+        except KeyError:
+            break
+    return schema
+
+def compact_object(meta_type, fields):
+    # an empty instance of the compact class for `meta_type` and `fields`,
+    # as unpickling needs it
+    return compact_schema(meta_type, tuple(fields)).new()
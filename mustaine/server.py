@@ -0,0 +1,257 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+import re
+import threading
+
+from mustaine.encoder import encode_object
+from mustaine.parser import Parser
+from mustaine.protocol import Call, Fault, Reply
+from mustaine._util import CODINGS, BufferedReader, InflatingReader, compress
+
+
+# the suffix Java clients give overloaded methods: the argument count
+ARITY_SUFFIX = re.compile(r'^(.+)__(\d+)$')
+
+# the argument types mustaine's overloaded method names may end with (see
+# Encoder.encode); typed arrays are '[' and their element type, and typed
+# objects go by the short name of their class
+TYPE_SUFFIXES = frozenset(['null', 'bool', 'int', 'long', 'double', 'date', 'string', 'binary', 'list', 'map', 'remote'])
+
+class HessianServer(object):
+    """
+    A WSGI application serving the public methods of `handler` as a Hessian
+    service:
+
+        class Calculator(object):
+            def add(self, a, b):
+                return a + b
+
+        application = HessianServer(Calculator())
+
+    Overloaded method names are mapped back onto their handler method, be
+    they mustaine's (`add_int_int`, see HessianProxy) or Java's (`add__2`).
+    Calls are parsed as their body is read, and answered in the protocol
+    version they came in. Exceptions raised by the handler are sent back
+    as Faults (a Fault raised is sent as is).
+
+    The application may be called from any number of threads at once, each
+    of which parses with its own Parser; the handler has to be thread-safe.
+
+    With `references` set, replies refer back to containers repeated within
+    them (see mustaine.encoder.Encoder). Requests may come compressed, and
+    replies of `compress_threshold` bytes or more are compressed for clients
+    that accept it (None disables this). Requests whose body exceeds
+    `max_request_size` bytes, once inflated, are refused with a 413.
+    """
+    def __init__(self, handler, references=False, buffer_size=65535, compress_threshold=1024, max_request_size=16 * 1024 * 1024):
+        self._handler            = handler
+        self._references         = references
+        self._buffer_size        = buffer_size
+        self._compress_threshold = compress_threshold
+        self._max_request_size   = max_request_size
+        self._local              = threading.local()
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'POST':
+            start_response('405 Method Not Allowed', [('Allow', 'POST'), ('Content-Type', 'text/plain')])
+            return [b'Hessian requests must be POSTed\n']
+
+        length = environ.get('CONTENT_LENGTH')
+        if length:
+            try:
+                length = int(length)
+            except ValueError:
+                length = -1
+            if length < 0:
+                start_response('400 Bad Request', [('Content-Type', 'text/plain')])
+                return [b'Invalid Content-Length\n']
+        elif environ.get('wsgi.input_terminated'):
+            length = None
+        else:
+            start_response('411 Length Required', [('Content-Type', 'text/plain')])
+            return [b'Hessian requests must have a Content-Length\n']
+
+        limit = self._max_request_size
+        if length is not None and length > limit:
+            start_response('413 Payload Too Large', [('Content-Type', 'text/plain')])
+            return [b'Hessian request too large\n']
+
+        body = environ['wsgi.input']
+        if length is None or environ.get('HTTP_CONTENT_ENCODING', 'identity').lower() in CODINGS:
+            # bodies of unknown length, and compressed ones (reading them by
+            # chunks could block past their end), are read whole; inflating
+            # stops past the limit, whatever the compression ratio
+            body = body.read(limit + 1) if length is None else body.read(length)
+            try:
+                if environ.get('HTTP_CONTENT_ENCODING', 'identity').lower() in CODINGS:
+                    body = InflatingReader(BytesIO(body)).read(limit + 1)
+            except Exception:
+                start_response('400 Bad Request', [('Content-Type', 'text/plain')])
+                return [b'Malformed request body\n']
+
+            if len(body) > limit:
+                start_response('413 Payload Too Large', [('Content-Type', 'text/plain')])
+                return [b'Hessian request too large\n']
+            body, length = BytesIO(body), len(body)
+
+        reader = BufferedReader(body, buffer_size=self._buffer_size, length=length)
+        try:
+            version = message_version(reader.peek(3)[:3].tobytes())
+        except Exception:
+            version = 1
+
+        body = self.encode_reply(self.dispatch(self.read_call(reader)), version)
+
+        headers = [('Content-Type', 'application/x-hessian')]
+
+        coding = accepted_coding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding and self._compress_threshold is not None and len(body) >= self._compress_threshold:
+            body = compress(body, coding)
+            headers.append(('Content-Encoding', coding))
+
+        headers.append(('Content-Length', str(len(body))))
+        start_response('200 OK', headers)
+        return [body]
+
+    def dispatch(self, call):
+        """ Perform `call`, returning its result, or a Fault if it failed """
+        if isinstance(call, Fault):
+            return call
+
+        method = self.resolve(call.method, len(call.args))
+        if method is None:
+            return no_such_method(call.method)
+
+        try:
+            return method(*call.args)
+        except Exception as e:
+            return service_fault(e)
+
+    def encode_reply(self, value, version=1):
+        """ The encoding of a reply carrying `value` """
+        try:
+            return encode_object(Reply(value), references=self._references, version=version)
+        except Exception as e:
+            fault = Fault('ServiceException', "Cannot encode reply: %s: %s" % (e.__class__.__name__, e), None)
+            return encode_object(Reply(fault), version=version)
+
+    def resolve(self, name, arg_count):
+        """
+        The handler method a call of `name` with `arg_count` arguments goes
+        to, or None. Only public methods are served.
+        """
+        method = self._public(name)
+        if method is not None:
+            return method
+
+        # method_type1_type2 from mustaine's overloaded calls; only type names
+        # are taken off, so `delete_everything` never runs `delete`
+        if arg_count:
+            parts = name.rsplit('_', arg_count)
+            if len(parts) == arg_count + 1 and all(part.lstrip('[') in TYPE_SUFFIXES or part[:1].isupper() for part in parts[1:]):
+                method = self._public(parts[0])
+                if method is not None:
+                    return method
+
+        # method__2 from Java's
+        match = ARITY_SUFFIX.match(name)
+        if match and int(match.group(2)) == arg_count:
+            return self._public(match.group(1))
+
+        return None
+
+    def _public(self, name):
+        if not name or name.startswith('_'):
+            return None
+
+        method = getattr(self._handler, name, None)
+        return method if callable(method) else None
+
+    def read_call(self, source):
+        """
+        The Call in `source`, a request body or a reader of one, or the
+        Fault to answer it with if it is not one.
+        """
+        # (anything going wrong while decoding is the request's fault)
+        parser = self._parser()
+        try:
+            if isinstance(source, (bytes, bytearray)):
+                call = parser.parse_string(source)
+            else:
+                call = parser.parse_stream(source)
+        except Exception as e:
+            return Fault('ProtocolException', "Malformed Hessian call: %s: %s" % (e.__class__.__name__, e), None)
+
+        if not isinstance(call, Call):
+            return Fault('ProtocolException', "Expected a Hessian call", None)
+
+        return call
+
+    def _parser(self):
+        # as in HessianProxy, each thread gets a Parser of its own
+        try:
+            return self._local.parser
+        except AttributeError:
+            self._local.parser = Parser()
+            return self._local.parser
+
+
+def message_version(head):
+    """ The protocol version of a message starting with the bytes `head` """
+    return 2 if head[:1] == b'H' or head[:3] == b'c\x02\x00' else 1
+
+def no_such_method(name):
+    return Fault('NoSuchMethodException', "The service has no method named: %s" % (name,), None)
+
+def service_fault(exception):
+    """ The Fault answering a call whose handler raised `exception` """
+    if isinstance(exception, Fault):
+        return exception
+
+    return Fault('ServiceException', "%s: %s" % (exception.__class__.__name__, exception), None)
+
+def accepted_coding(accept_encoding):
+    """ The content coding to reply in, given a request's Accept-Encoding """
+    accepted = [coding.split(';')[0].strip().lower() for coding in accept_encoding.split(',')]
+    for coding in ('gzip', 'deflate'):
+        if coding in accepted:
+            return coding
+    return None
+
+
+class _QuietHandler(WSGIRequestHandler):
+    # HessianProxy keeps connections alive, which wsgiref's HTTP/1.0 replies
+    # won't do; they are still correct, just closed after each call
+    def log_message(self, *args):
+        pass
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """
+    wsgiref's WSGIServer, handling each connection on one of `threads`
+    worker threads rather than in turn.
+    """
+    request_queue_size = 128
+
+    def __init__(self, address, handler=_QuietHandler, threads=16):
+        WSGIServer.__init__(self, address, handler)
+        self._executor = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self._executor.submit(ThreadingMixIn.process_request_thread, self, request, client_address)
+
+    def server_close(self):
+        WSGIServer.server_close(self)
+        self._executor.shutdown(wait=False)
+
+def make_server(handler, host='127.0.0.1', port=0, threads=16, **options):
+    """
+    A ThreadPoolWSGIServer serving `handler` through a HessianServer built
+    with `options`; call serve_forever() on it to start serving. Meant for
+    development and tests; production deployments should hand the
+    HessianServer to a WSGI server of their own.
+    """
+    server = ThreadPoolWSGIServer((host, port), threads=threads)
+    server.set_app(HessianServer(handler, **options))
+    return server
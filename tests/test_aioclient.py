@@ -0,0 +1,76 @@
+import asyncio
+
+from mustaine.aioclient import AsyncHessianProxy
+from mustaine import protocol
+from test_client import serve, serve_compressing, SlowEcho, Reaping, FaultyEcho
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_awaitable_calls_reuse_connections():
+    server, url = serve()
+    try:
+        async def calls():
+            proxy = AsyncHessianProxy(url)
+            return [await proxy.count() for _ in range(5)], proxy.pool_stats
+
+        results, stats = run(calls())
+        assert results == [1, 2, 3, 4, 5]
+        assert stats.misses == 1
+        assert stats.hits == 4
+    finally:
+        server.shutdown()
+
+def test_dropped_connections_are_replaced():
+    server, url = serve(Reaping)
+    try:
+        async def calls():
+            proxy = AsyncHessianProxy(url)
+            first = await proxy.count()
+            await asyncio.sleep(0.1)
+            return first, await proxy.count()
+
+        assert run(calls()) == (1, 2)
+    finally:
+        server.shutdown()
+
+def test_concurrent_calls_do_not_block_the_loop():
+    server, url = serve(SlowEcho)
+    try:
+        async def calls():
+            proxy = AsyncHessianProxy(url, pool_size=50)
+            return await asyncio.gather(*[proxy.echo(n) for n in range(200)])
+
+        assert run(calls()) == list(range(200))
+
+        # the calls were in progress side by side, not one after the other
+        assert server.most >= 10
+    finally:
+        server.shutdown()
+
+def test_batch_returns_results_and_faults_in_order():
+    server, url = serve(FaultyEcho)
+    try:
+        async def calls():
+            proxy = AsyncHessianProxy(url)
+            return await proxy.batch([('echo', (n,)) for n in range(-2, 30)], parallelism=5)
+
+        results = run(calls())
+        assert results[2:] == list(range(30))
+        assert all(isinstance(fault, protocol.Fault) for fault in results[:2])
+    finally:
+        server.shutdown()
+
+def test_compressed_requests_and_replies():
+    server, url = serve_compressing('deflate')
+    try:
+        async def calls():
+            proxy = AsyncHessianProxy(url, compression='gzip')
+            return await proxy.echo('x'), await proxy.echo('x' * 5000)
+
+        assert run(calls()) == (['x'], ['x' * 5000])
+        assert server.encodings == [None, 'gzip']
+        assert server.accepted == 'gzip, deflate'
+    finally:
+        server.shutdown()
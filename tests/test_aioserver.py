@@ -0,0 +1,193 @@
+import asyncio
+import threading
+
+import pytest
+
+from mustaine.aioclient import AsyncHessianProxy
+from mustaine.aioserver import AsyncHessianServer
+from mustaine.client import HessianProxy
+from mustaine.encoder import encode_object
+from mustaine.parser import Parser
+from mustaine.protocol import Call, Fault
+from mustaine._util import compress
+
+
+class Service(object):
+    def __init__(self):
+        self.running  = 0
+        self.most     = 0
+        self.blocked  = 0
+        self.lock     = threading.Lock()
+        self.released = threading.Event()
+
+    async def add(self, a, b):
+        return a + b
+
+    async def wait(self, seconds):
+        self.running += 1
+        self.most = max(self.most, self.running)
+        await asyncio.sleep(seconds)
+        self.running -= 1
+        return seconds
+
+    def block(self):
+        # a plain method, run in the executor, held until released
+        with self.lock:
+            self.blocked += 1
+        self.released.wait(5)
+        return threading.current_thread().name
+
+    async def fail(self):
+        raise ValueError('bad')
+
+def run(test, handler=None, **options):
+    # runs the coroutine function `test` with the url of a server started
+    # with `options`, and the server itself
+    async def main():
+        service = AsyncHessianServer(handler or Service(), **options)
+        server  = await service.serve()
+        try:
+            return await test("http://127.0.0.1:%d/" % (server.sockets[0].getsockname()[1],), service)
+        finally:
+            server.close()
+
+    return asyncio.run(main())
+
+async def request(url, data):
+    # sends raw `data`, returning (status line, headers, body) of the reply
+    host, port = url[7:-1].split(':')
+    reader, writer = await asyncio.open_connection(host, int(port))
+    try:
+        writer.write(data)
+        head    = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        headers = dict((name.lower(), value) for name, value in (line.split(': ', 1) for line in head[1:] if line))
+        body    = await reader.readexactly(int(headers.get('content-length', 0)))
+        return head[0], headers, body
+    finally:
+        writer.close()
+
+def post(body, *headers):
+    return b'\r\n'.join([b'POST / HTTP/1.1', b'Host: test', b'Content-Length: %d' % (len(body),)] + list(headers)) + b'\r\n\r\n' + body
+
+
+def test_coroutine_and_blocking_handlers():
+    async def test(url, service):
+        proxy = AsyncHessianProxy(url, pool_size=20)
+        assert await proxy.add(1, 2) == 3
+
+        # sleeps overlap on the loop...
+        assert await asyncio.gather(*[proxy.wait(0.2) for _ in range(20)]) == [0.2] * 20
+        assert handler.most >= 10
+
+        # ...and blocking calls in the executor, without stalling it
+        blocks = asyncio.gather(*[proxy.block() for _ in range(4)])
+        for _ in range(500):
+            if handler.blocked == 4:
+                break
+            await asyncio.sleep(0.01)
+        assert handler.blocked == 4
+        assert await proxy.add(2, 2) == 4
+        handler.released.set()
+        assert threading.main_thread().name not in await blocks
+
+        with pytest.raises(Fault) as info:
+            await proxy.fail()
+        assert info.value.code == 'ServiceException'
+        with pytest.raises(Fault) as info:
+            await proxy.missing()
+        assert info.value.code == 'NoSuchMethodException'
+
+        assert proxy.pool_stats.misses <= 20
+
+    handler = Service()
+    run(test, handler)
+
+def test_versions_overloading_and_compression():
+    async def test(url, service):
+        rows = [{'name': 'row', 'value': i} for i in range(2000)]
+        for version in (1, 2):
+            proxy = AsyncHessianProxy(url, version=version, overload=True, compression='gzip')
+            assert await proxy.add(1.5, 2) == 3.5
+            assert await proxy.add(rows, rows) == rows + rows
+
+    run(test)
+
+def test_sync_clients():
+    def test(url):
+        proxy = HessianProxy(url, chunk_size=4096)
+        assert proxy.add('a' * 10000, 'b') == 'a' * 10000 + 'b'
+        assert proxy.add(1, 2) == 3
+        return proxy.pool_stats.misses
+
+    async def main(url, service):
+        return await asyncio.get_running_loop().run_in_executor(None, test, url)
+
+    # both calls on one kept-alive connection
+    assert run(main) == 1
+
+def test_pending_calls_are_limited():
+    async def test(url, service):
+        proxy = AsyncHessianProxy(url, pool_size=10)
+        await asyncio.gather(*[proxy.wait(0.05) for _ in range(10)])
+
+    handler = Service()
+    run(test, handler, max_pending=3)
+    assert handler.most == 3
+
+def test_request_limits():
+    async def test(url, service):
+        call = encode_object(Call('add', ['x' * 2000, 'y']))
+
+        status, headers, body = await request(url, post(call))
+        assert status == 'HTTP/1.1 200 OK'
+        assert Parser().parse_string(body).value == 'x' * 2000 + 'y'
+
+        status, headers, body = await request(url, post(call + b'x' * 10000))
+        assert status == 'HTTP/1.1 413 Payload Too Large'
+        assert headers['connection'] == 'close'
+
+        # inflated sizes count
+        bomb = compress(b'\x00' * 100000, 'gzip')
+        status, headers, body = await request(url, post(bomb, b'Content-Encoding: gzip'))
+        assert status.endswith('413 Payload Too Large')
+
+        status, headers, body = await request(url, post(call, b'X-Padding: ' + b'p' * 5000))
+        assert status.endswith('431 Request Header Fields Too Large')
+
+        status, headers, body = await request(url, b'GET / HTTP/1.1\r\n\r\n')
+        assert status.endswith('405 Method Not Allowed') and headers['allow'] == 'POST'
+
+        status, headers, body = await request(url, b'POST / HTTP/1.1\r\n\r\n')
+        assert status.endswith('411 Length Required')
+
+        status, headers, body = await request(url, post(b'junk'))
+        assert Parser().parse_string(body).value.code == 'ProtocolException'
+
+        status, headers, body = await request(url, b'POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\n')
+        assert status.endswith('400 Bad Request')
+
+        status, headers, body = await request(url, b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n-5\r\n')
+        assert status.endswith('400 Bad Request')
+
+    run(test, max_request_size=4096, max_header_size=4096)
+
+def test_idle_connections_are_closed():
+    async def test(url, service):
+        host, port = url[7:-1].split(':')
+        reader, writer = await asyncio.open_connection(host, int(port))
+        await asyncio.sleep(0.05)
+        assert service.connections == 1
+
+        assert await asyncio.wait_for(reader.read(), 1) == b''
+        writer.close()
+        return service.connections
+
+    assert run(test, idle_timeout=0.2) == 0
+
+def test_slow_bodies_are_cut_off():
+    async def test(url, service):
+        # a body trickling in is given no longer than an idle connection
+        status, headers, body = await asyncio.wait_for(request(url, b'POST / HTTP/1.1\r\nContent-Length: 100\r\n\r\nc\x01'), 2)
+        assert status.endswith('408 Request Timeout') and headers['connection'] == 'close'
+
+    run(test, idle_timeout=0.2)
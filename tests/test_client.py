@@ -0,0 +1,404 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from struct import unpack
+import os
+import threading
+import time
+
+import pytest
+
+from mustaine.client import HessianProxy
+from mustaine.encoder import encode_object
+from mustaine.pool import header_block
+from mustaine.parser import Parser
+from mustaine._util import InflatingReader, compress
+from mustaine import protocol
+
+# a local stand-in for a Hessian service: every call is answered with the
+# number of requests the server has handled so far
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    close_after = False
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.handled += 1
+
+        body = b'r\x01\x00' + encode_object(self.server.handled) + b'z'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-hessian')
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_after:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+    def read_chunked(self):
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if not size:
+                break
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+        self.rfile.readline()
+        self.server.chunks = len(chunks)
+        return b''.join(chunks)
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+def serve(handler=Handler):
+    server = Server(('127.0.0.1', 0), handler)
+    server.handled = 0
+    server.running = server.most = 0
+    server.lock    = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d/test" % (server.server_address[1],)
+
+
+def test_keepalive_reuses_connection():
+    server, url = serve()
+    try:
+        proxy = HessianProxy(url)
+        assert [proxy.count() for _ in range(5)] == [1, 2, 3, 4, 5]
+        assert proxy.pool_stats.misses == 1
+        assert proxy.pool_stats.hits == 4
+    finally:
+        server.shutdown()
+
+def test_connection_close_is_honoured():
+    class Closing(Handler):
+        close_after = True
+
+    server, url = serve(Closing)
+    try:
+        proxy = HessianProxy(url)
+        assert [proxy.count() for _ in range(3)] == [1, 2, 3]
+        assert proxy.pool_stats.misses == 3
+        assert proxy.pool_stats.hits == 0
+    finally:
+        server.shutdown()
+
+class Reaping(Handler):
+    # drops the connection after replying without announcing it
+    def do_POST(self):
+        Handler.do_POST(self)
+        self.close_connection = True
+
+def test_stale_connections_are_evicted():
+    server, url = serve(Reaping)
+    try:
+        proxy = HessianProxy(url)
+        assert proxy.count() == 1
+        time.sleep(0.1)
+        assert proxy.count() == 2
+        assert proxy.pool_stats.evictions == 1
+        assert proxy.pool_stats.reconnects == 0
+    finally:
+        server.shutdown()
+
+def test_keepalive_with_many_open_files():
+    # connections numbered past select()'s FD_SETSIZE stay reusable
+    resource = pytest.importorskip('resource')
+    if resource.getrlimit(resource.RLIMIT_NOFILE)[0] < 1200:
+        pytest.skip('too few file descriptors allowed')
+
+    server, url = serve()
+    files = [os.open(os.devnull, os.O_RDONLY) for _ in range(1100)]
+    try:
+        proxy = HessianProxy(url)
+        assert [proxy.count() for _ in range(5)] == [1, 2, 3, 4, 5]
+        assert (proxy.pool_stats.hits, proxy.pool_stats.evictions) == (4, 0)
+    finally:
+        for fd in files:
+            os.close(fd)
+        server.shutdown()
+
+def test_reconnects_when_reused_connection_is_dead():
+    server, url = serve(Reaping)
+    try:
+        proxy = HessianProxy(url)
+        proxy._pool._stale = lambda pooled: False
+
+        assert proxy.count() == 1
+        time.sleep(0.1)
+        assert proxy.count() == 2
+        assert proxy.pool_stats.reconnects == 1
+    finally:
+        server.shutdown()
+
+def test_idle_connections_expire():
+    server, url = serve()
+    try:
+        proxy = HessianProxy(url, max_idle=0)
+        proxy.count()
+        proxy.count()
+        assert proxy.pool_stats.hits == 0
+        assert proxy.pool_stats.misses == 2
+    finally:
+        server.shutdown()
+
+def test_pool_is_bounded():
+    server, url = serve()
+    try:
+        proxy = HessianProxy(url, pool_size=1)
+        first, second = proxy._pool.get(), proxy._pool.get()
+        proxy._pool.put(first)
+        proxy._pool.put(second)
+        assert len(proxy._pool._idle) == 1
+    finally:
+        server.shutdown()
+
+class SlowEcho(Handler):
+    # simulates an I/O-bound service: waits, then echoes back the raw
+    # encoding of the call's last (long) argument; the server counts how
+    # many requests were in progress at once
+    def do_POST(self):
+        request = self.rfile.read(int(self.headers['Content-Length']))
+
+        with self.server.lock:
+            self.server.running += 1
+            self.server.most = max(self.server.most, self.server.running)
+        time.sleep(0.01)
+        with self.server.lock:
+            self.server.running -= 1
+
+        body = b'r\x01\x00' + request[-10:-1] + b'z'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def test_shared_proxy_under_thread_pool():
+    from concurrent.futures import ThreadPoolExecutor
+
+    server, url = serve(SlowEcho)
+    try:
+        proxy = HessianProxy(url, pool_size=16)
+        calls = list(range(400))
+
+        assert [proxy.echo(n) for n in calls[:50]] == calls[:50]
+        assert server.most == 1
+
+        with ThreadPoolExecutor(16) as executor:
+            assert list(executor.map(proxy.echo, calls)) == calls
+
+        # the calls of sixteen threads overlap rather than queue up
+        assert server.most >= 8
+        assert proxy.pool_stats.misses <= 16 + 1
+    finally:
+        server.shutdown()
+
+class FaultyEcho(SlowEcho):
+    # as SlowEcho, but negative arguments are answered with a Fault
+    def do_POST(self):
+        request = self.rfile.read(int(self.headers['Content-Length']))
+
+        if unpack('>q', request[-9:-1])[0] >= 0:
+            body = b'r\x01\x00' + request[-10:-1] + b'z'
+        else:
+            fault = {'code': 'ServiceException', 'message': 'negative', 'detail': None}
+            body  = b'r\x01\x00f' + encode_object(fault)[1:] + b'z'
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def test_batch_returns_results_and_faults_in_order():
+    server, url = serve(FaultyEcho)
+    try:
+        proxy   = HessianProxy(url)
+        results = proxy.batch([('echo', (n,)) for n in range(-3, 20)], parallelism=4)
+
+        assert results[3:] == list(range(20))
+        for fault in results[:3]:
+            assert isinstance(fault, protocol.Fault)
+            assert fault.message == 'negative'
+
+        assert proxy.pool_stats.misses <= 4
+        assert proxy.batch([]) == []
+
+        # by default, no more calls at once than the pool keeps connections
+        proxy = HessianProxy(url, pool_size=3)
+        assert proxy.batch([('echo', (n,)) for n in range(30)]) == list(range(30))
+        assert proxy.pool_stats.misses <= 3
+    finally:
+        server.shutdown()
+
+class ChunkedEcho(Handler):
+    # decodes a chunked request body and sends it back as a binary
+    def do_POST(self):
+        assert self.headers['Transfer-Encoding'] == 'chunked'
+
+        body = self.read_chunked()
+        body = b'r\x01\x00' + encode_object(protocol.Binary(body)) + b'z'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def test_streamed_requests():
+    server, url = serve(ChunkedEcho)
+    try:
+        proxy = HessianProxy(url, chunk_size=16384)
+        blob  = protocol.Binary(bytes(range(256)) * 4096)
+        args  = (blob, ['é' * 70000, {'k': 1.5}])
+
+        for overload in (False, True):
+            proxy._overload = overload
+            echoed = proxy.upload(*args).value
+            assert echoed == encode_object(protocol.Call('upload', list(args), overload=overload))
+            assert server.chunks >= len(echoed) // 65536
+    finally:
+        server.shutdown()
+
+class Echo2(Handler):
+    # answers in Hessian 2.0 with the arguments of the call it received
+    def do_POST(self):
+        call = Parser().parse_string(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.method = call.method
+
+        body = b'H\x02\x00R' + encode_object(call.args, version=2)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def test_hessian2_requests_and_replies():
+    server, url = serve(Echo2)
+    try:
+        proxy = HessianProxy(url, version=2, overload=True)
+        args  = [1, 'é' * 100, {'k': [2.5, None]}]
+        assert proxy.echo(*args) == args
+        assert server.method == 'echo_int_string_map'
+    finally:
+        server.shutdown()
+
+class CompressingEcho(Handler):
+    # echoes the arguments of the call it received in a reply compressed as
+    # `coding`, noting how the request was encoded
+    coding = 'gzip'
+
+    def do_POST(self):
+        if self.headers['Transfer-Encoding'] == 'chunked':
+            body = self.read_chunked()
+        else:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+
+        self.server.encodings.append(self.headers['Content-Encoding'])
+        self.server.accepted = self.headers['Accept-Encoding']
+        if self.headers['Content-Encoding']:
+            body = InflatingReader(BytesIO(body)).read()
+
+        call = Parser().parse_string(body)
+        body = b'r\x01\x00' + encode_object(call.args) + b'z'
+        if self.coding:
+            body = compress(body, self.coding)
+        self.server.sent = len(body)
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        if self.coding:
+            self.send_header('Content-Encoding', self.coding)
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve_compressing(coding):
+    class Echo(CompressingEcho):
+        pass
+    Echo.coding = coding
+
+    server, url = serve(Echo)
+    server.encodings = []
+    return server, url
+
+def test_compressed_requests_and_replies():
+    for coding in ('gzip', 'deflate', None):
+        server, url = serve_compressing(coding)
+        try:
+            proxy = HessianProxy(url, compression='gzip', compress_threshold=1000)
+            rows  = [{'name': 'row', 'value': i} for i in range(2000)]
+
+            assert proxy.echo(1) == [1]
+            assert proxy.echo(rows) == [rows]
+            assert server.encodings == [None, 'gzip']
+            assert server.accepted == 'gzip, deflate'
+            if coding:
+                assert server.sent < len(encode_object(rows)) // 10
+
+            # streamed requests are always compressed
+            proxy = HessianProxy(url, compression='deflate', chunk_size=4096)
+            assert proxy.echo(rows) == [rows]
+            assert server.encodings[-1] == 'deflate'
+        finally:
+            server.shutdown()
+
+    # not asked for, not used
+    server, url = serve_compressing(None)
+    try:
+        assert HessianProxy(url).echo('x' * 5000) == ['x' * 5000]
+        assert server.encodings == [None] and 'gzip' not in server.accepted
+    finally:
+        server.shutdown()
+
+class Recording(Handler):
+    # answers with the arguments of the call it received, keeping the
+    # request as it came
+    def do_POST(self):
+        if self.headers['Transfer-Encoding'] == 'chunked':
+            request = self.read_chunked()
+        else:
+            request = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append(request)
+        self.server.user_agent = self.headers['User-Agent']
+
+        body = b'r\x01\x00' + encode_object(Parser().parse_string(request).args) + b'z'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def test_prepared_calls():
+    server, url = serve(Recording)
+    server.requests = []
+    try:
+        args = [1, 'two', {'three': [3.0]}]
+        for version in (1, 2):
+            for overload, types in ((False, ()), (True, ()), (True, ('long' if version == 1 else 'int', 'string', 'map'))):
+                for chunk_size in (None, 4096):
+                    proxy  = HessianProxy(url, version=version, overload=overload, chunk_size=chunk_size)
+                    method = proxy.prepare('echo', *types)
+                    assert method(*args) == method(*args) == args
+                    assert server.requests[-1] == encode_object(protocol.Call('echo', args, overload=overload), version=version)
+
+        assert server.user_agent.startswith('mustaine/')
+
+        proxy = HessianProxy(url, overload=True)
+        with pytest.raises(TypeError):
+            proxy.prepare('echo', 'long')('one')
+        with pytest.raises(TypeError):
+            proxy.prepare('echo', 'long')(1, 2)
+
+        proxy = HessianProxy(url)
+        with pytest.raises(TypeError):
+            proxy.prepare('echo', 'long')
+        assert proxy.prepare('echo', headers={'trace': 'abc'})(1) == [1]
+        assert Parser().parse_string(server.requests[-1]).headers == {'trace': 'abc'}
+    finally:
+        server.shutdown()
+
+def test_header_blocks_are_checked():
+    assert header_block([('User-Agent', 'mustaine'), ('X-Count', 2)]) == b'User-Agent: mustaine\r\nX-Count: 2'
+    assert header_block([]) == b''
+
+    with pytest.raises(ValueError):
+        header_block([('X-Trace', 'a\r\nInjected: 1')])
+    with pytest.raises(ValueError):
+        header_block([('X-Trace:', 'a')])
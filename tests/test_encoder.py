@@ -0,0 +1,267 @@
+from io import BytesIO
+import tracemalloc
+
+import pytest
+
+from mustaine.encoder import Encoder, encode_object
+from mustaine.parser import Parser
+from mustaine._util import ChunkedSink
+from mustaine import protocol
+
+
+def test_encoder_writes_to_file_like_sinks():
+    value = {'a': [1, 'two', 3.0], 'b': protocol.Binary(b'\x00' * 70000)}
+    sink  = BytesIO()
+    assert Encoder(sink).encode(value) == b'map'
+    assert sink.getvalue() == encode_object(value)
+
+def test_encoder_reports_overload_types():
+    call = protocol.Call('f', [1.5, 'x', [1], {}, protocol.Binary(b'')], overload=True)
+    assert b'f_double_string_list_map_binary' in encode_object(call)
+
+def test_call_headers():
+    call = protocol.Call('f', [], headers={'trace': 'abc'})
+    assert encode_object(call) == b'c\x01\x00H\x00\x05traceS\x00\x03abcm\x00\x01fz'
+    assert Parser().parse_string(encode_object(call)).headers == {'trace': 'abc'}
+
+def test_replies_roundtrip():
+    fault = protocol.Fault('ServiceException', 'failed', None)
+    for version in (1, 2):
+        for value in (None, [1, 'two'], fault):
+            reply = Parser().parse_string(encode_object(protocol.Reply(value), version=version))
+            if value is fault:
+                assert (reply.value.code, reply.value.message) == ('ServiceException', 'failed')
+            else:
+                assert reply.value == value
+
+    assert encode_object(protocol.Reply(1, headers={'k': 'v'})) == b'r\x01\x00H\x00\x01kS\x00\x01vL\x00\x00\x00\x00\x00\x00\x00\x01z'
+    with pytest.raises(TypeError):
+        encode_object(protocol.Reply(1, headers={'k': 'v'}), version=2)
+
+class Socket(object):
+    # accepts at most `limit` bytes per sendmsg(), like a congested socket
+    def __init__(self, limit=None, keep=True):
+        self.limit = limit
+        self.keep  = keep
+        self.data  = bytearray()
+
+    def sendmsg(self, buffers):
+        sent = 0
+        for buffer in buffers:
+            if self.limit is not None:
+                buffer = buffer[:self.limit - sent]
+            if self.keep:
+                self.data += buffer
+            sent += len(buffer)
+        return sent
+
+    def sendall(self, data):
+        if self.keep:
+            self.data += data
+
+def test_chunked_sink_bounds_memory():
+    blob = protocol.Binary(b'x' * (8 << 20))
+    sock = Socket(keep=False)
+
+    tracemalloc.start()
+    sink = ChunkedSink(sock, 65536)
+    Encoder(sink).encode(blob)
+    sink.close()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # the 8 MB value is sliced, never copied
+    assert peak < 1 << 20
+
+def test_chunked_sink_roundtrip():
+    value = ['é' * 100000, protocol.Binary(b'y' * 200000), list(range(5000))]
+    sock  = Socket(limit=1000)
+    sink  = ChunkedSink(sock, 4096)
+    Encoder(sink).encode(value)
+    sink.close()
+
+    stream = BytesIO(bytes(sock.data))
+    body   = []
+    while True:
+        size = int(stream.readline(), 16)
+        if not size:
+            break
+        body.append(stream.read(size))
+        assert stream.readline() == b'\r\n'
+
+    assert stream.read() == b'\r\n'
+    decoded = Parser().parse_string(b'r\x01\x00' + b''.join(body) + b'z').value
+    assert decoded[0] == value[0]
+    assert decoded[1].value == value[1].value
+    assert decoded[2] == value[2]
+
+def chunks(encoded):
+    # split a string encoding into (tag, declared length, payload) chunks
+    result, pos = [], 0
+    while pos < len(encoded):
+        tag, length = encoded[pos:pos + 1], int.from_bytes(encoded[pos + 1:pos + 3], 'big')
+        data = encoded[pos + 3:].decode('utf-8', 'ignore')[:length].encode('utf-8')
+        result.append((tag, length, data))
+        pos += 3 + len(data)
+    return result
+
+def test_string_chunk_sizes():
+    for size in (0, 1, 65535, 65536, 3 * 65535 + 7):
+        value = 'x' * size
+        assert [(tag, length) for tag, length, _ in chunks(encode_object(value))] == \
+               [(b's', 65535)] * (max(size - 1, 0) // 65535) + [(b'S', size - max(size - 1, 0) // 65535 * 65535)]
+        assert encode_object(value.encode('utf-8')) == encode_object(value)
+
+def test_utf8_bytes_are_split_on_character_boundaries():
+    for prefix in range(4):
+        value = ('a' * prefix + 'é中\U0001f600' * 40000).encode('utf-8')
+        parts = chunks(encode_object(value))
+
+        assert len(parts) > 1
+        assert b''.join(data for _, _, data in parts) == value
+        for tag, length, data in parts:
+            assert len(data.decode('utf-8')) == length
+            assert len(data) <= 65535
+
+        assert Parser().parse_string(b'r\x01\x00' + encode_object(value) + b'z').value == value.decode('utf-8')
+
+def test_malformed_utf8_bytes_are_refused():
+    for value in (b'a' + b'\x80' * 70000, b'\x80' * 70000):
+        with pytest.raises(UnicodeDecodeError):
+            encode_object(value)
+
+def test_binary_chunk_sizes():
+    for size in (0, 65535, 65536, 200000):
+        value   = protocol.Binary(bytes(range(256)) * (size // 256) + b'!' * (size % 256))
+        decoded = Parser().parse_string(b'r\x01\x00' + encode_object(value) + b'z').value
+        assert decoded.value == value.value
+
+def decode(encoded):
+    return Parser().parse_string(b'r\x01\x00' + encoded + b'z').value
+
+def test_shared_containers_become_references():
+    shared = {'k': list(range(100))}
+    value  = [shared] * 1000
+
+    plain      = encode_object(value)
+    referenced = encode_object(value, references=True)
+    assert len(referenced) * 50 < len(plain)
+
+    decoded = decode(referenced)
+    assert decoded == value
+    assert all(item is decoded[0] for item in decoded)
+
+def test_reference_numbering_matches_parser():
+    a, b = [1], {'x': 2}
+    obj  = protocol.Object('t.T', a=a)
+    value = (a, b, obj, [b, (obj,)], a)
+
+    decoded = decode(encode_object(value, references=True))
+    assert decoded[0] is decoded[4] is decoded[2].a
+    assert decoded[1] is decoded[3][0]
+    assert decoded[2] is decoded[3][1][0]
+
+def test_cyclic_graphs_roundtrip():
+    cons = protocol.Object('com.caucho.hessian.test.TestCons', _first='a', _rest=None)
+    cons._rest = cons
+    loop = []
+    loop.append(loop)
+
+    decoded = decode(encode_object([cons, loop], references=True))
+    assert decoded[0]._rest is decoded[0]
+    assert decoded[1][0] is decoded[1]
+
+def test_references_within_calls():
+    shared = [1, 2]
+    call   = protocol.Call('f', [shared, shared])
+    parsed = Parser().parse_string(encode_object(call, references=True))
+    assert parsed.args[0] is parsed.args[1]
+
+def test_hessian2_compact_encodings():
+    # examples from the Hessian 2.0 serialization spec
+    cases = [(0, b'\x90'), (-16, b'\x80'), (47, b'\xbf'), (-2048, b'\xc0\x00'), (2047, b'\xcf\xff'),
+             (-262144, b'\xd0\x00\x00'), (262143, b'\xd7\xff\xff'), (262144, b'I\x00\x04\x00\x00'),
+             (2 ** 31, b'L\x00\x00\x00\x00\x80\x00\x00\x00'),
+             (0.0, b'\x5b'), (1.0, b'\x5c'), (-128.0, b'\x5d\x80'), (-32768.0, b'\x5e\x80\x00'),
+             (12.25, b'\x5f\x00\x00\x2f\xda'), ('hello', b'\x05hello'), ([0, 1], b'\x7a\x90\x91'),
+             (protocol.Binary(b''), b'\x20'), ({1: 'fee'}, b'H\x91\x03feeZ')]
+    for value, encoded in cases:
+        assert encode_object(value, version=2) == encoded
+
+def test_hessian2_string_and_binary_headers():
+    assert encode_object('x' * 32, version=2)[:2] == b'\x30\x20'
+    assert encode_object('x' * 1024, version=2)[:3] == b'S\x04\x00'
+    assert encode_object(protocol.Binary(b'x' * 16), version=2)[:2] == b'\x34\x10'
+    assert chunks(encode_object('x' * 70000, version=2))[0][:2] == (b'R', 65535)
+
+def test_hessian2_calls():
+    assert encode_object(protocol.Call('add', [1, 2]), version=2) == b'H\x02\x00C\x03add\x92\x91\x92'
+
+    call = protocol.Call('f', [1, 2 ** 40, 'x'], overload=True)
+    assert b'\x11f_int_long_string\x93' in encode_object(call, version=2)
+
+    with pytest.raises(TypeError):
+        encode_object(protocol.Call('f', [], headers={'trace': 'abc'}), version=2)
+
+def test_hessian2_repeated_types_and_references():
+    first, second = protocol.Object('a.T', k=1), protocol.Object('a.T', k=2)
+    encoded = encode_object([first, second, first], references=True, version=2)
+    assert encoded.count(b'a.T') == 1
+
+    decoded = Parser().parse_string(b'H\x02\x00R' + encoded).value
+    assert decoded[0] is decoded[2]
+    assert decoded[1]._meta_type == b'a.T' and decoded[1].k == 2
+
+def test_hessian2_class_definitions_are_written_once():
+    cars = [protocol.Object('example.Car', color='red', model='m%d' % (i,)) for i in range(100)]
+    encoded = encode_object(cars, version=2)
+    assert encoded.count(b'example.Car') == encoded.count(b'color') == 1
+
+    # a second class with the same type but other fields gets its own definition
+    kinds   = [protocol.Object('a.T%d' % (i,), x=i) for i in range(20)] + [protocol.Object('a.T0', y=1)]
+    encoded = encode_object(kinds, version=2)
+    assert encoded.count(b'C') == 21
+    assert encoded.endswith(b'C\x04a.T0\x91\x01yO\xa4\x91')
+
+    decoded = Parser().parse_string(b'H\x02\x00R' + encode_object(cars + kinds, version=2)).value
+    assert [(car._meta_type, car.color, car.model) for car in decoded[:100]] == [(b'example.Car', 'red', 'm%d' % (i,)) for i in range(100)]
+    assert [kind.x for kind in decoded[100:120]] == list(range(20))
+    assert decoded[120].y == 1 and decoded[120]._meta_type == b'a.T0'
+
+def test_arrays_become_typed_lists():
+    from array import array
+
+    assert encode_object(array('d', [1.5])) == b'Vt\x00\x07[doublel\x00\x00\x00\x01D?\xf8' + b'\x00' * 6 + b'z'
+    assert encode_object(array('h', [1, -1])) == b'Vt\x00\x04[intl\x00\x00\x00\x02I\x00\x00\x00\x01I\xff\xff\xff\xffz'
+    assert encode_object(array('b', [1]), version=2) == b'\x71\x04[intI\x00\x00\x00\x01'
+    assert encode_object(array('I', range(8)), version=2)[:8] == b'V\x05[long\x98'
+    assert encode_object([array('i'), array('i')], version=2) == b'\x7a\x70\x04[int\x70\x90'
+
+    values = [array('d', [i * 0.37 for i in range(1000)]), array('f', [0.5, -2.0]),
+              array('i', [-2**31, 2**31 - 1]), array('L', [0, 2**63 - 1]), array('B', [255])]
+    for value in values:
+        for version, envelope in ((1, b'r\x01\x00%sz'), (2, b'H\x02\x00R%s')):
+            decoded = Parser(arrays=True).parse_string(envelope % encode_object(value, version=version)).value
+            assert list(decoded) == list(value)
+
+    # arrays are numbered like any other list
+    shared  = array('q', [1, 2])
+    decoded = decode(encode_object([shared, {'k': 1}, shared, {'k': 1}], references=True))
+    assert decoded[2] is decoded[0] == [1, 2]
+
+    with pytest.raises(TypeError):
+        encode_object(array('u', 'abc'))
+
+    # unsigned 64-bit values that don't fit a long are refused, not wrapped
+    for typecode in ('Q', 'L' if array('L').itemsize == 8 else 'Q'):
+        with pytest.raises(ValueError):
+            encode_object(array(typecode, [1, 2**63]), version=2)
+
+    try:
+        import numpy
+    except ImportError:
+        return
+
+    assert encode_object(numpy.array([1, 2**63 - 1], dtype='uint64')) == encode_object(array('q', [1, 2**63 - 1]))
+    with pytest.raises(ValueError):
+        encode_object(numpy.array([1, 2**63], dtype='uint64'))
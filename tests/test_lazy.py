@@ -0,0 +1,91 @@
+import pytest
+
+from mustaine.encoder import encode_object
+from mustaine.lazy import LazyParser, LazyList, LazyMap
+from mustaine.parser import ParseError
+from mustaine.schema import CompactObject
+from mustaine import protocol
+
+
+ENVELOPES = {1: lambda data: b'r\x01\x00' + data + b'z', 2: lambda data: b'H\x02\x00R' + data}
+
+def lazy(value, version=1, references=False):
+    return LazyParser().parse_string(ENVELOPES[version](encode_object(value, references=references, version=version))).value
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_views_match_eager_decoding(version):
+    value = [{'id': i, 'name': 'é%d' % (i,), 'tags': ['a', 'x' * 70000], 'none': None} for i in range(50)]
+    value.append([protocol.Binary(b'\x00' * 70000), 1.5, 2 ** 40, True, {}, []])
+
+    view = lazy(value, version)
+    assert isinstance(view, LazyList) and isinstance(view[0], LazyMap)
+    assert view == value[:50] + [view[50]]
+    assert view[50][0].value == b'\x00' * 70000
+    assert view[50][1:] == value[50][1:]
+    assert view[-2]['tags'][1] == 'x' * 70000
+
+def test_elements_are_decoded_once_and_only_on_access():
+    data = b'r\x01\x00Vl\x00\x00\x00\x02S\x00\x02okS\x00\x02\xc3\x28zz'
+    view = LazyParser().parse_string(data).value
+
+    # the malformed second string goes unnoticed until it is asked for
+    assert view[0] == 'ok'
+    with pytest.raises(ParseError):
+        view[1]
+
+    maps = lazy([{'k': [1]}])
+    assert maps[0] is maps[0]
+    assert maps[0]['k'] is maps[0]['k']
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_references_into_undecoded_regions(version):
+    shared = {'k': [1, 2]}
+    obj    = protocol.Object('a.T', x=shared, y='s')
+    loop   = []
+    loop.append(loop)
+
+    view = lazy([shared, [shared], obj, loop, {1: [obj]}], version, references=True)
+
+    # reach the back-references before what they point at has been decoded
+    assert view[4][1][0] is view[2]
+    assert view[2].x is view[1][0] is view[0]
+    assert view[3][0] is view[3]
+    assert view[2]._meta_type == b'a.T' and view[2].y == 's'
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_parser_options(version):
+    # each payload's parser is built with the options of the one it was given to
+    value = [protocol.Object('test.lazy.Box', items=[1, 2])] * 2
+    view  = LazyParser(compact=True).parse_string(ENVELOPES[version](encode_object(value, references=True, version=version))).value
+    assert isinstance(view[0], CompactObject) and view[0] is view[1]
+    assert list(view[0].items) == [1, 2]
+
+    with pytest.raises(TypeError):
+        LazyParser(arrays=True)
+
+def test_calls_headers_and_faults():
+    call = LazyParser().parse_string(encode_object(protocol.Call('f', [[1], {'a': 2}])))
+    assert call.method == 'f' and call.args == [[1], {'a': 2}]
+
+    call = LazyParser().parse_string(encode_object(protocol.Call('f', [protocol.Object('a.T', v=[1])] * 2), version=2))
+    assert [arg.v for arg in call.args] == [[1], [1]]
+
+    fault = LazyParser().parse_string(b'H\x02\x00FH\x04code\x03Bad\x07message\x04oopsZ').value
+    assert fault.message == 'oops'
+
+def test_strings_next_to_continuation_like_bytes():
+    # a Hessian 2.0 compact int may follow a string ending in a multi-byte character
+    value = ['éa', 1, 'é', 'a\U0001f600', 2]
+    assert list(lazy(value, 2)) == value
+
+def test_truncated_payloads():
+    data = ENVELOPES[1](encode_object([1, {'k': 'é中'}, [2.5]]))
+    for end in range(3, len(data) - 1):
+        with pytest.raises(ParseError):
+            LazyParser().parse_string(data[:end])
+
+def test_streams_are_refused():
+    from io import BytesIO
+
+    with pytest.raises(TypeError):
+        LazyParser().parse_stream(BytesIO(b'r\x01\x00Nz'))
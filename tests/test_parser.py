@@ -0,0 +1,406 @@
+from io import BytesIO
+import datetime
+
+import pytest
+
+from mustaine.encoder import encode_object
+from mustaine.parser import Parser, ParseError
+from mustaine import protocol
+
+
+def reply(encoded):
+    return b'r\x01\x00' + encoded + b'z'
+
+def parse(data):
+    # both parser engines must agree on every payload
+    from_buffer = Parser().parse_string(data).value
+    from_stream = Parser().parse_stream(BytesIO(data)).value
+
+    if not isinstance(from_buffer, (protocol.Object, protocol.Binary)):
+        assert from_buffer == from_stream
+    return from_buffer
+
+def roundtrip(value):
+    return parse(reply(encode_object(value)))
+
+def test_scalars():
+    assert roundtrip(None) is None
+    assert roundtrip(True) is True
+    assert roundtrip(False) is False
+    assert roundtrip(-0x80000001) == -0x80000001
+    assert roundtrip(3.14159) == 3.14159
+    assert parse(reply(b'I\xff\xff\xff\xfe')) == -2
+
+def test_date():
+    value = datetime.datetime(1998, 5, 8, 7, 51)
+    assert roundtrip(value) == value
+
+def test_nested_containers():
+    value = {'a': [1, 2.5, None, {'b': [True, False]}], 'c': 'text'}
+    assert roundtrip(value) == value
+    assert roundtrip((1, 2)) == [1, 2]
+
+def test_typed_map():
+    value = roundtrip(protocol.Object('com.caucho.hessian.test.TestObject', _value=7))
+    assert value._meta_type == b'com.caucho.hessian.test.TestObject'
+    assert value._value == 7
+
+def test_references():
+    value = parse(reply(b'Vl\x00\x00\x00\x02Mz' + b'R\x00\x00\x00\x01z'))
+    assert value[0] is value[1]
+
+def test_chunked_binary():
+    value = roundtrip(protocol.Binary(b'\x00\xff' * 40000))
+    assert value.value == b'\x00\xff' * 40000
+
+def test_unknown_tag():
+    with pytest.raises(ParseError):
+        parse(reply(b'Q'))
+
+def test_truncated_stream():
+    data = reply(encode_object([1, 'é中', 2.5]))
+    for end in range(len(data)):
+        with pytest.raises(ParseError):
+            parse(data[:end])
+
+def test_empty_binary():
+    assert roundtrip(protocol.Binary(b'')).value == b''
+
+def test_ascii_string():
+    assert roundtrip('') == ''
+    assert roundtrip('0123456789' * 100) == '0123456789' * 100
+
+def test_multi_byte_strings():
+    for value in ['é', 'café', '中文字', 'été 中 xÿ']:
+        assert roundtrip(value) == value
+
+def test_four_byte_strings():
+    for value in ['\U0001f600', 'a\U0001f600', '\U0001f600\U0001f601z', 'é\U00010348中']:
+        assert roundtrip(value) == value
+
+def test_long_chunked_string():
+    value = ('xé中\U0001f600' * 40000)
+    assert roundtrip(value) == value
+
+def test_string_lead_bytes_at_range_edges():
+    # U+007F, U+07FF, U+FFFF and U+10FFFF sit on the lead byte boundaries
+    value = '\x7f\u0080߿ࠀ￿\U00010000\U0010ffff'
+    assert roundtrip(value) == value
+
+def test_malformed_string():
+    with pytest.raises(ParseError):
+        parse(reply(b'S\x00\x02\xff\xfe'))
+
+def test_engines_agree_on_nested_payload():
+    value = [{'id': i, 'name': 'é%d' % (i,), 'tags': ['a', '中'], 'x': i / 3.0} for i in range(500)]
+    assert roundtrip(value) == value
+
+def test_parse_string_accepts_buffers():
+    data = reply(encode_object(['a', 1]))
+    assert Parser().parse_string(bytearray(data)).value == ['a', 1]
+    assert Parser().parse_string(memoryview(data)).value == ['a', 1]
+
+def test_chunk_reassembly_does_not_recurse():
+    import sys
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(100)
+    try:
+        binary = protocol.Binary(b'\x01' * (65535 * 200 + 3))
+        string = 'é' * (65535 * 200 + 3)
+        assert roundtrip(binary).value == binary.value
+        assert roundtrip(string) == string
+    finally:
+        sys.setrecursionlimit(limit)
+
+def test_mismatched_chunk_tags():
+    with pytest.raises(ParseError):
+        parse(reply(b's\x00\x01aB\x00\x01a'))
+    with pytest.raises(ParseError):
+        parse(reply(b'b\x00\x01aS\x00\x01a'))
+
+def reply2(encoded):
+    return b'H\x02\x00R' + encoded
+
+def roundtrip2(value):
+    return parse(reply2(encode_object(value, version=2)))
+
+def test_hessian2_compact_numbers():
+    # examples from the Hessian 2.0 serialization spec
+    assert parse(reply2(b'\x90')) == 0
+    assert parse(reply2(b'\x80')) == -16
+    assert parse(reply2(b'\xbf')) == 47
+    assert parse(reply2(b'\xc0\x00')) == -2048
+    assert parse(reply2(b'\xcf\xff')) == 2047
+    assert parse(reply2(b'\xd0\x00\x00')) == -262144
+    assert parse(reply2(b'\xd7\xff\xff')) == 262143
+    assert parse(reply2(b'\xd8')) == -8
+    assert parse(reply2(b'\xf0\x00')) == -2048
+    assert parse(reply2(b'\x38\x00\x00')) == -262144
+    assert parse(reply2(b'Y\x80\x00\x00\x00')) == -0x80000000
+    assert parse(reply2(b'\x5b')) == 0.0
+    assert parse(reply2(b'\x5d\x80')) == -128.0
+    assert parse(reply2(b'\x5e\x80\x00')) == -32768.0
+    assert parse(reply2(b'\x5f\x00\x00\x2f\xda')) == 12.25
+
+def test_hessian2_dates():
+    value = datetime.datetime.fromtimestamp(894621091)
+    assert parse(reply2(b'J\x00\x00\x00\xd0\x4b\x92\x84\xb8')) == value
+    assert parse(reply2(b'K\x00\xe3\x83\x8f')) == value.replace(second=0)
+
+def test_hessian2_containers():
+    assert parse(reply2(b'\x72\x04[int\x90\x91')) == [0, 1]
+    assert parse(reply2(b'W\x90\x91Z')) == [0, 1]
+    assert parse(reply2(b'H\x91\x03fee\xa0\x03fie\xc9\x00\x03foeZ')) == {1: 'fee', 16: 'fie', 256: 'foe'}
+
+def test_hessian2_class_definitions():
+    cars = Parser().parse_string(reply2(b'\x7a'
+                        b'C\x0bexample.Car\x92\x05color\x05model'
+                        b'O\x90\x03red\x08corvette'
+                        b'\x60\x05green\x05civic')).value
+
+    assert [car._meta_type for car in cars] == [b'example.Car'] * 2
+    assert [(car.color, car.model) for car in cars] == [('red', 'corvette'), ('green', 'civic')]
+
+def test_hessian2_references_and_types():
+    value = Parser().parse_string(reply2(b'\x7aM\x05a.Map\x01k\x90ZM\x90Z')).value
+    assert value[0]._meta_type == value[1]._meta_type == b'a.Map'
+
+    value = parse(reply2(b'\x7aH\x01k\x90ZQ\x91'))
+    assert value[1] is value[0]
+
+    value = Parser().parse_string(reply2(b'\x79Q\x90')).value
+    assert value[0] is value
+
+def test_hessian2_roundtrip():
+    values = [None, True, -17, 2047, 262144, 2 ** 40, -0.0, 1.5, 0.001, 1e300, 1e306, 1.7e308, -1.7e308, '',
+              'é' * 1023, 'x中' * 40000, [], list(range(10)), {'a': [{}]}]
+    for value in values:
+        assert roundtrip2(value) == value
+
+    for size in (0, 15, 16, 1023, 1024, 65536, 200000):
+        assert roundtrip2(protocol.Binary(b'\xab' * size)).value == b'\xab' * size
+
+def test_hessian2_calls_and_faults():
+    call = Parser().parse_string(encode_object(protocol.Call('add', [1, 'x']), version=2))
+    assert (call.method, call.args) == ('add', [1, 'x'])
+
+    fault = Parser().parse_string(b'H\x02\x00FH\x04code\x03Bad\x07message\x04oopsZ').value
+    assert (fault.code, fault.message, fault.detail) == ('Bad', 'oops', None)
+
+def test_hessian2_strings_before_compact_ints():
+    # 0x80-0xbf bytes after a string are values, not continuation bytes
+    value = ['éa', 1, 'é', 'a\U0001f600', 2]
+    assert roundtrip2(value) == value
+
+def test_hessian2_in_version_one_envelope():
+    assert parse(b'r\x02\x00\x79\x5cz') == [1.0]
+
+    # a map there starts with 'H', which must not be taken for a header
+    data = b'r\x02\x00' + encode_object({'a': [1]}, version=2) + b'z'
+    assert parse(data) == {'a': [1]}
+    assert [event for event, _ in Parser().iterparse(data)] == [
+        'start_reply', 'start_map', 'key', 'start_list', 'value', 'end_list', 'end_map', 'end_reply']
+
+    # ...nor 'z', a list of two, for the end
+    data = b'r\x02\x00' + encode_object([1, 2], version=2) + b'z'
+    assert parse(data) == [1, 2]
+    assert [event for event, _ in Parser().iterparse(data)] == [
+        'start_reply', 'start_list', 'value', 'value', 'end_list', 'end_reply']
+    with pytest.raises(ParseError):
+        parse(b'r\x02\x00\x91\x92z')
+
+    # calls there can't be told apart from their arguments, and are refused
+    data = b'c\x02\x00m\x00\x04echo' + encode_object([1, 2], version=2) + b'z'
+    with pytest.raises(ParseError):
+        Parser().parse_string(data)
+    with pytest.raises(ParseError):
+        list(Parser().iterparse(data))
+
+def test_hessian2_truncated_stream():
+    data = reply2(encode_object([1, 'é中', protocol.Binary(b'ab'), 2.5, {'k': None}], version=2))
+    for end in range(len(data)):
+        with pytest.raises(ParseError):
+            parse(data[:end])
+
+def build(events):
+    # reassemble iterparse events into values, resolving references by number
+    values, refs, stack = [], [], []
+
+    def add(value):
+        if not stack:
+            values.append(value)
+        elif isinstance(stack[-1][0], list):
+            stack[-1][0].append(value)
+        else:
+            stack[-1][0][stack[-1][1]] = value
+
+    for event, value in events:
+        if event in ('start_list', 'start_map'):
+            container = [] if event == 'start_list' else {}
+            add(container)
+            refs.append(container)
+            stack.append([container, None])
+        elif event == 'key':
+            stack[-1][1] = value
+        elif event in ('end_list', 'end_map'):
+            stack.pop()
+        elif event == 'value':
+            add(value)
+        elif event == 'ref':
+            add(refs[value])
+
+    return values
+
+def test_iterparse_events():
+    data   = reply(encode_object({'a': [1, protocol.Object('t.T', x=None)]}))
+    events = list(Parser().iterparse(data))
+
+    assert events == [('start_reply', None), ('start_map', None), ('key', 'a'), ('start_list', None),
+                      ('value', 1), ('start_map', 't.T'), ('key', 'x'), ('value', None), ('end_map', None),
+                      ('end_list', None), ('end_map', None), ('end_reply', None)]
+    assert list(Parser().iterparse(BytesIO(data))) == events
+
+    cars = encode_object([protocol.Object('example.Car', color='red')] * 2, version=2)
+    assert list(Parser().iterparse(reply2(cars)))[1:-1] == [('start_list', None),
+        ('start_map', 'example.Car'), ('key', 'color'), ('value', 'red'), ('end_map', None),
+        ('start_map', 'example.Car'), ('key', 'color'), ('value', 'red'), ('end_map', None),
+        ('end_list', None)]
+
+def test_iterparse_calls_and_faults():
+    call = protocol.Call('f', [1, [2]], headers={'trace': 'abc'})
+    assert list(Parser().iterparse(encode_object(call))) == [('start_call', None), ('header', 'trace'),
+        ('value', 'abc'), ('method', 'f'), ('value', 1), ('start_list', None), ('value', 2),
+        ('end_list', None), ('end_call', None)]
+    assert list(Parser().iterparse(encode_object(protocol.Call('f', [1]), version=2))) == [
+        ('start_call', None), ('method', 'f'), ('value', 1), ('end_call', None)]
+
+    events = list(Parser().iterparse(b'r\x01\x00fS\x00\x04codeS\x00\x03BadS\x00\x07messageS\x00\x04oopszz'))
+    assert events[1][0] == 'fault' and events[1][1].message == 'oops'
+
+def test_iterparse_rebuilds_what_parse_returns():
+    shared = {'k': ['é' * 70000, protocol.Binary(b'\x01' * 70000)]}
+    loop   = []
+    loop.append(loop)
+    value  = [shared, [shared, (1, 2.5)], shared, loop, {}, list(range(20))]
+
+    for version, envelope in ((1, reply), (2, reply2)):
+        data  = envelope(encode_object(value, references=True, version=version))
+        built = build(Parser().iterparse(data))[0]
+
+        assert built[0] is built[1][0] is built[2]
+        assert built[3][0] is built[3]
+        assert built[0]['k'][0] == 'é' * 70000
+        assert built[0]['k'][1].value == b'\x01' * 70000
+        assert built[1][1] == [1, 2.5] and built[5] == list(range(20))
+
+def test_iterparse_runs_in_constant_memory():
+    import tracemalloc
+
+    class Generated(object):
+        # a reply holding a list of 200,000 ints, produced as it is read
+        def __init__(self):
+            self.pending = bytearray(b'r\x01\x00Vl\x00\x03\x0d\x40')
+            self.items   = iter(range(200000))
+
+        def read(self, n):
+            while len(self.pending) < n:
+                batch = [b'I' + i.to_bytes(4, 'big') for _, i in zip(range(1000), self.items)]
+                self.pending += b''.join(batch) if batch else b'zz'
+
+            data = bytes(self.pending[:n])
+            del self.pending[:n]
+            return data
+
+    tracemalloc.start()
+    try:
+        total = sum(value for event, value in Parser().iterparse(Generated()) if event == 'value')
+        peak  = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert total == sum(range(200000))
+    assert peak < 1 << 20
+
+def test_iterparse_errors():
+    data = reply(encode_object([1, {'k': 'é中'}]))
+    for end in range(len(data)):
+        with pytest.raises(ParseError):
+            list(Parser().iterparse(data[:end]))
+
+    # keys are decoded whole, and cannot refer to containers being streamed
+    with pytest.raises(ParseError, match='streaming'):
+        list(Parser().iterparse(reply(b'MVl\x00\x00\x00\x01R\x00\x00\x00\x00zNz')))
+
+def parse_arrays(data):
+    # as parse(), through every input, each returning arrays where it can
+    from mustaine._util import BufferedReader
+
+    results = [
+        Parser(arrays=True).parse_string(data).value,
+        Parser(arrays=True).parse_stream(BytesIO(data)).value,
+        Parser(arrays=True).parse_stream(BufferedReader(BytesIO(data), buffer_size=37)).value,
+    ]
+    for result in results[1:]:
+        assert type(result) is type(results[0])
+        assert list(result) == list(results[0])
+    return results[0]
+
+def test_numeric_lists_as_arrays(monkeypatch):
+    from array import array
+    from struct import pack
+    from mustaine import parser
+    monkeypatch.setattr(parser, 'numpy', None)
+
+    doubles = [i * 0.37 - 3 for i in range(1000)]
+    for value, typecode, tag in ((doubles, 'd', b'D'), ([1, -2, 3], 'i', b'I'), ([2**40, -1], 'q', b'L')):
+        values = b''.join(tag + pack('>' + typecode, n) for n in value)
+
+        # untyped, fixed-length and typed lists, in both versions
+        for data in (reply(b'V' + values + b'z'),
+                     reply2(b'W' + values + b'Z'),
+                     reply2(b'X' + encode_object(len(value), version=2) + values),
+                     reply2(b'V\x07[double' + encode_object(len(value), version=2) + values)):
+            result = parse_arrays(data)
+            assert isinstance(result, array) and result.typecode == typecode
+            assert result.tolist() == value
+
+    # lists that merely start with a run stay lists
+    assert parse_arrays(reply(encode_object([1.5, 2.5, 'x', 3.5]))) == [1.5, 2.5, 'x', 3.5]
+    assert parse_arrays(reply(encode_object([1, 2.5]))) == [1, 2.5]
+    assert parse_arrays(reply2(b'\x7bD?\xf8\x00\x00\x00\x00\x00\x00\x91\x92')) == [1.5, 1, 2]
+    assert parse_arrays(reply(encode_object([]))) == []
+
+    # references resolve to the array
+    data   = reply(b'M' + b'S\x00\x01a' + b'V' + b'I\x00\x00\x00\x07' * 2 + b'z' + b'S\x00\x01b' + b'R\x00\x00\x00\x01' + b'z')
+    result = Parser(arrays=True).parse_string(data).value
+    assert result['b'] is result['a'] and result['a'].tolist() == [7, 7]
+
+def test_numeric_arrays_truncated():
+    for data in (reply(encode_object([1.5, 2.5]))[:-6], reply2(b'\x7aI\x00\x00\x00\x01I\x00')):
+        with pytest.raises(ParseError):
+            Parser(arrays=True).parse_string(data)
+        with pytest.raises(ParseError):
+            Parser(arrays=True).parse_stream(BytesIO(data))
+
+def test_keys_and_type_names_are_shared():
+    value = [{'key': i, 'k' * 200: i} for i in range(3)] + [protocol.Object('a.T', x=1)] * 2
+
+    for version in (1, 2):
+        envelope = reply if version == 1 else reply2
+        decoded  = Parser().parse_string(envelope(encode_object(value, version=version))).value
+        keys     = [list(map_) for map_ in decoded[:3]]
+        assert keys[0][0] is keys[1][0] is keys[2][0]
+        assert keys[0][1] is not keys[1][1]
+        assert decoded[3]._meta_type is decoded[4]._meta_type
+
+        unshared = Parser(cache_size=0).parse_string(envelope(encode_object(value, version=version))).value
+        assert list(unshared[0])[0] is not list(unshared[1])[0]
+
+def test_key_cache_is_bounded():
+    parser = Parser(cache_size=16)
+    for i in range(10):
+        parser.parse_string(reply(encode_object(dict(('key%d' % (n,), n) for n in range(i * 10, i * 10 + 10)))))
+        assert len(parser._interned) <= 16
+
+    assert 'key99' in parser._interned and 'key0' not in parser._interned
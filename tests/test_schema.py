@@ -0,0 +1,170 @@
+import dataclasses
+import pickle
+
+import pytest
+
+from mustaine.encoder import WRITERS, WRITERS2, encode_object
+from mustaine.lazy import LazyParser
+from mustaine.parser import Parser
+from mustaine.schema import COMPACT, CompactObject, register
+from mustaine import schema
+from mustaine import protocol
+
+
+@register('test.schema.Car')
+@dataclasses.dataclass
+class Car(object):
+    color: str
+    model: str
+    mileage: int = 0
+
+@register('test.schema.Point')
+class Point(object):
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+    def __eq__(self, other):
+        return (self.x, self.y) == (other.x, other.y)
+
+@register(b'test.schema.Node', fields=['value', 'next'])
+class Node(object):
+    pass
+
+ENVELOPES = {1: (b'r\x01\x00', b'z'), 2: (b'H\x02\x00R', b'')}
+
+def roundtrip(value, version, references=False, parser=Parser):
+    head, tail = ENVELOPES[version]
+    return parser().parse_string(head + encode_object(value, references=references, version=version) + tail).value
+
+def test_registered_classes_roundtrip():
+    value = [Car('red', 'corvette'), Point(1.5, [Point(0, 0)]), Car('green', 'civic', 10)]
+    for version in (1, 2):
+        for parser in (Parser, LazyParser):
+            decoded = roundtrip(value, version, parser=parser)
+            assert decoded[0] == value[0] and decoded[2] == value[2]
+            assert decoded[1].x == 1.5 and list(decoded[1].y) == [Point(0, 0)]
+
+def test_registered_classes_match_objects_on_the_wire():
+    car    = Car('red', 'corvette', 3)
+    object = protocol.Object('test.schema.Car', color='red', model='corvette', mileage=3)
+    for version in (1, 2):
+        assert encode_object(car, version=version) == encode_object(object, version=version)
+
+    # definitions are shared between the two
+    encoded = encode_object([car, object], version=2)
+    assert encoded.count(b'test.schema.Car') == 1
+
+def test_unknown_fields_are_dropped():
+    object  = protocol.Object('test.schema.Point', y=2, z=3, x=1)
+    for version in (1, 2):
+        decoded = roundtrip(object, version)
+        assert type(decoded) is Point and decoded == Point(1, 2)
+        assert not hasattr(decoded, 'z')
+
+def test_registered_references():
+    node = Node()
+    node.value, node.next = 1, None
+    node.next = node
+
+    for version in (1, 2):
+        decoded = roundtrip([node, node], version, references=True)
+        assert decoded[0] is decoded[1] is decoded[0].next
+        assert decoded[0].value == 1
+
+@register('test.schema.Pair', fields=['pair'])
+class Pair(object):
+    def __init__(self, n):
+        self.n = n
+
+    @property
+    def pair(self):
+        return [self.n, self.n + 1]
+
+    @pair.setter
+    def pair(self, value):
+        self.n = value[0]
+
+def test_references_to_temporary_fields():
+    # lists made on the fly by a property are never taken for one another
+    for version in (1, 2):
+        decoded = roundtrip([Pair(i) for i in range(5)], version, references=True)
+        assert [item.pair for item in decoded] == [[i, i + 1] for i in range(5)]
+
+def test_overload_names_and_pickling():
+    call = protocol.Call('drive', [Car('red', 'm')], overload=True)
+    assert b'drive_Car' in encode_object(call)
+    assert pickle.loads(pickle.dumps(roundtrip(Car('red', 'm'), 2))) == Car('red', 'm')
+
+def test_classes_need_fields():
+    with pytest.raises(TypeError):
+        register('test.schema.Empty')(type('Empty', (object,), {}))
+
+def compact(value, version, references=False):
+    head, tail = ENVELOPES[version]
+    return Parser(compact=True).parse_string(head + encode_object(value, references=references, version=version) + tail).value
+
+def test_compact_objects():
+    value = [protocol.Object('test.compact.Car', color='red', model='m%d' % (i,)) for i in range(3)]
+    value.append(protocol.Object('test.compact.Car', color='blue'))
+
+    for version in (1, 2):
+        decoded = compact(value, version)
+        assert all(isinstance(car, CompactObject) and not hasattr(car, '__dict__') for car in decoded)
+        assert type(decoded[0]) is type(decoded[2]) is not type(decoded[3])
+        assert decoded[2]._meta_type == b'test.compact.Car'
+        assert (decoded[2].color, decoded[2].model, decoded[3].color) == ('red', 'm2', 'blue')
+        assert repr(decoded[0]).startswith("<b'test.compact.Car' object at")
+
+        # written back exactly as the Objects were, and pickled as they would be
+        assert encode_object(decoded, version=version) == encode_object(value, version=version)
+        objects = roundtrip(value, version)
+        assert [car.__getstate__() for car in decoded] == [car.__getstate__() for car in objects]
+        unpickled = pickle.loads(pickle.dumps(decoded))
+        assert [car.__getstate__() for car in unpickled] == [car.__getstate__() for car in objects]
+        assert type(unpickled[0]) is type(decoded[0])
+
+def test_compact_references():
+    cons = protocol.Object('test.compact.Cons', first=1, rest=None)
+    cons.rest = cons
+    outer = protocol.Object('test.compact.Box', item=protocol.Object('test.compact.Box', item=None))
+
+    for version in (1, 2):
+        decoded = compact([cons, outer, outer.item, cons], version, references=True)
+        assert decoded[0] is decoded[0].rest is decoded[3]
+        assert decoded[2] is decoded[1].item and isinstance(decoded[2], CompactObject)
+
+    # a typed map that refers to itself was handed out as an Object already
+    assert type(compact(cons, 1, references=True)) is protocol.Object
+    assert isinstance(compact(cons, 2, references=True), CompactObject)
+
+def test_compact_fallbacks():
+    # field names that can't be slots keep Objects; registered classes win
+    for fields in ({'not valid': 1}, {'_meta_type': 1}, {'class': 1}, {'__private': 1}):
+        assert type(compact(protocol.Object('test.compact.Odd', **fields), 2)) is protocol.Object
+
+    assert type(compact(protocol.Object('test.schema.Point', x=1, y=2), 1)) is Point
+
+def test_compact_maps():
+    # untyped maps stay dicts, typed ones become compact objects
+    for version in (1, 2):
+        assert compact({'a': 1, 'b': [2]}, version) == {'a': 1, 'b': [2]}
+
+    typed = Parser(compact=True).parse_string(b'H\x02\x00RM\x10test.compact.Map\x01a\x91Z').value
+    assert isinstance(typed, CompactObject) and typed._meta_type == b'test.compact.Map' and typed.a == 1
+
+def test_compact_classes_are_bounded(monkeypatch):
+    # endless new types make no more classes than the cache holds, and
+    # leave the writer registries alone
+    monkeypatch.setattr(schema, 'COMPACT_SIZE', 8)
+    writers = len(WRITERS), len(WRITERS2)
+
+    for i in range(50):
+        value   = protocol.Object('test.compact.Many%d' % (i,), n=i)
+        decoded = compact(value, 2)
+        assert isinstance(decoded, CompactObject)
+        assert compact(decoded, 1).n == i
+
+    assert len(COMPACT) <= 8
+    assert (len(WRITERS), len(WRITERS2)) == writers
@@ -0,0 +1,184 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import threading
+
+import pytest
+
+from mustaine.client import HessianProxy
+from mustaine.encoder import encode_object
+from mustaine.parser import Parser
+from mustaine.protocol import Call, Fault, Reply
+from mustaine.server import HessianServer, make_server
+from mustaine._util import compress
+
+class Calculator(object):
+    def add(self, a, b):
+        return a + b
+
+    def echo(self, value):
+        return value
+
+    def fail(self, message):
+        raise ValueError(message)
+
+    def refuse(self):
+        raise Fault('AccessDenied', 'not today', None)
+
+    def _hidden(self):
+        return 'secret'
+
+def serve(handler=None, **options):
+    server = make_server(handler or Calculator(), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d/calculator" % (server.server_address[1],)
+
+def post(app, body, **environ):
+    # calls `app` as a WSGI server would, returning (status, headers, body)
+    environ.setdefault('REQUEST_METHOD', 'POST')
+    environ.setdefault('CONTENT_LENGTH', str(len(body)))
+    environ['wsgi.input'] = BytesIO(body)
+
+    response = []
+    def start_response(status, headers):
+        response.extend((status, dict(headers)))
+
+    body = b''.join(app(environ, start_response))
+    return response[0], response[1], body
+
+
+def test_calls_over_http():
+    server, url = serve()
+    try:
+        for version in (1, 2):
+            for overload in (False, True):
+                proxy = HessianProxy(url, version=version, overload=overload)
+                assert proxy.add(2, 3) == 5
+                assert proxy.add('a', 'b') == 'ab'
+                assert proxy.echo({'k': [1.5, None]}) == {'k': [1.5, None]}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_faults():
+    server, url = serve()
+    try:
+        proxy = HessianProxy(url)
+        for method, args, code in (('fail', ('bad',), 'ServiceException'),
+                                   ('refuse', (), 'AccessDenied'),
+                                   ('missing', (), 'NoSuchMethodException'),
+                                   ('_hidden', (), 'NoSuchMethodException')):
+            with pytest.raises(Fault) as info:
+                proxy(method, args)
+            assert info.value.code == code
+
+        assert 'bad' in pytest.raises(Fault, proxy.fail, 'bad').value.message
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_method_resolution():
+    app = HessianServer(Calculator())
+    add = Calculator.add
+
+    assert app.resolve('add', 2).__func__ is add
+    assert app.resolve('add_int_int', 2).__func__ is add
+    assert app.resolve('add_string_map', 2).__func__ is add
+    assert app.resolve('add__2', 2).__func__ is add
+    assert app.resolve('add__3', 2) is None
+    assert app.resolve('add_int', 2) is None
+    assert app.resolve('add_Car_[double', 2).__func__ is add
+
+    # only type names are taken for overload suffixes
+    assert app.resolve('echo_everything', 1) is None
+    assert app.resolve('add_int_everything', 2) is None
+    assert app.resolve('_hidden', 0) is None
+    assert app.resolve('__init__', 0) is None
+
+def test_concurrent_calls():
+    server, url = serve(threads=8)
+    try:
+        proxy = HessianProxy(url, pool_size=8)
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda n: proxy.add(n, n), range(200)))
+        assert results == [n + n for n in range(200)]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_compression():
+    server, url = serve(compress_threshold=1000)
+    try:
+        rows = [{'name': 'row', 'value': i} for i in range(2000)]
+        for coding in ('gzip', 'deflate'):
+            proxy = HessianProxy(url, compression=coding, compress_threshold=1000)
+            assert proxy.echo(rows) == rows
+            assert proxy.add(1, 2) == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    app = HessianServer(Calculator(), compress_threshold=1000)
+    call = encode_object(Call('echo', ['x' * 5000]))
+    status, headers, body = post(app, call, HTTP_ACCEPT_ENCODING='deflate;q=1.0, br')
+    assert headers['Content-Encoding'] == 'deflate'
+    assert int(headers['Content-Length']) == len(body) < 1000
+
+    status, headers, body = post(app, call)
+    assert 'Content-Encoding' not in headers
+    assert Parser().parse_string(body).value == 'x' * 5000
+
+def test_call_headers_and_replies():
+    app  = HessianServer(Calculator())
+    call = encode_object(Call('add', [1, 2], headers={'transaction': 'T1'}))
+
+    status, headers, body = post(app, call)
+    assert status == '200 OK'
+    assert headers['Content-Type'] == 'application/x-hessian'
+    assert body == encode_object(Reply(3))
+
+    status, headers, body = post(app, encode_object(Call('add', [1, 2]), version=2))
+    assert body == encode_object(Reply(3), version=2)
+
+def test_bad_requests():
+    app = HessianServer(Calculator())
+
+    status, headers, body = post(app, b'', REQUEST_METHOD='GET')
+    assert status.startswith('405') and headers['Allow'] == 'POST'
+
+    status, headers, body = post(app, b'c\x01\x00', CONTENT_LENGTH='')
+    assert status.startswith('411')
+
+    for request in (b'c\x01\x00m\x00\x03ad', b'junk', encode_object(Reply(1)), b''):
+        status, headers, body = post(app, request)
+        reply = Parser().parse_string(body)
+        assert status == '200 OK'
+        assert reply.value.code == 'ProtocolException'
+
+def test_request_limits():
+    app  = HessianServer(Calculator(), max_request_size=4096)
+    call = encode_object(Call('echo', ['x' * 2000]))
+
+    status, headers, body = post(app, compress(call, 'gzip'), HTTP_CONTENT_ENCODING='gzip')
+    assert Parser().parse_string(body).value == 'x' * 2000
+
+    status, headers, body = post(app, call + b'x' * 10000)
+    assert status.startswith('413')
+
+    # inflated sizes count
+    status, headers, body = post(app, compress(b'\x00' * 100000, 'gzip'), HTTP_CONTENT_ENCODING='gzip')
+    assert status.startswith('413')
+
+    status, headers, body = post(app, call + b'x' * 10000, CONTENT_LENGTH='', **{'wsgi.input_terminated': True})
+    assert status.startswith('413')
+
+    for length in ('-1', 'x'):
+        status, headers, body = post(app, call, CONTENT_LENGTH=length)
+        assert status.startswith('400')
+
+def test_unencodable_results():
+    class Odd(object):
+        def get(self):
+            return object()
+
+    status, headers, body = post(HessianServer(Odd()), encode_object(Call('get', [])))
+    assert Parser().parse_string(body).value.code == 'ServiceException'
@@ -0,0 +1,110 @@
+from io import BytesIO
+import zlib
+
+import pytest
+
+from mustaine._util import BufferedReader, CompressingSink, InflatingReader, compress, utf8_length
+from mustaine.encoder import encode_object
+from mustaine.parser import Parser
+
+
+class Trickle(object):
+    # hands out at most three bytes per call, and counts what it gave away
+    def __init__(self, data):
+        self.data = BytesIO(data)
+        self.consumed = 0
+
+    def read(self, n):
+        chunk = self.data.read(min(n, 3))
+        self.consumed += len(chunk)
+        return chunk
+
+def test_reads_across_refills():
+    reader = BufferedReader(BytesIO(bytes(range(256)) * 4), buffer_size=10)
+    assert reader.read(3) == bytes(range(3))
+    assert reader.read(10) == bytes(range(3, 13))
+    assert reader.read(100) == bytes(range(13, 113))
+    assert reader.read(143) == bytes(range(113, 256))
+
+def test_short_input_raises():
+    reader = BufferedReader(BytesIO(b'abc'), buffer_size=10)
+    assert reader.read(2) == b'ab'
+    with pytest.raises(EOFError):
+        reader.read(2)
+
+def test_inputs_without_readinto():
+    reader = BufferedReader(Trickle(b'0123456789'), buffer_size=4)
+    assert reader.read(4) == b'0123'
+    assert reader.read(6) == b'456789'
+
+def test_known_length_is_never_overrun():
+    source = Trickle(b'hessian-body' + b'next-response')
+    reader = BufferedReader(source, buffer_size=64, length=12)
+    assert reader.read(12) == b'hessian-body'
+    assert source.consumed == 12
+    with pytest.raises(EOFError):
+        reader.read(1)
+
+def test_peek_does_not_consume():
+    reader = BufferedReader(BytesIO(b'abcdef'), buffer_size=4)
+    assert bytes(reader.peek(2)[:2]) == b'ab'
+    assert reader.read(3) == b'abc'
+    assert bytes(reader.peek(3)) == b'def'
+    assert reader.read(3) == b'def'
+    assert len(reader.peek()) == 0
+
+def test_readinto():
+    reader = BufferedReader(BytesIO(b'0123456789'), buffer_size=4)
+    assert reader.read(1) == b'0'
+
+    target = bytearray(6)
+    assert reader.readinto(target) == 6
+    assert target == b'123456'
+
+    target = bytearray(6)
+    assert reader.readinto(target) == 3
+    assert target[:3] == b'789'
+
+def test_parser_over_tiny_buffer():
+    value = {'key': ['é中\U0001f600' * 50, 1.5, list(range(20))]}
+    data  = b'r\x01\x00' + encode_object(value) + b'z'
+
+    for size in (1, 2, 3, 7, 64):
+        reader = BufferedReader(Trickle(data), buffer_size=size, length=len(data))
+        assert Parser().parse_stream(reader).value == value
+
+def test_utf8_length():
+    assert utf8_length(b'') == 0
+    assert utf8_length(b'abc') == 3
+    assert utf8_length('é中\U0001f600x'.encode('utf-8')) == 4
+
+def test_inflating_reader():
+    data = bytes(range(256)) * 4000
+    raw  = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    for compressed in (compress(data, 'gzip'), compress(data, 'deflate'), raw.compress(data) + raw.flush()):
+        assert InflatingReader(Trickle(compressed)).read() == data
+
+        # reads never inflate more than was asked for
+        reader = InflatingReader(BytesIO(compressed))
+        assert len(reader.read(10)) == 10 and reader.read(5) == data[10:15]
+
+    # a truncated stream just ends early
+    truncated = InflatingReader(BytesIO(compress(data, 'gzip')[:100])).read()
+    assert len(truncated) < len(data) and data.startswith(truncated)
+    with pytest.raises(zlib.error):
+        InflatingReader(BytesIO(b'\x1f\x8b' + b'\xff' * 50)).read()
+
+def test_compressing_sink_and_parser():
+    class Sink(BytesIO):
+        def close(self):
+            pass
+
+    value = {'rows': [{'name': 'row', 'value': i} for i in range(1000)]}
+    sink   = Sink()
+    writer = CompressingSink(sink, 'gzip')
+    writer.write(b'r\x01\x00' + encode_object(value) + b'z')
+    writer.close()
+
+    reader = BufferedReader(InflatingReader(BytesIO(sink.getvalue())), buffer_size=100)
+    assert Parser().parse_stream(reader).value == value